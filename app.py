@@ -1,59 +1,373 @@
 import re
 import sys
 import json
+import sqlite3
 import requests
-import datetime
-from datetime import timezone
 import logging
+import datetime
+import threading
 import webbrowser
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLineEdit, QTextEdit, QListWidget, QLabel, 
                              QInputDialog, QMessageBox, QDialog, QDialogButtonBox, QFormLayout,
-                             QComboBox, QListWidgetItem, QTreeWidget, QTreeWidgetItem, QSplitter)
-from PyQt5.QtCore import Qt, QRegExp, QTimer
-from PyQt5.QtGui import QColor, QTextCharFormat, QFont, QSyntaxHighlighter, QPalette, QTextCursor
+                             QComboBox, QListWidgetItem, QTreeWidget, QTreeWidgetItem, QSplitter,
+                             QCheckBox, QSpinBox, QDoubleSpinBox, QProgressDialog, QAbstractItemView,
+                             QListView, QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog, QShortcut,
+                             QPlainTextEdit, QPlainTextDocumentLayout)
+from PyQt5.QtCore import (Qt, QRegExp, QTimer, QObject, QRunnable, QThreadPool, pyqtSignal, QPoint,
+                          QAbstractListModel, QModelIndex, QSortFilterProxyModel)
+from PyQt5.QtGui import (QColor, QTextCharFormat, QFont, QSyntaxHighlighter, QPalette, QTextCursor, QKeySequence,
+                         QTextDocument, QTextLayout)
+from collections import OrderedDict
+
+from pyatlib.models import Action
+from pyatlib.store import ActionStore
+from pyatlib.cache import CompletionCache
+from pyatlib.categories import CategoryIndex
+from pyatlib.search import SearchIndex
+from pyatlib.snapshot import IndexSnapshot, snapshot_path, source_stamp, write_snapshot
+from pyatlib.similarity import SimilarityIndex
+from pyatlib.validation import CODE_FIELDS, SnippetValidator, check_source
+from pyatlib.settings import Settings
+from pyatlib.yandexgpt import CodeFormatter
+from pyatlib.completion import BACKENDS
+from pyatlib.batch import BatchGenerator
+from pyatlib.transfer import Importer, export_actions
+from pyatlib.testexport import TestPackageExporter
+from pyatlib.remote import RemoteLibrary, RemoteImporter, LibrarySync, SyncLoop
+from pyatlib.watch import LibraryWatcher
+from pyatlib.persistence import WriteBehindQueue, action_snapshot
+from pyatlib.history import ActionHistory, UndoStack, FIELDS, KIND_LABELS, diff_states
+from pyatlib.metrics import metrics
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def utf16_offsets(text):
+    # QSyntaxHighlighter.setFormat принимает позиции в UTF-16 code units
+    if text.isascii():
+        return None
+    offsets = [0]
+    position = 0
+    for char in text:
+        position += 2 if ord(char) > 0xFFFF else 1
+        offsets.append(position)
+    return offsets if position != len(text) else None
+
 class PythonHighlighter(QSyntaxHighlighter):
+    KEYWORDS = ('def', 'class', 'if', 'else', 'elif', 'for', 'while', 'try', 'except', 'finally',
+                'return', 'import', 'from', 'as', 'pass')
+
+    # Все правила объединены в одно выражение и компилируются один раз
+    TOKEN_RE = re.compile(r"""
+        (?P<comment>\#.*)
+      | (?P<triple>(?<!\w)[rRbBuUfF]{0,2}(?:\'\'\'|\"\"\"))
+      | (?P<string>(?<!\w)[rRbBuUfF]{0,2}(?:"(?:[^"\\]|\\.)*(?:"|\\?$)|'(?:[^'\\]|\\.)*(?:'|\\?$)))
+      | (?P<keyword>\b(?:""" + '|'.join(KEYWORDS) + r""")\b)
+      | (?P<qt_class>\bQ[A-Za-z]+\b)
+    """, re.VERBOSE)
+
+    NORMAL = -1
+    IN_SINGLE_TRIPLE = 1
+    IN_DOUBLE_TRIPLE = 2
+    DELIMITERS = {IN_SINGLE_TRIPLE: "'''", IN_DOUBLE_TRIPLE: '"""'}
+    STATES = {delimiter: state for state, delimiter in DELIMITERS.items()}
+
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.formats = self.create_formats()
+        self.offsets = None
 
+    @staticmethod
+    def create_formats():
         keyword_format = QTextCharFormat()
         keyword_format.setForeground(QColor("#569CD6"))
         keyword_format.setFontWeight(QFont.Bold)
 
-        keyword_patterns = ["\\bdef\\b", "\\bclass\\b", "\\bif\\b", "\\belse\\b", "\\belif\\b",
-                            "\\bfor\\b", "\\bwhile\\b", "\\btry\\b", "\\bexcept\\b", "\\bfinally\\b",
-                            "\\breturn\\b", "\\bimport\\b", "\\bfrom\\b", "\\bas\\b", "\\bpass\\b"]
-
-        self.highlightingRules = [(QRegExp(pattern), keyword_format)
-                                  for pattern in keyword_patterns]
-
         class_format = QTextCharFormat()
         class_format.setFontWeight(QFont.Bold)
         class_format.setForeground(QColor("#4EC9B0"))
-        self.highlightingRules.append((QRegExp("\\bQ[A-Za-z]+\\b"),
-                                       class_format))
 
         string_format = QTextCharFormat()
         string_format.setForeground(QColor("#CE9178"))
-        self.highlightingRules.append((QRegExp("\".*\""), string_format))
-        self.highlightingRules.append((QRegExp("'.*'"), string_format))
 
         comment_format = QTextCharFormat()
         comment_format.setForeground(QColor("#6A9955"))
-        self.highlightingRules.append((QRegExp("#[^\n]*"), comment_format))
+
+        return {
+            'keyword': keyword_format,
+            'qt_class': class_format,
+            'string': string_format,
+            'triple': string_format,
+            'comment': comment_format
+        }
+
+    @classmethod
+    def tokens(cls, text, state):
+        # Разбор одной строки: [(начало, конец, вид)] в позициях Python и состояние для следующей
+        # строки - незакрытая многострочная строка или NORMAL
+        spans = []
+        position = 0
+        if state in cls.DELIMITERS:
+            end = text.find(cls.DELIMITERS[state])
+            if end < 0:
+                return [(0, len(text), 'triple')], state
+            position = end + 3
+            spans.append((0, position, 'triple'))
+
+        while True:
+            match = cls.TOKEN_RE.search(text, position)
+            if match is None:
+                return spans, cls.NORMAL
+            kind = match.lastgroup
+            if kind == 'triple':
+                state = cls.STATES[match.group()[-3:]]
+                end = text.find(cls.DELIMITERS[state], match.end())
+                if end < 0:
+                    spans.append((match.start(), len(text), 'triple'))
+                    return spans, state
+                position = end + 3
+                spans.append((match.start(), position, 'triple'))
+            else:
+                spans.append((match.start(), match.end(), kind))
+                position = match.end()
+
+    @classmethod
+    def next_state(cls, text, state):
+        # Состояние после строки; без тройных кавычек оно не меняется и разбор не нужен
+        if "'''" not in text and '"""' not in text:
+            return state if state in cls.DELIMITERS else cls.NORMAL
+        return cls.tokens(text, state)[1]
+
+    def apply_format(self, start, end, format):
+        if self.offsets is not None:
+            start, end = self.offsets[start], self.offsets[end]
+        self.setFormat(start, end - start, format)
+
+    def highlightBlock(self, text):
+        # Состояние блока хранит незакрытую многострочную строку; Qt сам перекрашивает
+        # следующие блоки только если состояние изменилось
+        self.offsets = utf16_offsets(text)
+        spans, state = self.tokens(text, self.previousBlockState())
+        for start, end, kind in spans:
+            self.apply_format(start, end, self.formats[kind])
+        self.setCurrentBlockState(state)
+
+class CodeDocument(QTextDocument):
+    # Документ для просмотра кода: разметка QPlainTextEdit размечает только видимые блоки.
+    # states - состояния разбора после первых блоков, formatted - номера подсвеченных блоков
+    def __init__(self, text, font, parent=None):
+        super().__init__(parent)
+        self.setDocumentLayout(QPlainTextDocumentLayout(self))
+        self.setDefaultFont(font)
+        self.setPlainText(text)
+        self.states = []
+        self.formatted = set()
+        self.scroll = 0
+
+class ViewportHighlighter(QObject):
+    # Подсветка без QSyntaxHighlighter, который при смене текста проходит весь документ:
+    # форматы получают только видимые блоки и LOOKAHEAD блоков ниже. Блоки выше видимой
+    # области при переходе в конец только разбираются ради состояния многострочных строк.
+    # Форматы хранятся в разметке блоков документа, поэтому документ из кэша показывается
+    # снова без повторной подсветки
+    LOOKAHEAD = 100
+
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+        self.document = None
+        self.formats = PythonHighlighter.create_formats()
+        editor.updateRequest.connect(self.highlight_visible)
+
+    def set_document(self, document):
+        self.document = document
+        self.highlight_visible()
+
+    def format_ranges(self, text, spans):
+        offsets = utf16_offsets(text)
+        ranges = []
+        for start, end, kind in spans:
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            format_range = QTextLayout.FormatRange()
+            format_range.start = start
+            format_range.length = end - start
+            format_range.format = self.formats[kind]
+            ranges.append(format_range)
+        return ranges
+
+    def highlight_visible(self, *args):
+        document = self.document
+        if document is None or not document.blockCount():
+            return
+        viewport = self.editor.viewport()
+        top = self.editor.cursorForPosition(QPoint(0, 0)).blockNumber()
+        bottom = self.editor.cursorForPosition(QPoint(0, viewport.height())).blockNumber()
+        if all(number in document.formatted for number in range(top, bottom + 1)):
+            return
+        states = document.states
+        with metrics.span('highlight_viewport'):
+            if len(states) < top:
+                state = states[-1] if states else PythonHighlighter.NORMAL
+                for text in document.toPlainText().split('\n')[len(states):top]:
+                    state = PythonHighlighter.next_state(text, state)
+                    states.append(state)
+            last = min(bottom + self.LOOKAHEAD, document.blockCount() - 1)
+            block = document.findBlockByNumber(top)
+            state = states[top - 1] if top else PythonHighlighter.NORMAL
+            dirty_start = dirty_end = None
+            for number in range(top, last + 1):
+                if number in document.formatted:
+                    state = states[number]
+                else:
+                    text = block.text()
+                    spans, state = PythonHighlighter.tokens(text, state)
+                    if number == len(states):
+                        states.append(state)
+                    block.layout().setFormats(self.format_ranges(text, spans))
+                    document.formatted.add(number)
+                    if dirty_start is None:
+                        dirty_start = block.position()
+                    dirty_end = block.position() + block.length()
+                block = block.next()
+            if dirty_start is not None:
+                document.markContentsDirty(dirty_start, dirty_end - dirty_start)
+
+class ActionDetailsView(QWidget):
+    # Карточка действия по разделам. Документы с кодом строятся один раз на действие и
+    # хранятся для CACHE_SIZE последних просмотренных, поэтому возврат к действию - только
+    # смена документа в редакторе; раздел сгенерированного кода заполняется, когда он не пуст
+    CACHE_SIZE = 32
+    ERROR_LABELS = {'code': "код", 'generated_code': "сгенерированный код"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.name_label = QLabel()
+        self.name_label.setWordWrap(True)
+        self.name_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        font = self.name_label.font()
+        font.setBold(True)
+        font.setPointSize(font.pointSize() + 2)
+        self.name_label.setFont(font)
+        self.category_label = QLabel()
+        self.category_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.description_label = QLabel()
+        self.description_label.setWordWrap(True)
+        self.description_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.errors_label = QLabel()
+        self.errors_label.setWordWrap(True)
+        self.errors_label.setStyleSheet("color: #F44747;")
+        self.errors_label.setVisible(False)
+        layout.addWidget(self.name_label)
+        layout.addWidget(self.category_label)
+        layout.addWidget(self.description_label)
+        layout.addWidget(self.errors_label)
+
+        self.sections = QSplitter(Qt.Vertical)
+        self.code_view, self.code_highlighter = self.add_section("Код:")
+        self.generated_view, self.generated_highlighter = self.add_section("Сгенерированный код:")
+        self.generated_section = self.sections.widget(1)
+        layout.addWidget(self.sections, 1)
+
+        self.empty_document = CodeDocument("", self.code_view.font(), self)
+        self.cache = OrderedDict()
+        self.clear()
+
+    def add_section(self, title):
+        section = QWidget()
+        section_layout = QVBoxLayout(section)
+        section_layout.setContentsMargins(0, 0, 0, 0)
+        section_layout.addWidget(QLabel(title))
+        view = QPlainTextEdit()
+        view.setReadOnly(True)
+        view.setLineWrapMode(QPlainTextEdit.NoWrap)
+        section_layout.addWidget(view)
+        self.sections.addWidget(section)
+        return view, ViewportHighlighter(view)
+
+    def clear(self):
+        self.remember_scroll()
+        for label in (self.name_label, self.category_label, self.description_label, self.errors_label):
+            label.clear()
+        self.errors_label.setVisible(False)
+        self.generated_section.setVisible(True)
+        self.show_document(self.code_view, self.code_highlighter, self.empty_document)
+        self.show_document(self.generated_view, self.generated_highlighter, self.empty_document)
+
+    def release(self, entry):
+        # Документ удаляется из цикла событий, когда редактор уже переключён на новый
+        for document in entry[1]:
+            if document is not self.empty_document:
+                document.deleteLater()
+
+    def documents_for(self, action):
+        # Запись кэша сверяется с текстом действия, поэтому правки не требуют явного сброса
+        code, generated_code = action.code, action.generated_code
+        entry = self.cache.get(action.id)
+        if entry is not None and entry[0] == (code, generated_code):
+            self.cache.move_to_end(action.id)
+            return entry[1]
+        if entry is not None:
+            self.release(entry)
+        with metrics.span('render_action_details'):
+            font = self.code_view.font()
+            documents = (CodeDocument(code, font, self),
+                         CodeDocument(generated_code, font, self) if generated_code else self.empty_document)
+        self.cache[action.id] = ((code, generated_code), documents)
+        self.cache.move_to_end(action.id)
+        while len(self.cache) > self.CACHE_SIZE:
+            _, old = self.cache.popitem(last=False)
+            self.release(old)
+        return documents
+
+    def remember_scroll(self):
+        for view in (self.code_view, self.generated_view):
+            document = view.document()
+            if isinstance(document, CodeDocument):
+                document.scroll = view.verticalScrollBar().value()
+
+    def show_document(self, view, highlighter, document):
+        if view.document() is not document:
+            view.setDocument(document)
+        view.verticalScrollBar().setValue(document.scroll)
+        highlighter.set_document(document)
+
+    def show_action(self, action, errors=None):
+        if action is None:
+            self.clear()
+            return
+        self.remember_scroll()
+        code_document, generated_document = self.documents_for(action)
+        self.name_label.setText(action.name)
+        self.category_label.setText(f"Категория: {action.category}")
+        self.description_label.setText(action.description)
+        self.description_label.setVisible(bool(action.description))
+        self.errors_label.setText("\n".join(f"⚠️ Синтаксическая ошибка ({self.ERROR_LABELS[field]}): {error}"
+                                            for field, error in (errors or {}).items()))
+        self.errors_label.setVisible(bool(errors))
+        self.show_document(self.code_view, self.code_highlighter, code_document)
+        self.generated_section.setVisible(generated_document is not self.empty_document)
+        self.show_document(self.generated_view, self.generated_highlighter, generated_document)
+
+class DiffHighlighter(QSyntaxHighlighter):
+    COLORS = {'+': "#6A9955", '-': "#F44747", '@': "#569CD6"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.formats = {}
+        for prefix, color in self.COLORS.items():
+            text_format = QTextCharFormat()
+            text_format.setForeground(QColor(color))
+            self.formats[prefix] = text_format
 
     def highlightBlock(self, text):
-        for pattern, format in self.highlightingRules:
-            expression = QRegExp(pattern)
-            index = expression.indexIn(text)
-            while index >= 0:
-                length = expression.matchedLength()
-                self.setFormat(index, length, format)
-                index = expression.indexIn(text, index + length)
+        text_format = self.formats.get(text[:1])
+        if text_format is not None:
+            self.setFormat(0, len(text), text_format)
 
 class PlainTextEdit(QTextEdit):
     def insertFromMimeData(self, source):
@@ -69,56 +383,18 @@ class PlainLineEdit(QLineEdit):
         else:
             super().insertFromMimeData(source)
 
-class Settings:
-    def __init__(self):
-        self.oauth_token = ""
-        self.iam_token = ""
-        self.iam_token_expires = datetime.datetime.now(timezone.utc)
-        self.system_prompt = "Ты должен писать только код. И ничего больше. \nТы используешь PyTest, Python в написании кода.\nА так же используешь Chrome в качестве основного браузера. \nВ конце ничего так же не требуется писать."
-    
-    def save(self):
-        with open('settings.json', 'w') as f:
-            json.dump({
-                'oauth_token': self.oauth_token,
-                'iam_token': self.iam_token,
-                'iam_token_expires': self.iam_token_expires.isoformat(),
-                'system_prompt': self.system_prompt
-            }, f)
-    
-    def load(self):
-        try:
-            with open('settings.json', 'r') as f:
-                data = json.load(f)
-                self.oauth_token = data.get('oauth_token', "")
-                self.iam_token = data.get('iam_token', "")
-                self.iam_token_expires = datetime.datetime.fromisoformat(data.get('iam_token_expires', datetime.datetime.now(timezone.utc).isoformat()))
-                self.system_prompt = data.get('system_prompt', self.system_prompt)
-        except FileNotFoundError:
-            pass
-
-    def get_iam_token(self):
-        if datetime.datetime.now(timezone.utc) >= self.iam_token_expires:
-            self.refresh_iam_token()
-        return self.iam_token
+class TokenRefreshNotifier(QObject):
+    failed = pyqtSignal(str)
 
-    def refresh_iam_token(self):
-        url = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
-        payload = {"yandexPassportOauthToken": self.oauth_token}
-        try:
-            response = requests.post(url, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            logging.info(f"Received data: {data}")
-            self.iam_token = data['iamToken']
-            if isinstance(data['expiresAt'], str):
-                expires_at = datetime.datetime.fromisoformat(data['expiresAt'].replace('Z', '+00:00'))
-            else:
-                expires_at = datetime.datetime.fromtimestamp(data['expiresAt'], tz=timezone.utc)
-            self.iam_token_expires = expires_at
-            self.save()
-        except Exception as e:
-            logging.error(f"Error refreshing IAM token: {str(e)}")
-            raise
+class WriteBehindNotifier(QObject):
+    state = pyqtSignal(int, bool)
+    flushed = pyqtSignal(object)
+    conflict = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+class LibrarySyncNotifier(QObject):
+    changes = pyqtSignal(object)
+    failed = pyqtSignal(str)
 
 class SettingsDialog(QDialog):
     def __init__(self, settings, parent=None):
@@ -136,6 +412,45 @@ class SettingsDialog(QDialog):
         self.layout.addRow(self.get_oauth_button)
         self.layout.addRow("System Prompt:", self.system_prompt_input)
 
+        self.batch_concurrency_input = QSpinBox()
+        self.batch_concurrency_input.setRange(1, 64)
+        self.batch_concurrency_input.setValue(self.settings.batch_concurrency)
+        self.batch_rate_input = QDoubleSpinBox()
+        self.batch_rate_input.setRange(0.1, 100.0)
+        self.batch_rate_input.setValue(self.settings.batch_requests_per_second)
+        self.layout.addRow("Параллельных запросов:", self.batch_concurrency_input)
+        self.layout.addRow("Запросов в секунду:", self.batch_rate_input)
+
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItems(sorted(BACKENDS))
+        self.backend_combo.setCurrentText(self.settings.backend)
+        self.completion_url_input = QLineEdit(self.settings.completion_url)
+        self.completion_url_input.setPlaceholderText("пусто - адрес Yandex Cloud")
+        self.iam_url_input = QLineEdit(self.settings.iam_url)
+        self.iam_url_input.setPlaceholderText("пусто - адрес Yandex Cloud")
+        self.model_uri_input = QLineEdit(self.settings.model_uri)
+        self.model_uri_input.setPlaceholderText("пусто - модель по умолчанию")
+        self.layout.addRow("Генерация кода:", self.backend_combo)
+        self.layout.addRow("Адрес генерации:", self.completion_url_input)
+        self.layout.addRow("Адрес IAM:", self.iam_url_input)
+        self.layout.addRow("Модель (modelUri):", self.model_uri_input)
+
+        self.server_url_input = QLineEdit(self.settings.server_url)
+        self.server_url_input.setPlaceholderText("http://127.0.0.1:8765 - пусто для локальной библиотеки")
+        self.server_token_input = QLineEdit(self.settings.server_token)
+        self.server_token_input.setEchoMode(QLineEdit.Password)
+        self.layout.addRow("Сервер библиотеки:", self.server_url_input)
+        self.layout.addRow("Токен сервера:", self.server_token_input)
+
+        self.history_revisions_input = QSpinBox()
+        self.history_revisions_input.setRange(1, 1000)
+        self.history_revisions_input.setValue(self.settings.history_max_revisions)
+        self.history_days_input = QSpinBox()
+        self.history_days_input.setRange(1, 3650)
+        self.history_days_input.setValue(self.settings.history_max_days)
+        self.layout.addRow("Ревизий на действие:", self.history_revisions_input)
+        self.layout.addRow("Хранить историю, дней:", self.history_days_input)
+
         self.buttons = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
             Qt.Horizontal, self)
@@ -147,27 +462,268 @@ class SettingsDialog(QDialog):
     def accept(self):
         self.settings.oauth_token = self.oauth_token_input.text()
         self.settings.system_prompt = self.system_prompt_input.toPlainText()
+        self.settings.batch_concurrency = self.batch_concurrency_input.value()
+        self.settings.batch_requests_per_second = self.batch_rate_input.value()
+        self.settings.backend = self.backend_combo.currentText()
+        self.settings.completion_url = self.completion_url_input.text().strip()
+        self.settings.iam_url = self.iam_url_input.text().strip()
+        self.settings.model_uri = self.model_uri_input.text().strip()
+        self.settings.server_url = self.server_url_input.text().strip()
+        self.settings.server_token = self.server_token_input.text().strip()
+        self.settings.history_max_revisions = self.history_revisions_input.value()
+        self.settings.history_max_days = self.history_days_input.value()
         self.settings.save()
         super().accept()
 
     def open_oauth_page(self):
         webbrowser.open("https://yandex.cloud/ru/docs/iam/operations/iam-token/create#:~:text=%D1%8D%D1%82%D0%BE%D0%B3%D0%BE%20%D0%BF%D0%B5%D1%80%D0%B5%D0%B9%D0%B4%D0%B8%D1%82%D0%B5%20%D0%BF%D0%BE-,%D1%81%D1%81%D1%8B%D0%BB%D0%BA%D0%B5,-%2C%20%D0%BD%D0%B0%D0%B6%D0%BC%D0%B8%D1%82%D0%B5%20%D0%A0%D0%B0%D0%B7%D1%80%D0%B5%D1%88%D0%B8%D1%82%D1%8C%20%D0%B8")
 
-class Action:
-    def __init__(self, name, description, code, category=None, generated_code=None):
-        self.name = name
-        self.description = description
-        self.code = code
-        self.category = category if category is not None else "Без категории"
-        self.generated_code = generated_code if generated_code is not None else ""
+class SearchWorkerSignals(QObject):
+    finished = pyqtSignal(int, object)
+
+class SearchWorker(QRunnable):
+    def __init__(self, index, query, generation, current_generation):
+        super().__init__()
+        self.index = index
+        self.query = query
+        self.generation = generation
+        self.current_generation = current_generation
+        self.signals = SearchWorkerSignals()
+
+    def is_cancelled(self):
+        return self.current_generation() != self.generation
+
+    def run(self):
+        if self.is_cancelled():
+            return
+        results = self.index.search(self.query, self.is_cancelled)
+        if results is not None and not self.is_cancelled():
+            self.signals.finished.emit(self.generation, results)
+
+class SimilarityBuildWorker(QRunnable):
+    def __init__(self, index, store):
+        super().__init__()
+        self.index = index
+        self.store = store
+
+    def run(self):
+        try:
+            self.index.build(self.store.iter_search_rows())
+        except sqlite3.DatabaseError as e:
+            logging.error(f"Failed to build similarity index: {e}")
+
+class IndexSnapshotWorker(QRunnable):
+    # Сохраняет индексы снимком для следующего запуска. После полной перезагрузки сначала
+    # собирает поисковый индекс, после догонки снимка выгружает уже восстановленный
+    def __init__(self, index, generation, store, source, actions, build=False):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.store = store
+        self.source = source
+        self.build = build
+        self.ids = [action.id for action in actions]
+        self.names = [action.name for action in actions]
+        self.categories = [action.category for action in actions]
+
+    def run(self):
+        try:
+            if self.build and not self.index.extend(self.store.iter_search_rows(), self.generation):
+                return
+            write_snapshot(snapshot_path(self.store), self.source, self.ids, self.names, self.categories,
+                           self.index, self.generation)
+        except sqlite3.DatabaseError as e:
+            logging.error(f"Failed to build search index: {e}")
+        except OSError as e:
+            logging.error(f"Failed to write index snapshot: {e}")
+
+class HistoryCompactWorker(QRunnable):
+    def __init__(self, history, max_revisions, max_days):
+        super().__init__()
+        self.history = history
+        self.max_revisions = max_revisions
+        self.max_days = max_days
+
+    def run(self):
+        try:
+            self.history.compact(self.max_revisions, self.max_days)
+        except sqlite3.DatabaseError as e:
+            logging.error(f"History compaction failed: {e}")
+
+class ValidationWorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    checked = pyqtSignal(object, object)
+
+class ValidationWorker(QRunnable):
+    # Без rows проверяется вся библиотека; rows - (id, code, generated_code) отдельных действий,
+    # они возвращаются в checked вместе с результатом
+    def __init__(self, validator, rows=None):
+        super().__init__()
+        self.signals = ValidationWorkerSignals()
+        self.validator = validator
+        self.rows = rows
+
+    def run(self):
+        try:
+            if self.rows is None:
+                self.signals.finished.emit(self.validator.run())
+            else:
+                self.signals.checked.emit(self.rows, self.validator.validate_rows(self.rows)[0])
+        except sqlite3.DatabaseError as e:
+            logging.error(f"Snippet validation failed: {e}")
+            if self.rows is not None:
+                # Кэш проверок недоступен: фрагменты разбираются без него, ответа ждёт диалог действия
+                broken = {}
+                for action_id, *sources in self.rows:
+                    errors = {field: error for field, error in zip(CODE_FIELDS, map(check_source, sources)) if error}
+                    if errors:
+                        broken[action_id] = errors
+                self.signals.checked.emit(self.rows, broken)
+
+def qt_length(text):
+    # Позиции QTextCursor считаются в UTF-16 code units
+    return len(text.encode('utf-16-le')) // 2
+
+class GenerationWorkerSignals(QObject):
+    chunk = pyqtSignal(str)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str, str, bool)
+
+class GenerationWorker(QRunnable):
+    def __init__(self, backend, system_prompt, user_code):
+        super().__init__()
+        self.backend = backend
+        self.system_prompt = system_prompt
+        self.user_code = user_code
+        self.cancelled = threading.Event()
+        self.signals = GenerationWorkerSignals()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            text = ""
+            with metrics.span('generate_code'):
+                for text in self.backend.stream(self.system_prompt, self.user_code, cancelled=self.cancelled):
+                    self.signals.chunk.emit(text)
+
+            if not self.cancelled.is_set():
+                self.signals.finished.emit(text)
+        except requests.RequestException as e:
+            if not self.cancelled.is_set():
+                self.signals.failed.emit("Ошибка API", f"Не удалось получить ответ от API: {str(e)}", False)
+        except (KeyError, IndexError, ValueError) as e:
+            self.signals.failed.emit("Ошибка данных", f"Не удалось извлечь сгенерированный код из ответа API: {str(e)}", False)
+        except Exception as e:
+            self.signals.failed.emit("Непредвиденная ошибка", f"Произошла непредвиденная ошибка: {str(e)}", True)
+
+class BatchGenerationWorkerSignals(QObject):
+    prepared = pyqtSignal(int)
+    progress = pyqtSignal(int, int, int)
+    results = pyqtSignal(object)
+    finished = pyqtSignal(int, int, int)
+
+class BatchGenerationWorker(QRunnable):
+    def __init__(self, store, action_ids, pending_codes, system_prompt, backend, concurrency=8,
+                 requests_per_second=5.0, cache=None):
+        super().__init__()
+        self.signals = BatchGenerationWorkerSignals()
+        self.store = store
+        self.action_ids = action_ids
+        # Несохранённые правки ещё не в базе, их код берётся из памяти
+        self.pending_codes = pending_codes
+        self.generator = BatchGenerator([], system_prompt, backend, concurrency, requests_per_second, cache,
+                                        on_progress=self.signals.progress.emit,
+                                        on_results=self.signals.results.emit)
+
+    def cancel(self):
+        self.generator.cancel()
+
+    def run(self):
+        try:
+            # Код действий читается из базы здесь, а не в потоке интерфейса
+            codes = self.store.load_codes(self.action_ids)
+            codes.update(self.pending_codes)
+            self.generator.jobs = [(action_id, codes[action_id]) for action_id in self.action_ids
+                                   if codes.get(action_id, "").strip()]
+            self.signals.prepared.emit(len(self.generator.jobs))
+            if self.generator.jobs:
+                self.generator.run()
+        finally:
+            self.signals.finished.emit(self.generator.done, self.generator.failed, self.generator.skipped)
+
+class TransferWorkerSignals(QObject):
+    progress = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+class ImportWorker(QRunnable):
+    def __init__(self, store, path, conflict, remote=None):
+        super().__init__()
+        self.signals = TransferWorkerSignals()
+        self.path = path
+        if remote is not None:
+            self.importer = RemoteImporter(remote, conflict, on_progress=self.signals.progress.emit)
+        else:
+            self.importer = Importer(store, conflict, on_progress=self.signals.progress.emit)
+
+    def cancel(self):
+        self.importer.cancel()
+
+    def run(self):
+        try:
+            self.signals.finished.emit(self.importer.import_file(self.path))
+        except (OSError, ValueError) as e:
+            logging.error(f"Import failed: {e}")
+            self.signals.failed.emit(str(e))
+
+class ExportWorker(QRunnable):
+    def __init__(self, store, path, fmt):
+        super().__init__()
+        self.signals = TransferWorkerSignals()
+        self.store = store
+        self.path = path
+        self.fmt = fmt
+
+    def run(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                count = export_actions(self.store, f, self.fmt, on_progress=self.signals.progress.emit)
+            self.signals.finished.emit(count)
+        except OSError as e:
+            logging.error(f"Export failed: {e}")
+            self.signals.failed.emit(str(e))
+
+class TestExportWorker(QRunnable):
+    def __init__(self, store, directory, action_ids):
+        super().__init__()
+        self.signals = TransferWorkerSignals()
+        self.action_ids = action_ids
+        self.exporter = TestPackageExporter(store, directory,
+                                            on_progress=lambda done, total: self.signals.progress.emit((done, total)))
+
+    def run(self):
+        try:
+            self.signals.finished.emit(self.exporter.export(action_ids=self.action_ids))
+        except (OSError, ValueError) as e:
+            logging.error(f"Test package export failed: {e}")
+            self.signals.failed.emit(str(e))
 
 class ActionDialog(QDialog):
-    def __init__(self, parent=None, action=None, categories=[], settings=None):
+    def __init__(self, parent=None, action=None, categories=[], settings=None, cache=None, similar=None,
+                 validator=None):
         super().__init__(parent)
         self.setWindowTitle("Действие")
         self.layout = QFormLayout(self)
         self.categories = categories
         self.settings = settings
+        self.cache = cache
+        self.cache_key = None
+        self.similar = similar
+        self.validator = validator
+        self.validation_worker = None
+        self.action_id = action.id if action else None
 
         self.name_input = PlainLineEdit(self)
         self.description_input = PlainTextEdit(self)
@@ -185,12 +741,36 @@ class ActionDialog(QDialog):
         self.layout.addRow("Описание:", self.description_input)
         self.layout.addRow("Код:", self.code_input)
         self.layout.addRow("Сгенерированный код:", self.generated_code_input)
+        self.syntax_label = QLabel(self)
+        self.syntax_label.setStyleSheet("color: #ff6b6b;")
+        self.syntax_label.hide()
+        self.layout.addRow(self.syntax_label)
         self.layout.addRow("Категория:", self.category_combo)
 
+        # Похожие действия пересчитываются после паузы в наборе
+        self.similar_list = QListWidget(self)
+        self.similar_list.setMaximumHeight(110)
+        self.similar_timer = QTimer(self)
+        self.similar_timer.setSingleShot(True)
+        self.similar_timer.setInterval(300)
+        self.similar_timer.timeout.connect(self.update_similar)
+        if self.similar is not None:
+            self.layout.addRow("Похожие действия:", self.similar_list)
+            self.name_input.textChanged.connect(self.similar_timer.start)
+            self.description_input.textChanged.connect(self.similar_timer.start)
+            self.code_input.textChanged.connect(self.similar_timer.start)
+        else:
+            self.similar_list.hide()
+
+        self.generation_worker = None
         self.generate_button = QPushButton("🤖 Сгенерировать код")
         self.generate_button.clicked.connect(self.generate_code)
         self.layout.addRow(self.generate_button)
 
+        self.bypass_cache_checkbox = QCheckBox("Не использовать кэш генерации")
+        self.bypass_cache_checkbox.setEnabled(self.cache is not None)
+        self.layout.addRow(self.bypass_cache_checkbox)
+
         self.buttons = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
             Qt.Horizontal, self)
@@ -206,6 +786,14 @@ class ActionDialog(QDialog):
             self.generated_code_input.setPlainText(action.generated_code)
             self.category_combo.setCurrentText(action.category)
 
+    def update_similar(self):
+        self.similar_list.clear()
+        for action, score in self.similar(self.name_input.text(), self.description_input.toPlainText(),
+                                          self.code_input.toPlainText(), self.action_id):
+            item = QListWidgetItem(f"{score:.0%}  {action.name}  ({action.category})")
+            item.setToolTip(action.description)
+            self.similar_list.addItem(item)
+
     def get_action_data(self):
         return {
             'name': self.name_input.text(),
@@ -216,93 +804,396 @@ class ActionDialog(QDialog):
         }
 
     def generate_code(self):
+        if self.generation_worker is not None:
+            self.cancel_generation()
+            return
+
         user_code = self.code_input.toPlainText()
         system_prompt = self.settings.system_prompt
-        prompt = f"""{system_prompt}
-
-        {user_code}
-
-        Верни только готовый код без дополнительного текста."""
-
-        payload = {
-            "messages": [
-                {"text": prompt, "role": "user"}
-            ],
-            "completionOptions": {
-                "stream": False,
-                "maxTokens": 1500,
-                "temperature": 0.1
-            },
-            "modelUri": "gpt://b1gkl7o40oq65tfl3s3j/yandexgpt"
-        }
-
         try:
-            headers = {
-                "Authorization": f"Bearer {self.settings.get_iam_token()}",
-                "Content-Type": "application/json"
-            }
-            
-            logging.info(f"Request payload: {payload}")
-            logging.info(f"Request headers: {headers}")
-
-            response = requests.post("https://llm.api.cloud.yandex.net/foundationModels/v1/completion", 
-                                     json=payload, headers=headers)
-            
-            logging.info(f"API Response: {response.text}")
-            
-            response.raise_for_status()
-            data = response.json()
-            generated_code = data['result']['alternatives'][0]['message']['text']
-            
-            # Очистка и форматирование кода
-            generated_code = self.clean_and_format_code(generated_code)
-            
-            self.generated_code_input.setPlainText(generated_code)
-        except requests.RequestException as e:
-            logging.error(f"API Error Response: {response.text if response else 'No response'}")
-            QMessageBox.warning(self, "Ошибка API", f"Не удалось получить ответ от API: {str(e)}")
-        except (KeyError, IndexError) as e:
-            QMessageBox.warning(self, "Ошибка данных", f"Не удалось извлечь сгенерированный код из ответа API: {str(e)}")
-        except Exception as e:
-            QMessageBox.critical(self, "Непредвиденная ошибка", f"Произошла непредвиденная ошибка: {str(e)}")
+            backend = self.settings.create_backend()
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка настроек", str(e))
+            return
+
+        self.cache_key = None
+        if self.cache is not None:
+            self.cache_key = backend.cache_key(system_prompt, user_code)
+            if not self.bypass_cache_checkbox.isChecked():
+                cached = self.cache.get(self.cache_key)
+                if cached is not None:
+                    logging.info(f"Completion cache hit: {self.cache_key}")
+                    self.generated_code_input.setPlainText(cached)
+                    return
+
+        self.code_formatter = CodeFormatter()
+        self.generated_length = 0
+        self.generated_code_input.clear()
+
+        worker = GenerationWorker(backend, system_prompt, user_code)
+        worker.signals.chunk.connect(lambda text, w=worker: self.on_generation_chunk(w, text))
+        worker.signals.finished.connect(lambda text, w=worker: self.on_generation_finished(w, text))
+        worker.signals.failed.connect(lambda title, message, critical, w=worker: self.on_generation_failed(w, title, message, critical))
+        self.generation_worker = worker
+        self.generate_button.setText("⏹ Отменить генерацию")
+        QThreadPool.globalInstance().start(worker)
+
+    def cancel_generation(self):
+        if self.generation_worker is not None:
+            self.generation_worker.cancel()
+            self.generation_worker = None
+        self.generate_button.setText("🤖 Сгенерировать код")
+
+    def on_generation_chunk(self, worker, text):
+        if worker is not self.generation_worker:
+            return
+        new_lines, tail = self.code_formatter.feed(text)
+        # Заменяем только хвост документа: уже отформатированные строки не трогаем
+        cursor = QTextCursor(self.generated_code_input.document())
+        cursor.setPosition(self.generated_length)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        committed = ''.join(('\n' if self.generated_length or i else '') + line
+                            for i, line in enumerate(new_lines))
+        self.generated_length += qt_length(committed)
+        if tail:
+            tail = ('\n' if self.generated_length else '') + tail
+        cursor.insertText(committed + tail)
+
+    def on_generation_finished(self, worker, text):
+        if worker is not self.generation_worker:
+            return
+        self.code_formatter.feed(text)
+        generated_code = self.code_formatter.finish()
+        self.generated_code_input.setPlainText(generated_code)
+        error = check_source(generated_code)
+        # Код с синтаксической ошибкой не попадает в кэш, чтобы следующая генерация шла заново
+        if self.cache is not None and self.cache_key is not None and generated_code and error is None:
+            self.cache.put(self.cache_key, generated_code)
+        self.show_syntax_error(error)
+        self.cancel_generation()
+
+    def show_syntax_error(self, error):
+        self.syntax_label.setText(f"⚠️ Сгенерированный код не разбирается: {error}" if error else "")
+        self.syntax_label.setVisible(error is not None)
+
+    def accept(self):
+        if self.validation_worker is not None:
+            return
+        row = (self.action_id, self.code_input.toPlainText(), self.generated_code_input.toPlainText())
+        if self.validator is None:
+            errors = {field: error for field, error in zip(CODE_FIELDS, map(check_source, row[1:])) if error}
+            self.confirm_save(errors)
+            return
+        # Разбор большого кода не должен подвешивать диалог: проверка идёт в фоне через кэш проверок,
+        # диалог закрывается по её результату
+        worker = ValidationWorker(self.validator, [row])
+        worker.signals.checked.connect(lambda rows, broken, w=worker: self.on_validated(w, rows, broken))
+        self.validation_worker = worker
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(False)
+        QThreadPool.globalInstance().start(worker)
+
+    def on_validated(self, worker, rows, broken):
+        if worker is not self.validation_worker:
+            return
+        self.validation_worker = None
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(True)
+        action_id, code, generated_code = rows[0]
+        # Пока шла проверка, код успели изменить: проверяется новый текст
+        if (code, generated_code) != (self.code_input.toPlainText(), self.generated_code_input.toPlainText()):
+            self.accept()
+            return
+        self.confirm_save(broken.get(action_id, {}))
+
+    def confirm_save(self, errors):
+        labels = {'code': "Код", 'generated_code': "Сгенерированный код"}
+        if errors:
+            reply = QMessageBox.question(self, "Синтаксическая ошибка",
+                                         "\n".join(f"{labels[field]}: {error}" for field, error in errors.items())
+                                         + "\n\nСохранить действие всё равно?",
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                return
+        super().accept()
+
+    def on_generation_failed(self, worker, title, message, critical):
+        if worker is not self.generation_worker:
+            return
+        self.cancel_generation()
+        if critical:
+            QMessageBox.critical(self, title, message)
+        else:
+            QMessageBox.warning(self, title, message)
+
+    def done(self, result):
+        self.cancel_generation()
+        self.validation_worker = None
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(True)
+        super().done(result)
 
     def clean_and_format_code(self, code):
-        # Удаление маркеров кода и лишних пробелов
-        code = code.strip('`').strip()
-        
-        # Удаление ```python в начале и ``` в конце, если они есть
-        code = re.sub(r'^```python\n', '', code)
-        code = re.sub(r'\n```$', '', code)
-        
-        # Удаление пустых строк в начале и конце
-        code = code.strip()
-        
-        # Замена множественных пустых строк на одну
-        code = re.sub(r'\n{3,}', '\n\n', code)
-        
-        # Исправление отступов
-        lines = code.split('\n')
-        formatted_lines = []
-        indent_level = 0
-        for line in lines:
-            stripped_line = line.strip()
-            if stripped_line.startswith(('def ', 'class ', 'if ', 'elif ', 'else:', 'for ', 'while ', 'try:', 'except:', 'finally:')):
-                formatted_lines.append(f"{'    ' * indent_level}{stripped_line}")
-                if not stripped_line.endswith(':'):
-                    continue
-                if not stripped_line.startswith(('else:', 'elif ', 'except:', 'finally:')):
-                    indent_level += 1
-            elif stripped_line.startswith(('return ', 'break', 'continue', 'pass')):
-                indent_level = max(0, indent_level - 1)
-                formatted_lines.append(f"{'    ' * indent_level}{stripped_line}")
-            elif stripped_line.startswith(')'):
-                indent_level = max(0, indent_level - 1)
-                formatted_lines.append(f"{'    ' * indent_level}{stripped_line}")
-            else:
-                formatted_lines.append(f"{'    ' * indent_level}{stripped_line}")
+        formatter = CodeFormatter()
+        formatter.feed(code)
+        return formatter.finish()
+
+class DiagnosticsDialog(QDialog):
+    COLUMNS = ("Операция", "Вызовов", "Ошибок", "p50, мс", "p95, мс", "p99, мс", "max, мс")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Диагностика производительности")
+        self.resize(800, 400)
+        self.layout = QVBoxLayout(self)
+
+        self.enabled_checkbox = QCheckBox("Собирать замеры")
+        self.enabled_checkbox.setChecked(metrics.enabled)
+        self.enabled_checkbox.toggled.connect(self.set_enabled)
+        self.layout.addWidget(self.enabled_checkbox)
+
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.layout.addWidget(self.table)
+
+        self.counters_label = QLabel()
+        self.layout.addWidget(self.counters_label)
+
+        button_layout = QHBoxLayout()
+        self.refresh_button = QPushButton("🔄 Обновить")
+        self.reset_button = QPushButton("🧹 Сбросить")
+        self.export_json_button = QPushButton("💾 JSON")
+        self.export_prometheus_button = QPushButton("💾 Prometheus")
+        for button in [self.refresh_button, self.reset_button, self.export_json_button, self.export_prometheus_button]:
+            button_layout.addWidget(button)
+        self.layout.addLayout(button_layout)
+
+        self.refresh_button.clicked.connect(self.refresh)
+        self.reset_button.clicked.connect(self.reset)
+        self.export_json_button.clicked.connect(lambda: self.export(metrics.export_json(), "metrics.json", "JSON (*.json)"))
+        self.export_prometheus_button.clicked.connect(lambda: self.export(metrics.export_prometheus(), "metrics.prom", "Prometheus (*.prom *.txt)"))
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+        self.refresh()
+
+    def set_enabled(self, enabled):
+        metrics.enabled = enabled
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def refresh(self):
+        snapshot = metrics.snapshot()
+        self.table.setRowCount(len(snapshot['spans']))
+        for row, (name, data) in enumerate(snapshot['spans'].items()):
+            values = (name, data['count'], data['errors'], data['p50'] * 1000, data['p95'] * 1000,
+                      data['p99'] * 1000, data['max'] * 1000)
+            for column, value in enumerate(values):
+                text = f"{value:.2f}" if isinstance(value, float) else str(value)
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        counters = ', '.join(f"{name}: {value}" for name, value in snapshot['counters'].items())
+        self.counters_label.setText(counters or "Счётчики пусты")
+
+    def export(self, text, default_name, file_filter):
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт замеров", default_name, file_filter)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+class HistoryDialog(QDialog):
+    # Ревизии одного действия или, без action_id, недавно удалённые действия
+    def __init__(self, history, action_id=None, current=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("История действия" if action_id is not None else "Удалённые действия")
+        self.resize(900, 600)
+        self.layout = QVBoxLayout(self)
+        self.current = current
+        self.restored = None
+
+        # Записи списка: (id действия, ревизия, состояние до неё)
+        self.entries = []
+        if action_id is not None:
+            previous = None
+            for revision in history.revisions(action_id):
+                self.entries.append((action_id, revision, previous))
+                previous = revision['state']
+            self.entries.reverse()
+        else:
+            for deleted_id, created, state in history.deleted_actions():
+                self.entries.append((deleted_id, {'created': created, 'kind': 'delete', 'state': state}, None))
+
+        splitter = QSplitter(Qt.Horizontal)
+        self.revision_list = QListWidget()
+        for _, revision, _ in self.entries:
+            created = datetime.datetime.fromisoformat(revision['created']).astimezone().strftime('%d.%m.%Y %H:%M:%S')
+            self.revision_list.addItem(f"{created}  {KIND_LABELS.get(revision['kind'], revision['kind'])}  "
+                                       f"{revision['state']['name']}")
+        self.diff_view = PlainTextEdit()
+        self.diff_view.setReadOnly(True)
+        self.diff_highlighter = DiffHighlighter(self.diff_view.document())
+        splitter.addWidget(self.revision_list)
+        splitter.addWidget(self.diff_view)
+        splitter.setStretchFactor(1, 2)
+        self.layout.addWidget(splitter)
+
+        self.compare_current_checkbox = QCheckBox("Сравнивать с текущей версией")
+        self.compare_current_checkbox.setVisible(action_id is not None and current is not None)
+        self.layout.addWidget(self.compare_current_checkbox)
+
+        button_layout = QHBoxLayout()
+        self.restore_button = QPushButton("↩️ Восстановить эту версию")
+        self.close_button = QPushButton("Закрыть")
+        button_layout.addWidget(self.restore_button)
+        button_layout.addWidget(self.close_button)
+        self.layout.addLayout(button_layout)
+
+        self.revision_list.currentRowChanged.connect(self.show_revision)
+        self.compare_current_checkbox.toggled.connect(lambda: self.show_revision(self.revision_list.currentRow()))
+        self.restore_button.clicked.connect(self.restore)
+        self.close_button.clicked.connect(self.reject)
+        if self.entries:
+            self.revision_list.setCurrentRow(0)
+        else:
+            self.restore_button.setEnabled(False)
+            self.diff_view.setPlainText("История пуста")
+
+    def show_revision(self, row):
+        if row < 0:
+            return
+        _, revision, previous = self.entries[row]
+        state = revision['state']
+        if self.compare_current_checkbox.isChecked():
+            lines = diff_states(state, self.current)
+        else:
+            lines = diff_states(previous, state)
+        self.diff_view.setPlainText('\n'.join(lines) or "Без изменений")
+        self.restore_button.setEnabled(state != self.current)
+
+    def restore(self):
+        row = self.revision_list.currentRow()
+        if row >= 0:
+            action_id, revision, _ = self.entries[row]
+            self.restored = (action_id, revision['state'])
+            self.accept()
+
+class ActionListModel(QAbstractListModel):
+    IdRole = Qt.UserRole
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.actions = []
+        self.rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.actions)
+
+    def data(self, index, role=Qt.DisplayRole):
+        # Данные строки запрашиваются представлением только для видимых элементов
+        if not index.isValid():
+            return None
+        action = self.actions[index.row()]
+        if role == Qt.DisplayRole:
+            return action.name
+        if role == Qt.ToolTipRole:
+            return action.category
+        if role == self.IdRole:
+            return action.id
+        return None
+
+    def reindex_rows(self, start=0):
+        for row in range(start, len(self.actions)):
+            self.rows[self.actions[row].id] = row
+
+    def set_actions(self, actions):
+        self.beginResetModel()
+        self.actions = actions
+        self.rows = {}
+        self.reindex_rows()
+        self.endResetModel()
+
+    def append_action(self, action):
+        row = len(self.actions)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.actions.append(action)
+        self.rows[action.id] = row
+        self.endInsertRows()
+
+    def remove_action(self, action_id):
+        row = self.rows[action_id]
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.actions[row]
+        del self.rows[action_id]
+        self.reindex_rows(row)
+        self.endRemoveRows()
+
+    def update_action(self, action_id):
+        index = self.index_of(action_id)
+        self.dataChanged.emit(index, index)
+
+    def index_of(self, action_id):
+        row = self.rows.get(action_id)
+        return self.index(row) if row is not None else QModelIndex()
+
+class ActionFilterProxyModel(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.category_ids = None
+        self.ranks = None
+        self.setDynamicSortFilter(True)
+
+    def set_category_ids(self, category_ids):
+        # invalidateFilter удаляет и вставляет только изменившиеся строки, без сброса модели
+        self.category_ids = category_ids
+        self.invalidateFilter()
+
+    def set_search_results(self, action_ids):
+        # Новые результаты вставляются и убираются через invalidateFilter, как при смене категории.
+        # Без поиска список идёт в порядке исходной модели: сортировка всего списка через lessThan
+        # на больших библиотеках занимает секунды, поэтому включается только для результатов поиска,
+        # а заново сортируются они, только если оставшиеся строки поменяли порядок
+        previous = self.ranks
+        self.ranks = None if action_ids is None else {action_id: rank for rank, action_id in enumerate(action_ids)}
+        if self.ranks is None:
+            if self.sortColumn() != -1:
+                self.sort(-1)
+            self.invalidateFilter()
+        elif self.sortColumn() != 0:
+            self.invalidateFilter()
+            self.sort(0)
+        elif self.rank_order_changed(previous, action_ids):
+            self.invalidate()
+        else:
+            self.invalidateFilter()
+
+    @staticmethod
+    def rank_order_changed(previous, action_ids):
+        kept = [previous[action_id] for action_id in action_ids if action_id in previous]
+        return any(left > right for left, right in zip(kept, kept[1:]))
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        action = self.sourceModel().actions[source_row]
+        if self.category_ids is not None and action.id not in self.category_ids:
+            return False
+        return self.ranks is None or action.id in self.ranks
+
+    def lessThan(self, left, right):
+        if self.ranks is not None:
+            actions = self.sourceModel().actions
+            left_rank = self.ranks.get(actions[left.row()].id, 0)
+            right_rank = self.ranks.get(actions[right.row()].id, 0)
+            if left_rank != right_rank:
+                return left_rank < right_rank
+        return left.row() < right.row()
 
-        return '\n'.join(formatted_lines)
 class AutoTestLibrary(QMainWindow):
+    # Больше изменений с сервера выгоднее применить полной перезагрузкой списка
+    REMOTE_RELOAD_THRESHOLD = 1000
+    # Сколько изменений после снимка индексов догоняется при запуске; больше - индексы строятся заново
+    SNAPSHOT_CATCHUP_LIMIT = 500
+    WATCH_INTERVAL_MS = 1000
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Библиотека автотестера")
@@ -313,19 +1204,78 @@ class AutoTestLibrary(QMainWindow):
         self.layout = QHBoxLayout(self.central_widget)
 
         self.actions = []
+        self.actions_by_id = {}
         self.current_action = None
         self.categories = []
-        self.settings = Settings()
+        self.category_index = CategoryIndex()
+        self.category_items = {}
+        self.all_categories_item = None
+        self.selected_category = None
+        self.store = ActionStore()
+        self.library_watcher = LibraryWatcher(self.store)
+        # Правки пишутся в базу фоновым потоком, главный поток только ставит их в очередь
+        self.history = ActionHistory(self.store)
+        self.undo_stack = UndoStack()
+        self.write_notifier = WriteBehindNotifier(self)
+        self.writer = WriteBehindQueue(self.store, on_state=self.write_notifier.state.emit,
+                                       on_flushed=self.write_notifier.flushed.emit,
+                                       on_conflict=self.write_notifier.conflict.emit,
+                                       on_error=self.write_notifier.failed.emit, history=self.history)
+        self.writer.start()
+        self.completion_cache = CompletionCache()
+        self.batch_worker = None
+        self.transfer_worker = None
+        self.search_index = SearchIndex(self.store.load_search_texts)
+        self.similarity_index = SimilarityIndex()
+        self.sync_loop = None
+        self.broken_actions = {}
+        self.rechecked_actions = set()
+        self.health_queue = {}
+        self.broken_item = None
+        self.show_broken = False
+        self.search_pool = QThreadPool(self)
+        self.search_pool.setMaxThreadCount(1)
+        self.search_generation = 0
+
+        # Поиск запускается после паузы в наборе, а не на каждое нажатие клавиши
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.run_search)
+        self.health_timer = QTimer(self)
+        self.health_timer.setSingleShot(True)
+        self.health_timer.setInterval(0)
+        self.health_timer.timeout.connect(self.start_health_check)
+
+        self.settings = Settings(self.store)
+        self.migrate_json_library()
         self.settings.load()
+        self.validator = SnippetValidator(self.store)
 
         self.init_ui()
         self.load_actions()
         self.apply_styles()
 
-        # Запускаем таймер для обновления IAM токена каждый час
-        self.token_refresh_timer = QTimer(self)
-        self.token_refresh_timer.timeout.connect(self.refresh_iam_token)
-        self.token_refresh_timer.start(3600000)  # 1 час в миллисекундах
+        # IAM токен обновляется в фоне заранее, до истечения срока действия
+        self.token_notifier = TokenRefreshNotifier(self)
+        self.token_notifier.failed.connect(self.show_token_error)
+        self.settings.token_manager.on_error = self.token_notifier.failed.emit
+        self.settings.token_manager.start()
+
+        self.sync_notifier = LibrarySyncNotifier(self)
+        self.sync_notifier.changes.connect(self.apply_library_changes)
+        self.sync_notifier.failed.connect(self.show_sync_error)
+        self.start_library_sync()
+
+        # Изменения базы другими процессами подхватываются опросом, без полной перезагрузки
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setInterval(self.WATCH_INTERVAL_MS)
+        self.watch_timer.timeout.connect(self.check_library_changes)
+        self.watch_timer.start()
+
+        # Старые ревизии чистятся в фоне, чтобы история не раздувала базу
+        QThreadPool.globalInstance().start(HistoryCompactWorker(
+            self.history, self.settings.history_max_revisions, self.settings.history_max_days))
 
     def init_ui(self):
         splitter = QSplitter(Qt.Horizontal)
@@ -346,36 +1296,75 @@ class AutoTestLibrary(QMainWindow):
         self.category_tree.setHeaderHidden(True)
         left_layout.addWidget(self.category_tree)
 
-        self.action_list = QListWidget()
+        self.action_model = ActionListModel(self)
+        self.action_model.set_actions(self.actions)
+        self.action_proxy = ActionFilterProxyModel(self)
+        self.action_proxy.setSourceModel(self.action_model)
+
+        self.action_list = QListView()
+        self.action_list.setModel(self.action_proxy)
+        self.action_list.setUniformItemSizes(True)
+        self.action_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         left_layout.addWidget(self.action_list)
 
+        self.batch_generate_button = QPushButton("🤖 Сгенерировать код для выбранных")
+        self.batch_generate_button.clicked.connect(self.batch_generate)
+        left_layout.addWidget(self.batch_generate_button)
+
         self.clean_categories_button = QPushButton("🧹 Удалить неиспользуемые категории")
         self.clean_categories_button.clicked.connect(self.clean_unused_categories)
         left_layout.addWidget(self.clean_categories_button)
 
+        transfer_layout = QHBoxLayout()
+        self.import_button = QPushButton("📥 Импорт")
+        self.import_button.clicked.connect(self.import_library)
+        transfer_layout.addWidget(self.import_button)
+        self.export_button = QPushButton("📤 Экспорт")
+        self.export_button.clicked.connect(self.export_library)
+        transfer_layout.addWidget(self.export_button)
+        self.export_tests_button = QPushButton("🧪 Экспорт тестов")
+        self.export_tests_button.clicked.connect(self.export_test_package)
+        transfer_layout.addWidget(self.export_tests_button)
+        left_layout.addLayout(transfer_layout)
+
         right_panel = QWidget()
         right_layout = QVBoxLayout(right_panel)
         right_layout.setContentsMargins(0, 0, 0, 0)
 
-        self.action_details = PlainTextEdit()
-        self.action_details.setReadOnly(True)
+        self.action_details = ActionDetailsView()
         right_layout.addWidget(self.action_details)
 
-        self.details_highlighter = PythonHighlighter(self.action_details.document())
-
         button_layout = QHBoxLayout()
         self.copy_button = QPushButton("📋 Копировать код")
         self.add_button = QPushButton("➕ Добавить")
         self.edit_button = QPushButton("✏️ Редактировать")
         self.delete_button = QPushButton("❌ Удалить")
         self.settings_button = QPushButton("⚙️ Настройки")
+        self.diagnostics_button = QPushButton("📊 Диагностика")
         
-        for button in [self.copy_button, self.add_button, self.edit_button, self.delete_button, self.settings_button]:
+        for button in [self.copy_button, self.add_button, self.edit_button, self.delete_button, self.settings_button,
+                       self.diagnostics_button]:
             button.setMinimumHeight(40)
             button_layout.addWidget(button)
 
         right_layout.addLayout(button_layout)
 
+        history_layout = QHBoxLayout()
+        self.undo_button = QPushButton("↶ Отменить")
+        self.redo_button = QPushButton("↷ Повторить")
+        self.history_button = QPushButton("🕘 История")
+        self.deleted_button = QPushButton("🗑 Удалённые")
+        for button in [self.undo_button, self.redo_button, self.history_button, self.deleted_button]:
+            history_layout.addWidget(button)
+        right_layout.addLayout(history_layout)
+        self.undo_button.clicked.connect(self.undo_change)
+        self.redo_button.clicked.connect(self.redo_change)
+        self.history_button.clicked.connect(self.open_history)
+        self.deleted_button.clicked.connect(self.open_deleted)
+        QShortcut(QKeySequence.Undo, self, self.undo_change)
+        QShortcut(QKeySequence.Redo, self, self.redo_change)
+        self.update_undo_buttons()
+
         splitter.addWidget(left_panel)
         splitter.addWidget(right_panel)
         splitter.setStretchFactor(0, 1)
@@ -387,7 +1376,16 @@ class AutoTestLibrary(QMainWindow):
         self.edit_button.clicked.connect(self.edit_action)
         self.delete_button.clicked.connect(self.delete_action)
         self.settings_button.clicked.connect(self.open_settings)
-        self.action_list.itemClicked.connect(self.show_action_details)
+        self.diagnostics_button.clicked.connect(self.open_diagnostics)
+        self.action_list.clicked.connect(self.show_action_details)
+
+        self.save_state_label = QLabel()
+        self.statusBar().addPermanentWidget(self.save_state_label)
+        self.write_notifier.state.connect(self.show_save_state)
+        self.write_notifier.flushed.connect(self.on_actions_flushed)
+        self.write_notifier.conflict.connect(self.on_write_conflict)
+        self.write_notifier.failed.connect(self.on_write_failed)
+        self.show_save_state(0, False)
 
     def apply_styles(self):
         dark_palette = QPalette()
@@ -423,14 +1421,14 @@ class AutoTestLibrary(QMainWindow):
         QPushButton:hover {
             background-color: #3a92ea;
         }
-        QLineEdit, QTextEdit, QListWidget, QTreeWidget {
+        QLineEdit, QTextEdit, QListWidget, QListView, QTreeWidget {
             border: 1px solid #3a3a3a;
             border-radius: 4px;
             padding: 5px;
             background-color: #1e1e1e;
             color: white;
         }
-        QTreeWidget::item:selected, QListWidget::item:selected {
+        QTreeWidget::item:selected, QListWidget::item:selected, QListView::item:selected {
             background-color: #2a82da;
         }
         QTreeWidget::item {
@@ -470,16 +1468,136 @@ class AutoTestLibrary(QMainWindow):
         """
         self.setStyleSheet(style)
 
+    def open_diagnostics(self):
+        dialog = DiagnosticsDialog(self)
+        dialog.exec_()
+
+    def start_library_sync(self):
+        if self.sync_loop is not None:
+            self.sync_loop.stop()
+            self.sync_loop = None
+        if not self.settings.server_url:
+            return
+        self.writer.flush()
+        sync = LibrarySync(self.store, RemoteLibrary(self.settings.server_url, self.settings.server_token or None))
+        if sync.version == 0 and self.actions:
+            # Первое подключение: локальная база становится зеркалом сервера
+            reply = QMessageBox.question(
+                self, "Сервер библиотеки",
+                f"Отправить локальные действия ({len(self.actions)}) на сервер?\n"
+                "Локальная библиотека будет заменена содержимым сервера; действия, код которых "
+                "уже есть на сервере, отправлены не будут.",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            try:
+                if reply == QMessageBox.Yes:
+                    sync.upload_local()
+                else:
+                    self.store.clear_actions()
+            except OSError as e:
+                QMessageBox.warning(self, "Сервер библиотеки", f"Не удалось подключиться к серверу: {str(e)}")
+                return
+            self.load_actions()
+        self.sync_loop = SyncLoop(sync, on_changes=self.sync_notifier.changes.emit,
+                                  on_error=self.sync_notifier.failed.emit)
+        self.sync_loop.start()
+
+    def show_sync_error(self, message):
+        QMessageBox.warning(self, "Сервер библиотеки", f"Ошибка синхронизации с сервером: {message}")
+
+    def push_actions(self, actions):
+        if self.sync_loop is not None and actions:
+            self.sync_loop.push(actions)
+
+    def check_library_changes(self):
+        # В режиме сервера база - зеркало, которое обновляет только синхронизация
+        if self.sync_loop is not None:
+            return
+        try:
+            result = self.library_watcher.poll()
+        except sqlite3.Error as e:
+            logging.error(f"Library change check failed: {e}")
+            return
+        if result is not None:
+            changed, deleted, reset = result
+            logging.info(f"Library changed by another process: changed {len(changed)}, deleted {len(deleted)}")
+            self.apply_library_changes(result)
+
+    def apply_library_changes(self, result):
+        changed, deleted, reset = result
+        if reset or len(changed) + len(deleted) > self.REMOTE_RELOAD_THRESHOLD:
+            self.load_actions()
+            return
+        # Небольшие изменения применяются точечно, без перестройки списка и индексов
+        self.reload_actions(changed, deleted)
+        self.refresh_category_filter()
+        if self.search_input.text():
+            self.search_actions()
+        if self.current_action is not None:
+            self.display_action_details(self.actions_by_id.get(self.current_action.id))
+
+    def reload_actions(self, changed, deleted=()):
+        # Действия перечитываются из базы; пропавшие из неё убираются из индексов.
+        # Несохранённые правки новее базы, их действия не трогаются
+        pending = self.writer.pending_ids()
+        changed = [action_id for action_id in changed if action_id not in pending]
+        deleted = [action_id for action_id in deleted if action_id not in pending]
+        categories = self.store.load_categories()
+        if set(self.categories) - set(categories):
+            # Категории удалены на сервере: дерево перестраивается
+            self.categories = categories
+            self.update_category_tree()
+        else:
+            self.update_categories(categories)
+        records = self.store.get_records(changed)
+        missing = set(changed).difference(record['id'] for record in records)
+        for action_id in missing.union(deleted):
+            if action_id in self.actions_by_id:
+                self.unindex_action(action_id)
+        for record in records:
+            action = self.actions_by_id.get(record['id'])
+            if action is None:
+                self.index_new_action(Action(record['name'], category=record['category'], id=record['id'],
+                                             loader=self.store.load_body))
+            else:
+                action.name = record['name']
+                action.category = record['category']
+                action.attach(self.store.load_body)
+                self.index_changed_action(action)
+
     def open_settings(self):
         dialog = SettingsDialog(self.settings, self)
+        server = (self.settings.server_url, self.settings.server_token)
         if dialog.exec_():
             self.refresh_iam_token()
+            if (self.settings.server_url, self.settings.server_token) != server:
+                self.start_library_sync()
 
     def refresh_iam_token(self):
-        try:
-            self.settings.refresh_iam_token()
-        except Exception as e:
-            QMessageBox.warning(self, "Ошибка обновления токена", str(e))
+        future = self.settings.token_manager.refresh()
+        future.add_done_callback(self.report_token_refresh)
+
+    def report_token_refresh(self, future):
+        # Вызывается из фонового потока, поэтому сообщение передаётся через сигнал
+        error = future.exception()
+        if error is not None:
+            self.token_notifier.failed.emit(str(error))
+
+    def show_token_error(self, message):
+        QMessageBox.warning(self, "Ошибка обновления токена", message)
+
+    def closeEvent(self, event):
+        if not self.writer.close():
+            reply = QMessageBox.question(self, "Несохранённые изменения",
+                                         "Не удалось записать изменения в библиотеку.\n\n"
+                                         "Закрыть приложение без сохранения?",
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                event.ignore()
+                return
+        self.settings.token_manager.stop()
+        if self.sync_loop is not None:
+            self.sync_loop.stop()
+        super().closeEvent(event)
 
     def copy_code(self):
         if self.current_action:
@@ -490,137 +1608,642 @@ class AutoTestLibrary(QMainWindow):
             msg_box.information(self, "Копирование", "Код скопирован в буфер обмена!")
 
     def search_actions(self):
-        query = self.search_input.text().lower()
-        self.action_list.clear()
-        for action in self.actions:
-            if query in action.name.lower() or query in action.description.lower() or query in action.code.lower():
-                self.action_list.addItem(action.name)
+        # Устаревшие запросы отменяются сменой поколения
+        self.search_generation += 1
+        self.search_timer.start()
+
+    def run_search(self):
+        worker = SearchWorker(self.search_index, self.search_input.text(),
+                              self.search_generation, lambda: self.search_generation)
+        worker.signals.finished.connect(self.apply_search_results)
+        self.search_pool.start(worker)
+
+    def apply_search_results(self, generation, results):
+        if generation != self.search_generation:
+            return
+        self.action_proxy.set_search_results(results if self.search_input.text() else None)
 
     def filter_by_category(self, item, column):
-        category = item.text(column)
-        self.action_list.clear()
-        for action in self.actions:
-            if action.category == category or category == "Все категории":
-                self.action_list.addItem(action.name)
+        category = item.data(0, Qt.UserRole)
+        self.show_broken = item is self.broken_item
+        self.selected_category = None if category == "all" or self.show_broken else category
+        self.refresh_category_filter()
+
+    def refresh_category_filter(self):
+        category_ids = None
+        if self.show_broken:
+            category_ids = set(self.broken_actions)
+        elif self.selected_category is not None:
+            category_ids = self.category_index.ids_in(self.selected_category)
+        self.action_proxy.set_category_ids(category_ids)
+
+    def selected_actions(self):
+        return [self.actions_by_id[index.data(ActionListModel.IdRole)]
+                for index in self.action_list.selectionModel().selectedIndexes()]
+
+    def batch_generate(self):
+        if self.batch_worker is not None:
+            return
+        actions = self.selected_actions()
+        if not actions:
+            category_item = self.category_tree.currentItem()
+            category = category_item.data(0, Qt.UserRole) if category_item is not None else None
+            if category is None:
+                QMessageBox.information(self, "Пакетная генерация", "Выберите действия или категорию.")
+                return
+            if category == "all":
+                actions = self.actions
+            else:
+                actions = [self.actions_by_id[action_id] for action_id in self.category_index.ids_in(category)]
+        action_ids = [action.id for action in actions]
+        pending = self.writer.pending_ids()
+        pending_codes = {action.id: action.code for action in actions if action.id in pending}
+
+        try:
+            backend = self.settings.create_backend()
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка настроек", str(e))
+            return
+
+        # Число заданий известно, когда поток прочитает код действий
+        self.batch_total = None
+        self.batch_progress = QProgressDialog("Подготовка заданий...", "Отменить", 0, 0, self)
+        self.batch_progress.setWindowTitle("Пакетная генерация")
+        self.batch_progress.setWindowModality(Qt.WindowModal)
+        self.batch_progress.setMinimumDuration(0)
+        self.batch_progress.setAutoClose(False)
+        self.batch_progress.setAutoReset(False)
+
+        worker = BatchGenerationWorker(self.store, action_ids, pending_codes, self.settings.system_prompt, backend,
+                                       self.settings.batch_concurrency, self.settings.batch_requests_per_second,
+                                       self.completion_cache)
+        worker.signals.prepared.connect(self.on_batch_prepared)
+        worker.signals.progress.connect(self.on_batch_progress)
+        worker.signals.results.connect(self.on_batch_results)
+        worker.signals.finished.connect(self.on_batch_finished)
+        self.batch_progress.canceled.connect(worker.cancel)
+        self.batch_worker = worker
+        QThreadPool.globalInstance().start(worker)
+
+    def on_batch_prepared(self, total):
+        self.batch_total = total
+        self.batch_progress.setMaximum(total)
+        self.batch_progress.setLabelText("Генерация кода...")
+
+    def on_batch_progress(self, done, failed, skipped):
+        self.batch_progress.setValue(done + skipped)
+        text = f"Готово: {done} из {self.batch_progress.maximum()}, ошибок: {failed}"
+        if skipped:
+            text += f", отменено: {skipped}"
+        self.batch_progress.setLabelText(text)
+
+    def on_batch_results(self, results):
+        # Сначала подтягиваются чужие изменения, чтобы не записать поверх них старый код
+        self.check_library_changes()
+        changed = []
+        undo_changes = {}
+        for action_id, generated_code in results:
+            action = self.actions_by_id.get(action_id)
+            if action is not None:
+                before = action_snapshot(action)
+                action.generated_code = generated_code
+                undo_changes[action_id] = (before, action_snapshot(action))
+                changed.append(action)
+        self.remember_change("генерация кода", undo_changes)
+        self.save_actions(changed)
+        self.push_actions(changed)
+        for action in changed:
+            self.update_action_health(action)
+        if self.current_action in changed:
+            self.display_action_details(self.current_action)
+
+    def on_batch_finished(self, done, failed, skipped):
+        self.batch_worker = None
+        self.batch_progress.close()
+        if self.batch_total == 0:
+            QMessageBox.information(self, "Пакетная генерация", "Нет действий с кодом для генерации.")
+            return
+        text = f"Обработано действий: {done}, ошибок: {failed}."
+        if skipped:
+            text += f" Отменено: {skipped}."
+        QMessageBox.information(self, "Пакетная генерация", text)
+
+    def start_transfer(self, worker, title, label, cancellable):
+        self.transfer_progress = QProgressDialog(label, "Отменить" if cancellable else None, 0, 0, self)
+        self.transfer_progress.setWindowTitle(title)
+        self.transfer_progress.setWindowModality(Qt.WindowModal)
+        self.transfer_progress.setMinimumDuration(0)
+        self.transfer_progress.setAutoClose(False)
+        self.transfer_progress.setAutoReset(False)
+        if cancellable:
+            self.transfer_progress.canceled.connect(worker.cancel)
+        worker.signals.failed.connect(self.on_transfer_failed)
+        self.transfer_worker = worker
+        QThreadPool.globalInstance().start(worker)
+
+    def import_library(self):
+        if self.transfer_worker is not None:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Импорт действий", "",
+                                              "JSON и NDJSON (*.json *.ndjson *.jsonl);;Все файлы (*)")
+        if not path:
+            return
+        policies = {"Переименовать": 'rename', "Пропустить": 'skip', "Заменить": 'replace', "Оставить оба": 'keep'}
+        choice, ok = QInputDialog.getItem(self, "Импорт действий", "Если название уже есть в библиотеке:",
+                                          list(policies), 0, False)
+        if not ok:
+            return
+        remote = self.sync_loop.pusher if self.sync_loop is not None else None
+        worker = ImportWorker(self.store, path, policies[choice], remote)
+        worker.signals.progress.connect(self.on_import_progress)
+        worker.signals.finished.connect(self.on_import_finished)
+        self.start_transfer(worker, "Импорт действий", "Чтение файла...", True)
+
+    def on_import_progress(self, stats):
+        self.transfer_progress.setLabelText(f"Прочитано: {stats.read}, добавлено: {stats.imported}, "
+                                            f"дубликатов: {stats.duplicates} ({stats.rate:.0f} записей/с)")
+
+    def on_import_finished(self, stats):
+        self.transfer_worker = None
+        self.transfer_progress.close()
+        # Индексы перестраиваются один раз после всего импорта
+        self.load_actions()
+        QMessageBox.information(self, "Импорт действий", stats.summary())
+
+    def export_library(self):
+        if self.transfer_worker is not None:
+            return
+        path, selected_filter = QFileDialog.getSaveFileName(self, "Экспорт действий", "actions.json",
+                                                            "JSON (*.json);;NDJSON (*.ndjson)")
+        if not path:
+            return
+        fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) or 'NDJSON' in selected_filter else 'json'
+        worker = ExportWorker(self.store, path, fmt)
+        worker.signals.progress.connect(
+            lambda count: self.transfer_progress.setLabelText(f"Выгружено действий: {count}"))
+        worker.signals.finished.connect(self.on_export_finished)
+        self.start_transfer(worker, "Экспорт действий", "Выгрузка...", False)
+
+    def export_test_package(self):
+        if self.transfer_worker is not None:
+            return
+        # Выгружаются выбранные действия, а если ничего не выбрано - всё, что видно в списке
+        actions = self.selected_actions()
+        if actions:
+            action_ids = [action.id for action in actions]
+        else:
+            action_ids = [self.action_proxy.index(row, 0).data(ActionListModel.IdRole)
+                          for row in range(self.action_proxy.rowCount())]
+        if not action_ids:
+            QMessageBox.information(self, "Экспорт тестов", "Нет действий для выгрузки.")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Каталог пакета тестов")
+        if not directory:
+            return
+        worker = TestExportWorker(self.store, directory, action_ids)
+        worker.signals.progress.connect(
+            lambda progress: self.transfer_progress.setLabelText(f"Записано модулей: {progress[0]} из {progress[1]}"))
+        worker.signals.finished.connect(self.on_test_export_finished)
+        self.start_transfer(worker, "Экспорт тестов", "Сборка модулей...", False)
+
+    def on_test_export_finished(self, stats):
+        self.transfer_worker = None
+        self.transfer_progress.close()
+        QMessageBox.information(self, "Экспорт тестов", stats.summary())
+
+    def on_export_finished(self, count):
+        self.transfer_worker = None
+        self.transfer_progress.close()
+        QMessageBox.information(self, "Экспорт действий", f"Выгружено действий: {count}.")
+
+    def on_transfer_failed(self, message):
+        worker, self.transfer_worker = self.transfer_worker, None
+        self.transfer_progress.close()
+        if isinstance(worker, ImportWorker):
+            # Уже зафиксированные пакеты остаются в базе
+            self.load_actions()
+        QMessageBox.critical(self, "Ошибка", f"Не удалось обработать файл: {message}")
 
     def add_action(self):
-        dialog = ActionDialog(self, categories=self.categories, settings=self.settings)
+        dialog = ActionDialog(self, categories=self.categories, settings=self.settings, cache=self.completion_cache,
+                              similar=self.find_similar, validator=self.validator)
         if dialog.exec_():
             action_data = dialog.get_action_data()
             new_action = Action(**action_data)
-            self.actions.append(new_action)
-            self.update_categories([new_action.category])
-            self.update_action_list()
-            self.save_actions()
+            self.remember_change("добавление", {new_action.id: (None, action_snapshot(new_action))})
+            self.save_actions([new_action])
+            self.push_actions([new_action])
+            self.index_new_action(new_action)
+            self.refresh_category_filter()
+            if self.search_input.text():
+                self.search_actions()
 
     def edit_action(self):
         if self.current_action:
-            dialog = ActionDialog(self, self.current_action, self.categories, self.settings)
+            action = self.current_action
+            # Версия запоминается до открытия диалога: пока он открыт, действие может
+            # изменить другой процесс, и его правки нельзя молча перезаписать
+            base_version = self.store.action_versions([action.id]).get(action.id)
+            dialog = ActionDialog(self, action, self.categories, self.settings, self.completion_cache,
+                                  self.find_similar, self.validator)
             if dialog.exec_():
                 action_data = dialog.get_action_data()
-                self.current_action.name = action_data['name']
-                self.current_action.description = action_data['description']
-                self.current_action.code = action_data['code']
-                self.current_action.generated_code = action_data['generated_code']
-                self.current_action.category = action_data['category']
-                self.update_categories([self.current_action.category])
-                self.save_actions()
-                self.update_action_list()
-                
-                for i in range(self.action_list.count()):
-                    if self.action_list.item(i).text() == self.current_action.name:
-                        self.action_list.setCurrentItem(self.action_list.item(i))
-                        break
-                
-                self.show_action_details(self.action_list.currentItem())
+                before = action_snapshot(action)
+                action.name = action_data['name']
+                action.description = action_data['description']
+                action.code = action_data['code']
+                action.generated_code = action_data['generated_code']
+                action.category = action_data['category']
+                self.remember_change("изменение", {action.id: (before, action_snapshot(action))})
+                self.writer.save([action], expected={action.id: base_version})
+                self.current_action = action
+                self.push_actions([action])
+                if action.id in self.actions_by_id:
+                    self.index_changed_action(action)
+                else:
+                    self.index_new_action(action)
+                self.refresh_category_filter()
+                if self.search_input.text():
+                    self.search_actions()
+
+                index = self.action_proxy.mapFromSource(self.action_model.index_of(self.current_action.id))
+                self.action_list.setCurrentIndex(index)
+                self.display_action_details(self.current_action)
+
+    def show_save_state(self, pending, saving):
+        if saving:
+            self.save_state_label.setText("⏳ Сохранение...")
+        elif pending:
+            self.save_state_label.setText(f"● Не сохранено: {pending}")
+        else:
+            self.save_state_label.setText("✓ Все изменения сохранены")
+
+    def on_actions_flushed(self, action_ids):
+        self.library_watcher.mark_synced()
+        # Записанные действия снова читают тело из базы, чтобы не держать его в памяти
+        pending = self.writer.pending_ids()
+        for action_id in action_ids:
+            action = self.actions_by_id.get(action_id)
+            if action is not None and action_id not in pending:
+                action.attach(self.store.load_body)
+        # Поиск проверяет совпадения по текстам из базы: запрос, выполненный до записи,
+        # видел старые тексты записанных действий
+        if self.search_input.text():
+            self.search_actions()
+
+    def on_write_conflict(self, records):
+        names = ', '.join(f"'{record['name']}'" for record in records)
+        reply = QMessageBox.question(self, "Конфликт записи",
+                                     f"Пока вы редактировали действия {names}, их изменил или удалил другой процесс."
+                                     "\n\nПерезаписать их вашими версиями?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.writer.save_records(records)
+            return
+        # Правки отбрасываются, в памяти остаётся версия из базы
+        self.check_library_changes()
+        self.reload_actions([record['id'] for record in records])
+        self.refresh_category_filter()
+        if self.current_action is not None:
+            self.display_action_details(self.actions_by_id.get(self.current_action.id))
+
+    def on_write_failed(self, message):
+        self.save_state_label.setText("⚠️ Ошибка сохранения, повтор...")
+        QMessageBox.warning(self, "Ошибка сохранения",
+                            f"Не удалось записать изменения в библиотеку: {message}\n"
+                            "Изменения сохранены в памяти, запись будет повторена.")
+
+    def remember_change(self, label, changes):
+        self.undo_stack.push(label, changes)
+        self.update_undo_buttons()
+
+    def update_undo_buttons(self):
+        undo_label = self.undo_stack.undo_label()
+        redo_label = self.undo_stack.redo_label()
+        self.undo_button.setEnabled(undo_label is not None)
+        self.undo_button.setToolTip(f"Отменить {undo_label}" if undo_label else "")
+        self.redo_button.setEnabled(redo_label is not None)
+        self.redo_button.setToolTip(f"Повторить {redo_label}" if redo_label else "")
+
+    def undo_change(self):
+        if self.undo_stack.undo_label() is None:
+            return
+        label, states = self.undo_stack.undo()
+        self.apply_action_states(states)
+        self.update_undo_buttons()
+        self.statusBar().showMessage(f"Отменено: {label}", 3000)
+
+    def redo_change(self):
+        if self.undo_stack.redo_label() is None:
+            return
+        label, states = self.undo_stack.redo()
+        self.apply_action_states(states)
+        self.update_undo_buttons()
+        self.statusBar().showMessage(f"Повторено: {label}", 3000)
+
+    def apply_action_states(self, states):
+        # Состояния из отмены, повтора или истории; None - действие удаляется
+        saved = []
+        deleted = []
+        for action_id, record in states.items():
+            action = self.actions_by_id.get(action_id)
+            if record is None:
+                if action is not None:
+                    self.unindex_action(action_id)
+                    deleted.append(action_id)
+            elif action is None:
+                action = Action(record['name'], record['description'], record['code'], record['category'],
+                                record['generated_code'], action_id)
+                self.index_new_action(action)
+                saved.append(action)
+            else:
+                for field in FIELDS:
+                    setattr(action, field, record[field])
+                self.index_changed_action(action)
+                saved.append(action)
+        if saved:
+            self.save_actions(saved)
+            self.push_actions(saved)
+        if deleted:
+            self.writer.delete(deleted)
+            if self.sync_loop is not None:
+                for action_id in deleted:
+                    self.sync_loop.delete(action_id)
+        self.refresh_category_filter()
+        if self.search_input.text():
+            self.search_actions()
+        if self.current_action is not None:
+            self.display_action_details(self.actions_by_id.get(self.current_action.id))
+
+    def open_history(self):
+        if self.current_action is None:
+            return
+        # Несохранённые правки ещё не попали в историю
+        self.writer.flush()
+        current = action_snapshot(self.current_action)
+        del current['id']
+        dialog = HistoryDialog(self.history, self.current_action.id, current, self)
+        if dialog.exec_() and dialog.restored is not None:
+            self.restore_revision(*dialog.restored)
+
+    def open_deleted(self):
+        self.writer.flush()
+        dialog = HistoryDialog(self.history, parent=self)
+        if dialog.exec_() and dialog.restored is not None:
+            self.restore_revision(*dialog.restored)
+
+    def restore_revision(self, action_id, state):
+        record = dict(state, id=action_id)
+        action = self.actions_by_id.get(action_id)
+        self.remember_change("восстановление версии",
+                             {action_id: (action_snapshot(action) if action is not None else None, record)})
+        self.apply_action_states({action_id: record})
 
     def delete_action(self):
         if self.current_action:
             reply = QMessageBox.question(self, "Удалить действие", f"Вы уверены, что хотите удалить действие '{self.current_action.name}'?",
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.actions.remove(self.current_action)
-                self.save_actions()
-                self.update_action_list()
+                self.remember_change("удаление", {self.current_action.id: (action_snapshot(self.current_action), None)})
+                self.unindex_action(self.current_action.id)
+                self.writer.delete([self.current_action.id])
+                if self.sync_loop is not None:
+                    self.sync_loop.delete(self.current_action.id)
                 self.action_details.clear()
-
-    def show_action_details(self, item):
-        if item is None:
-            self.action_details.clear()
-            self.current_action = None
-        else:
-            for action in self.actions:
-                if action.name == item.text():
-                    self.current_action = action
-                    details = f"Название: {action.name}\n\n"
-                    details += f"Категория: {action.category}\n\n"
-                    details += f"Описание: {action.description}\n\n"
-                    details += f"Код:\n{action.code}\n\n"
-                    details += f"Сгенерированный код:\n{action.generated_code}"
-                    self.action_details.setPlainText(details)
-                    break
-
-    def update_action_list(self):
-        self.action_list.clear()
-        for action in self.actions:
-            self.action_list.addItem(action.name)
+                self.current_action = None
+
+    def index_new_action(self, action):
+        self.actions_by_id[action.id] = action
+        self.action_model.append_action(action)
+        self.search_index.add(action)
+        self.similarity_index.add(action)
+        self.update_action_health(action)
+        self.update_categories([action.category])
+        self.update_category_counts(self.category_index.add(action.id, action.category))
+
+    def index_changed_action(self, action):
+        self.search_index.update(action)
+        self.similarity_index.update(action)
+        self.update_action_health(action)
+        self.update_categories([action.category])
+        self.update_category_counts(self.category_index.move(action.id, action.category))
+        self.action_model.update_action(action.id)
+
+    def unindex_action(self, action_id):
+        self.action_model.remove_action(action_id)
+        del self.actions_by_id[action_id]
+        self.search_index.forget(action_id)
+        self.similarity_index.remove(action_id)
+        if self.broken_actions.pop(action_id, None):
+            self.update_broken_item()
+        self.update_category_counts(self.category_index.remove(action_id))
+
+    def find_similar(self, name, description, code, exclude=None):
+        results = self.similarity_index.similar(name, description, code, k=5, exclude=exclude, threshold=0.2)
+        return [(self.actions_by_id[action_id], score) for action_id, score in results
+                if action_id in self.actions_by_id]
+
+    def show_action_details(self, index):
+        # Действие находится по идентификатору из Qt.UserRole, а не по имени
+        action_id = index.data(ActionListModel.IdRole) if index is not None and index.isValid() else None
+        self.display_action_details(self.actions_by_id.get(action_id))
+
+    def display_action_details(self, action):
+        self.current_action = action
+        self.action_details.show_action(action, self.broken_actions.get(action.id) if action else None)
+
+    def validate_library(self):
+        self.rechecked_actions = set()
+        worker = ValidationWorker(self.validator)
+        worker.signals.finished.connect(self.on_validation_finished)
+        QThreadPool.globalInstance().start(worker)
+
+    def on_validation_finished(self, broken):
+        # Действия, изменённые во время фоновой проверки, уже перепроверены по отдельности
+        current = self.broken_actions
+        self.broken_actions = {action_id: errors for action_id, errors in broken.items()
+                               if action_id in self.actions_by_id and action_id not in self.rechecked_actions}
+        self.broken_actions.update((action_id, current[action_id]) for action_id in self.rechecked_actions
+                                   if action_id in current)
+        self.update_broken_item()
+        if self.show_broken:
+            self.refresh_category_filter()
+
+    def update_action_health(self, action):
+        # Разбор кода и запись кэша проверок идут в фоновом потоке; действия, изменённые
+        # за один проход цикла событий (пакетная генерация, изменения из базы), проверяются вместе
+        self.health_queue[action.id] = action
+        self.health_timer.start()
+
+    def start_health_check(self):
+        rows = [(action.id, action.code, action.generated_code) for action in self.health_queue.values()]
+        self.health_queue = {}
+        worker = ValidationWorker(self.validator, rows)
+        worker.signals.checked.connect(self.on_health_checked)
+        QThreadPool.globalInstance().start(worker)
+
+    def on_health_checked(self, rows, broken):
+        changed = set()
+        for action_id, code, generated_code in rows:
+            action = self.actions_by_id.get(action_id)
+            # Действие успели изменить ещё раз: его результат придёт со следующей проверкой
+            if action is None or (action.code, action.generated_code) != (code, generated_code):
+                continue
+            self.rechecked_actions.add(action_id)
+            errors = broken.get(action_id)
+            if errors:
+                if self.broken_actions.get(action_id) != errors:
+                    self.broken_actions[action_id] = errors
+                    changed.add(action_id)
+            elif self.broken_actions.pop(action_id, None) is not None:
+                changed.add(action_id)
+        if not changed:
+            return
+        self.update_broken_item()
+        if self.show_broken:
+            self.refresh_category_filter()
+        if self.current_action is not None and self.current_action.id in changed:
+            self.display_action_details(self.current_action)
+
+    def update_broken_item(self):
+        if self.broken_item is not None:
+            self.broken_item.setText(0, f"⚠️ Сломанные сниппеты ({len(self.broken_actions)})")
+            self.broken_item.setHidden(not self.broken_actions)
 
     def update_categories(self, new_categories):
-        for category in new_categories:
-            if category not in self.categories:
-                self.categories.append(category)
-        self.update_category_tree()
-
+        added = [category for category in dict.fromkeys(new_categories) if category not in self.categories]
+        self.categories.extend(added)
+        if added:
+            self.writer.add_categories(added)
+            # Дерево дополняется только новыми узлами, без полной перестройки
+            for category in added:
+                self.ensure_category_item(category)
+
+    def ensure_category_item(self, category):
+        item = self.category_items.get(category)
+        if item is None:
+            parent_path, _, name = category.rpartition(CategoryIndex.SEPARATOR)
+            parent = self.ensure_category_item(parent_path) if parent_path else self.category_tree
+            item = QTreeWidgetItem(parent)
+            item.setData(0, Qt.UserRole, category)
+            item.setExpanded(True)
+            self.category_items[category] = item
+            self.update_category_counts([category])
+        return item
+
+    def update_category_counts(self, categories):
+        for category in categories:
+            item = self.category_items.get(category)
+            if item is not None:
+                name = category.rpartition(CategoryIndex.SEPARATOR)[2]
+                item.setText(0, f"{name} ({self.category_index.count(category)})")
+        if self.all_categories_item is not None:
+            self.all_categories_item.setText(0, f"Все категории ({self.category_index.total()})")
+
+    @metrics.timed('update_category_tree')
     def update_category_tree(self):
         self.category_tree.clear()
-        all_categories = QTreeWidgetItem(self.category_tree)
-        all_categories.setText(0, "Все категории")
-        all_categories.setData(0, Qt.UserRole, "all")
+        self.category_items = {}
+        self.all_categories_item = QTreeWidgetItem(self.category_tree)
+        self.all_categories_item.setData(0, Qt.UserRole, "all")
         for category in self.categories:
-            item = QTreeWidgetItem(self.category_tree)
-            item.setText(0, category)
-            item.setData(0, Qt.UserRole, category)
+            self.ensure_category_item(category)
+        self.update_category_counts([])
+        self.broken_item = QTreeWidgetItem(self.category_tree)
+        self.update_broken_item()
         self.category_tree.expandAll()
 
     def clean_unused_categories(self):
-        used_categories = set(action.category for action in self.actions)
-        unused_categories = [cat for cat in self.categories if cat not in used_categories]
+        unused_categories = [cat for cat in self.categories if not self.category_index.is_used(cat)]
         
         if unused_categories:
             reply = QMessageBox.question(self, "Удалить категории", 
                                          f"Следующие категории не используются:\n{', '.join(unused_categories)}\n\nУдалить их?",
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.categories = list(used_categories)
+                self.categories = [cat for cat in self.categories if self.category_index.is_used(cat)]
+                self.writer.flush()
+                self.store.replace_categories(self.categories)
                 self.update_category_tree()
                 QMessageBox.information(self, "Категории удалены", "Неиспользуемые категории были удалены.")
         else:
             QMessageBox.information(self, "Нет неиспользуемых категорий", "Все категории используются.")
 
-    def save_actions(self):
-        with open('actions.json', 'w', encoding='utf-8') as f:
-            json.dump([{**action.__dict__, 'generated_code': action.generated_code} for action in self.actions], f, ensure_ascii=False, indent=4)
+    @metrics.timed('save_actions')
+    def save_actions(self, actions=None):
+        # Сохраняются только переданные действия, без перезаписи всей библиотеки
+        self.writer.save(self.actions if actions is None else actions)
 
-    def load_actions(self):
+    def migrate_json_library(self):
         try:
-            with open('actions.json', 'r', encoding='utf-8') as f:
-                actions_data = json.load(f)
-                self.actions = []
-                for data in actions_data:
-                    if 'category' not in data:
-                        data['category'] = 'Без категории'
-                    if 'generated_code' not in data:
-                        data['generated_code'] = ''
-                    action = Action(**data)
-                    self.actions.append(action)
-                    self.update_categories([action.category])
-                
-                self.update_action_list()
-                self.update_category_tree()
-        except FileNotFoundError:
-            pass
-        except json.JSONDecodeError:
+            self.store.migrate_from_json()
+        except (json.JSONDecodeError, TypeError, KeyError):
             QMessageBox.warning(self, "Ошибка загрузки", "Файл с действиями поврежден. Начинаем с пустой библиотеки.")
+            self.store.set_meta('json_migrated', 'failed')
+
+    def open_index_snapshot(self):
+        # (снимок, отметка базы до догонки, изменения после снимка) или (None, None, None),
+        # если индексы нужно строить заново
+        snapshot = IndexSnapshot.open(snapshot_path(self.store))
+        if snapshot is None:
+            return None, None, None
+        freshness = snapshot.freshness(self.store)
+        if freshness == 'fresh':
+            return snapshot, None, None
+        if freshness == 'behind':
+            source = source_stamp(self.store)
+            _, changed, deleted = self.store.changed_since(snapshot.version)
+            if len(changed) + len(deleted) <= self.SNAPSHOT_CATCHUP_LIMIT:
+                return snapshot, source, (changed, set(deleted).difference(changed))
+        logging.info(f"Index snapshot {snapshot.path} is {freshness}, rebuilding indexes")
+        snapshot.close()
+        return None, None, None
+
+    def restore_indexes(self, snapshot):
+        # Действия, категории и названия для поиска берутся из снимка; триграммы остаются в файле,
+        # которым теперь владеет поисковый индекс
+        load_body = self.store.load_body
+        self.actions = [Action(name, category=category, id=action_id, loader=load_body)
+                        for action_id, name, category in zip(snapshot.ids, snapshot.names, snapshot.categories)]
+        self.actions_by_id = dict(zip(snapshot.ids, self.actions))
+        self.category_index.restore(snapshot.members, snapshot.totals, zip(snapshot.ids, snapshot.categories))
+        return self.search_index.restore(snapshot, snapshot.ids, snapshot.names)
+
+    def rebuild_indexes(self):
+        source = source_stamp(self.store)
+        self.actions = self.store.load_actions()
+        self.actions_by_id = {action.id: action for action in self.actions}
+        self.category_index.build(self.actions)
+        # До конца сборки поиск ждёт индекс в своём потоке, список и категории доступны сразу
+        generation = self.search_index.clear()
+        QThreadPool.globalInstance().start(IndexSnapshotWorker(self.search_index, generation, self.store, source,
+                                                               self.actions, build=True))
+
+    @metrics.timed('load_actions')
+    def load_actions(self):
+        try:
+            self.writer.flush()
+            self.library_watcher.reset()
+            snapshot, source, changes = self.open_index_snapshot()
+            if snapshot is not None:
+                generation = self.restore_indexes(snapshot)
+            else:
+                self.rebuild_indexes()
+            self.categories = self.store.load_categories()
+            self.update_category_tree()
+            self.update_categories(list(self.category_index.members))
+            self.action_model.set_actions(self.actions)
+            if changes is not None:
+                # Изменения базы после записи снимка применяются точечно, а снимок переписывается,
+                # чтобы следующий запуск не догонял их снова
+                self.reload_actions(*changes)
+                QThreadPool.globalInstance().start(IndexSnapshotWorker(self.search_index, generation, self.store,
+                                                                       source, self.actions))
+            # Индекс похожих действий нужен только в диалоге, поэтому собирается в фоне
+            QThreadPool.globalInstance().start(SimilarityBuildWorker(self.similarity_index, self.store))
+            self.validate_library()
+        except sqlite3.DatabaseError as e:
+            QMessageBox.warning(self, "Ошибка загрузки", f"База данных библиотеки повреждена: {str(e)}")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Произошла непредвиденная ошибка при загрузке действий: {str(e)}")
 
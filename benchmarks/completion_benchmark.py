@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pyatlib.batch import BatchGenerator
+from pyatlib.metrics import metrics
+from pyatlib.settings import Settings
+from pyatlib.stub import CompletionStubServer, IAM_PATH, COMPLETION_PATH
+from library_benchmark import environment, max_rss_bytes
+
+def start_stub(args):
+    server = CompletionStubServer(('127.0.0.1', 0), latency=args.latency, chunk_delay=args.chunk_delay,
+                                  chunks=args.chunks, rate_limit=args.rate_limit, error_rate=args.error_rate,
+                                  token_ttl=args.token_ttl)
+    threading.Thread(target=server.serve_forever, name='completion-stub', daemon=True).start()
+    return server
+
+def create_backend(server):
+    # Настоящий путь генерации: Settings, IamTokenManager и YandexGPTBackend, направленные на заглушку
+    settings = Settings()
+    settings.save_iam_token = lambda: None
+    settings.oauth_token = 'benchmark'
+    settings.iam_url = server.url + IAM_PATH
+    settings.completion_url = server.url + COMPLETION_PATH
+    return settings, settings.create_backend()
+
+def span(name):
+    data = metrics.snapshot()['spans'].get(name)
+    if data is None:
+        return None
+    return {key: data[key] for key in ('count', 'errors', 'p50', 'p95', 'p99', 'max')}
+
+def bench_batch(backend, server, concurrency, requests):
+    metrics.reset()
+    stats_before = dict(server.stats)
+    jobs = [(str(i), f"def test_{concurrency}_{i}(driver):\n    driver.get('https://example.com/{i}')")
+            for i in range(requests)]
+    # Ограничение частоты выставлено выше возможностей заглушки, чтобы мерить саму генерацию
+    generator = BatchGenerator(jobs, "Ты пишешь только код.", backend, concurrency, requests_per_second=10000)
+    start = time.perf_counter()
+    done, failed = generator.run()
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests': done,
+        'failed': failed,
+        'seconds': elapsed,
+        'throughput': done / elapsed if elapsed else None,
+        'latency': span('generate_code_batch'),
+        'server': {key: server.stats[key] - stats_before[key] for key in server.stats},
+    }
+
+def bench_streams(backend, concurrency, requests):
+    # Одновременные потоковые генерации, как при нескольких открытых окнах действий
+    import requests as http
+
+    metrics.reset()
+    session = http.Session()
+    session.mount('http://', http.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def generate(i):
+        with metrics.span('generate_code'):
+            for _ in backend.stream("Ты пишешь только код.", f"stream {concurrency} {i}", session=session):
+                pass
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(generate, range(requests)))
+    elapsed = time.perf_counter() - start
+    session.close()
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'seconds': elapsed,
+        'throughput': requests / elapsed if elapsed else None,
+        'latency': span('generate_code'),
+        'first_chunk': span('completion_first_chunk'),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный замер генерации кода на локальной заглушке")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="запросов на уровень параллельности")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка заглушки перед ответом, с")
+    parser.add_argument("--chunk-delay", type=float, default=0.01)
+    parser.add_argument("--chunks", type=int, default=5)
+    parser.add_argument("--rate-limit", type=float, help="ограничение заглушки, запросов в секунду")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-ttl", type=int, default=3600)
+    parser.add_argument("--output", help="файл с результатами в JSON")
+    args = parser.parse_args()
+
+    metrics.enabled = True
+    server = start_stub(args)
+    os.chdir(tempfile.mkdtemp())
+    settings, backend = create_backend(server)
+    report = {'environment': environment(), 'stub': {key: value for key, value in vars(args).items()
+                                                     if key not in ('concurrency', 'output')},
+              'batch': [], 'stream': []}
+    try:
+        for concurrency in args.concurrency:
+            batch = bench_batch(backend, server, concurrency, args.requests)
+            stream = bench_streams(backend, concurrency, args.requests)
+            report['batch'].append(batch)
+            report['stream'].append(stream)
+            print(f"{concurrency:>4} потоков: пакет {batch['throughput']:.1f}/с, "
+                  f"p95 {batch['latency']['p95'] * 1000:.0f} мс; поток {stream['throughput']:.1f}/с, "
+                  f"первая часть p95 {stream['first_chunk']['p95'] * 1000:.0f} мс")
+    finally:
+        settings.token_manager.stop()
+        server.shutdown()
+        server.server_close()
+    report['max_rss_bytes'] = max_rss_bytes()
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         'completion-' + datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"Результаты: {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QRegExp
+from PyQt5.QtGui import QTextDocument, QTextCursor, QSyntaxHighlighter, QTextCharFormat, QColor
+
+from app import PythonHighlighter
+
+class LegacyHighlighter(QSyntaxHighlighter):
+    # Прежняя реализация: QRegExp на каждое правило и каждый блок
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        text_format = QTextCharFormat()
+        text_format.setForeground(QColor("#569CD6"))
+        patterns = ["\\bdef\\b", "\\bclass\\b", "\\bif\\b", "\\belse\\b", "\\belif\\b",
+                    "\\bfor\\b", "\\bwhile\\b", "\\btry\\b", "\\bexcept\\b", "\\bfinally\\b",
+                    "\\breturn\\b", "\\bimport\\b", "\\bfrom\\b", "\\bas\\b", "\\bpass\\b",
+                    "\\bQ[A-Za-z]+\\b", "\".*\"", "'.*'", "#[^\n]*"]
+        self.highlightingRules = [(QRegExp(pattern), text_format) for pattern in patterns]
+
+    def highlightBlock(self, text):
+        for pattern, format in self.highlightingRules:
+            expression = QRegExp(pattern)
+            index = expression.indexIn(text)
+            while index >= 0:
+                length = expression.matchedLength()
+                self.setFormat(index, length, format)
+                index = expression.indexIn(text, index + length)
+
+def generate_source(lines):
+    template = [
+        'import pytest',
+        'from selenium.webdriver.common.by import By',
+        '',
+        'class TestLogin{n}:',
+        '    """Проверка входа',
+        '    с многострочным описанием"""',
+        '',
+        '    def test_login_{n}(self, driver):',
+        '        driver.get("https://example.com/login?id={n}")  # открыть страницу',
+        "        field = driver.find_element(By.ID, 'username')",
+        '        if field.is_displayed():',
+        '            field.send_keys("user_{n}")',
+        '        else:',
+        '            pytest.fail(f"Поле не найдено: {{field}}")',
+        '        return field',
+        '',
+    ]
+    result = []
+    n = 0
+    while len(result) < lines:
+        result.extend(line.format(n=n) for line in template)
+        n += 1
+    return '\n'.join(result[:lines])
+
+def highlighted_blocks(document):
+    count = 0
+    block = document.begin()
+    while block.isValid():
+        if block.layout().formats():
+            count += 1
+        block = block.next()
+    return count
+
+def measure(highlighter_class, source, repeat):
+    full = []
+    edit = []
+    # В каждой непустой строке шаблона есть что подсветить обоим вариантам
+    expected = sum(1 for line in source.split('\n') if line.strip())
+    for _ in range(repeat):
+        document = QTextDocument()
+        highlighter = highlighter_class(document)
+        start = time.perf_counter()
+        document.setPlainText(source)
+        # Подсветка после setPlainText откладывается до цикла событий, поэтому запускается явно
+        highlighter.rehighlight()
+        full.append(time.perf_counter() - start)
+        highlighted = highlighted_blocks(document)
+        assert highlighted == expected, f"{highlighter_class.__name__}: highlighted {highlighted} of {expected} blocks"
+
+        # Правка в середине документа: перекрашиваются только затронутые блоки
+        cursor = QTextCursor(document.findBlockByNumber(document.blockCount() // 2))
+        start = time.perf_counter()
+        cursor.insertText("x = 'edit'  # правка")
+        edit.append(time.perf_counter() - start)
+        del highlighter
+    return min(full), min(edit)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подсветки синтаксиса")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    print(f"{'lines':>8} {'highlighter':>12} {'full, ms':>10} {'lines/s':>12} {'edit, ms':>10}")
+    for lines in args.lines:
+        source = generate_source(lines)
+        for name, highlighter_class in (("legacy", LegacyHighlighter), ("python", PythonHighlighter)):
+            full, edit = measure(highlighter_class, source, args.repeat)
+            print(f"{lines:>8} {name:>12} {full * 1000:>10.1f} {lines / full:>12.0f} {edit * 1000:>10.2f}")
+
+if __name__ == '__main__':
+    main()
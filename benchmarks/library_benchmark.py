@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import datetime
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pyatlib.models import Action
+from pyatlib.store import ActionStore
+from pyatlib.categories import CategoryIndex
+from pyatlib.search import SearchIndex
+from pyatlib.similarity import SimilarityIndex
+from pyatlib.snapshot import IndexSnapshot, snapshot_path, source_stamp, write_snapshot
+
+CATEGORIES = ["UI", "UI/Login", "UI/Cart", "API", "API/Auth", "DB", "Mobile/Android", "Mobile/iOS"]
+WORDS = ["login", "click", "button", "cart", "order", "token", "driver", "element", "wait", "assert",
+         "поле", "кнопка", "проверка", "страница", "пользователь"]
+QUERIES = ["login", "кнопка", "driver.find_element", "zz", "assert response"]
+
+def make_action(i, rng):
+    words = ' '.join(rng.choice(WORDS) for _ in range(6))
+    code = '\n'.join([
+        f"def test_{i}(driver):",
+        f"    driver.get('https://example.com/{rng.choice(WORDS)}/{i}')",
+        f"    element = driver.find_element(By.ID, '{rng.choice(WORDS)}_{i}')",
+        "    element.click()",
+        f"    assert element.text == '{words}'",
+    ])
+    return Action(f"{rng.choice(WORDS).capitalize()} {i}", f"Проверка: {words}", code,
+                  rng.choice(CATEGORIES), code if i % 3 == 0 else "")
+
+def build_library(path, size, seed=0):
+    rng = random.Random(seed)
+    store = ActionStore(path)
+    chunk = []
+    for i in range(size):
+        chunk.append(make_action(i, rng))
+        if len(chunk) == 10000:
+            store.upsert_actions(chunk)
+            chunk = []
+    if chunk:
+        store.upsert_actions(chunk)
+    store.add_categories(CATEGORIES)
+    store.set_meta('json_migrated', 'benchmark')
+    store.close()
+
+def measure(results, name, func, repeat=1):
+    # Время берётся как минимум по повторам, память - пик tracemalloc за один прогон
+    timings = []
+    value = None
+    for i in range(repeat):
+        if i == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - start)
+        if i == 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    results[name] = {'seconds': min(timings), 'mean_seconds': sum(timings) / len(timings),
+                     'repeat': repeat, 'peak_bytes': peak}
+    print(f"  {name:<32} {min(timings) * 1000:>10.2f} ms {peak / 1024 / 1024:>10.1f} MiB")
+    return value
+
+def bench_core(path, size, repeat):
+    results = {}
+    store = ActionStore(path)
+    actions = measure(results, 'load_actions', store.load_actions, repeat)
+
+    category_index = CategoryIndex()
+    measure(results, 'category_index.build', lambda: category_index.build(actions), repeat)
+
+    search_index = SearchIndex(store.load_search_texts)
+    measure(results, 'search_index.build', lambda: search_index.build(store.iter_search_rows()))
+    for query in QUERIES:
+        measure(results, f'search_actions[{query}]', lambda: search_index.search(query), repeat)
+
+    # Снимок индексов: запись после сборки и восстановление при тёплом запуске
+    index_path = snapshot_path(store)
+    source = source_stamp(store)
+    rows = ([action.id for action in actions], [action.name for action in actions],
+            [action.category for action in actions])
+    measure(results, 'snapshot.write', lambda: write_snapshot(index_path, source, *rows, search_index))
+    restored = SearchIndex(store.load_search_texts)
+    def restore_snapshot():
+        snapshot = IndexSnapshot.open(index_path)
+        category_index.restore(snapshot.members, snapshot.totals, zip(snapshot.ids, snapshot.categories))
+        restored.restore(snapshot, snapshot.ids, snapshot.names)
+    measure(results, 'snapshot.restore', restore_snapshot, repeat)
+    measure(results, f'search_actions[{QUERIES[0]}] snapshot', lambda: restored.search(QUERIES[0]), repeat)
+    restored.clear()
+    os.remove(index_path)
+
+    similarity_index = SimilarityIndex()
+    measure(results, 'similarity_index.build', lambda: similarity_index.build(store.iter_search_rows()))
+    probe = actions[len(actions) // 2]
+    measure(results, 'similar_actions', lambda: similarity_index.similar(probe.name, probe.description, probe.code),
+            repeat)
+
+    for category in ("UI", "API/Auth"):
+        measure(results, f'filter_by_category[{category}]', lambda: category_index.ids_in(category), repeat)
+
+    rng = random.Random(1)
+    sample = [rng.choice(actions) for _ in range(100)]
+    measure(results, 'show_action_details x100', lambda: [action.body() for action in sample], repeat)
+
+    edited = sample[0]
+    edited.description = edited.description + " edited"
+    measure(results, 'save_actions[1 edit]', lambda: store.upsert_actions([edited]), repeat)
+    batch = sample[:100]
+    measure(results, 'save_actions[100 batch]', lambda: store.upsert_actions(batch), repeat)
+    store.close()
+    return results
+
+def bench_gui(path, size, repeat):
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QThreadPool
+    from PyQt5.QtGui import QTextDocument
+
+    import app
+    from benchmarks.highlighter_benchmark import generate_source, highlighted_blocks
+
+    qt_app = QApplication.instance() or QApplication(sys.argv)
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(path))
+    try:
+        # Первый запуск строит поисковый индекс в фоне и сохраняет снимок, второй открывает снимок
+        cold = measure(results, 'gui.startup[cold]', app.AutoTestLibrary)
+        QThreadPool.globalInstance().waitForDone()
+        cold.settings.token_manager.stop()
+        cold.close()
+        window = measure(results, 'gui.startup[snapshot]', app.AutoTestLibrary)
+        measure(results, 'gui.load_actions', window.load_actions, repeat)
+        measure(results, 'gui.update_category_tree', window.update_category_tree, repeat)
+
+        def filter_by(category):
+            window.selected_category = category
+            window.refresh_category_filter()
+        for category in ("UI", None):
+            measure(results, f'gui.filter_by_category[{category or "all"}]', lambda: filter_by(category), repeat)
+
+        for query in QUERIES[:2]:
+            ids = window.search_index.search(query)
+            measure(results, f'gui.search_actions[{query}]', lambda: window.action_proxy.set_search_results(ids), repeat)
+        window.action_proxy.set_search_results(None)
+
+        rng = random.Random(2)
+        sample = [rng.choice(window.actions) for _ in range(20)]
+        measure(results, 'gui.show_action_details x20',
+                lambda: [window.display_action_details(action) for action in sample], repeat)
+
+        # Переключение между действиями с большим сгенерированным кодом: первый показ строит
+        # документы, повторные берут их из кэша карточки
+        large = [Action(f"Large {i}", "", generate_source(2000), "UI", generate_source(20000)) for i in range(4)]
+        window.action_details.cache.clear()
+        measure(results, 'gui.show_action_details[20000 lines] first x4',
+                lambda: [window.display_action_details(action) for action in large])
+        measure(results, 'gui.show_action_details[20000 lines] cached x4',
+                lambda: [window.display_action_details(action) for action in large], repeat)
+        window.display_action_details(None)
+
+        source = generate_source(20000)
+        def highlight():
+            document = QTextDocument()
+            highlighter = app.PythonHighlighter(document)
+            document.setPlainText(source)
+            # Без явного rehighlight подсветка отложилась бы до цикла событий и в замер не попала
+            highlighter.rehighlight()
+            return document, highlighter
+        document, _ = measure(results, 'gui.highlighter[20000 lines]', highlight, repeat)
+        expected = sum(1 for line in source.split('\n') if line.strip())
+        assert highlighted_blocks(document) == expected, "highlighter skipped blocks"
+        QThreadPool.globalInstance().waitForDone()
+        window.settings.token_manager.stop()
+        window.close()
+    finally:
+        os.chdir(cwd)
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'commit': commit,
+    }
+
+def max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк операций библиотеки на синтетических данных")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--gui", action="store_true", help="замерить также GUI (offscreen Qt)")
+    parser.add_argument("--output", help="файл с результатами в JSON")
+    args = parser.parse_args()
+
+    report = {'environment': environment(), 'runs': []}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.db')
+            print(f"{size} actions")
+            start = time.perf_counter()
+            build_library(path, size)
+            run = {'size': size, 'build_seconds': time.perf_counter() - start,
+                   'db_bytes': os.path.getsize(path), 'results': bench_core(path, size, args.repeat)}
+            if args.gui:
+                run['results'].update(bench_gui(path, size, args.repeat))
+            run['max_rss_bytes'] = max_rss_bytes()
+            report['runs'].append(run)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"Результаты: {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# Ядро библиотеки автотестера без зависимости от Qt.
+# Модули импортируются при первом обращении, чтобы CLI запускался быстро.
+import importlib
+
+_EXPORTS = {
+    'Action': 'models',
+    'ActionStore': 'store',
+    'CompletionCache': 'cache',
+    'CategoryIndex': 'categories',
+    'SearchIndex': 'search',
+    'IndexSnapshot': 'snapshot',
+    'SimilarityIndex': 'similarity',
+    'Settings': 'settings',
+    'IamTokenManager': 'settings',
+    'CodeFormatter': 'yandexgpt',
+    'CompletionBackend': 'completion',
+    'create_backend': 'completion',
+    'CompletionStubServer': 'stub',
+    'BatchGenerator': 'batch',
+    'SnippetValidator': 'validation',
+    'TestPackageExporter': 'testexport',
+    'Importer': 'transfer',
+    'LibraryServer': 'server',
+    'RemoteLibrary': 'remote',
+    'LibrarySync': 'remote',
+    'LibraryWatcher': 'watch',
+    'WriteBehindQueue': 'persistence',
+    'ActionHistory': 'history',
+    'metrics': 'metrics',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f'.{module}', __name__), name)
@@ -0,0 +1,155 @@
+import time
+import random
+import logging
+import threading
+
+from .metrics import metrics
+from .validation import check_source
+from .yandexgpt import CodeFormatter
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self, cancelled):
+        # Каждый вызов резервирует следующий слот, ожидание идёт вне блокировки
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        return not cancelled.wait(delay) if delay > 0 else not cancelled.is_set()
+
+class BatchGenerator:
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = 120
+    MAX_RETRIES = 5
+    BACKOFF = 1.0
+    COMMIT_BATCH_SIZE = 25
+
+    def __init__(self, jobs, system_prompt, backend, concurrency=8, requests_per_second=5.0, cache=None,
+                 on_progress=None, on_results=None):
+        self.jobs = jobs
+        self.system_prompt = system_prompt
+        self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.cache = cache
+        self.on_progress = on_progress
+        self.on_results = on_results
+        self.cancelled = threading.Event()
+        self.done = 0
+        self.failed = 0
+        # Задания, отменённые пользователем: не ошибки и не входят в done
+        self.skipped = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def create_session(self):
+        import requests
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def retry_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.BACKOFF * 2 ** attempt + random.uniform(0, self.BACKOFF)
+
+    def request_completion(self, session, user_code):
+        import requests
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            if not self.rate_limiter.wait(self.cancelled):
+                return None
+            response = None
+            try:
+                response = self.backend.request(session, self.system_prompt, user_code,
+                                                timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return self.backend.extract_text(response.json())
+                metrics.increment(f'completion_http_{response.status_code}')
+                if attempt == self.MAX_RETRIES:
+                    response.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.MAX_RETRIES:
+                    raise
+            logging.info(f"Retrying completion, attempt {attempt + 1}")
+            if self.cancelled.wait(self.retry_delay(response, attempt)):
+                return None
+        return None
+
+    def generate(self, session, action_id, user_code):
+        key = self.backend.cache_key(self.system_prompt, user_code)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None and check_source(cached) is None:
+                return action_id, cached
+        with metrics.span('generate_code_batch'):
+            text = self.request_completion(session, user_code)
+        if text is None:
+            return action_id, None
+        formatter = CodeFormatter()
+        formatter.feed(text)
+        generated_code = formatter.finish()
+        # Код, который не разбирается, не сохраняется и считается ошибкой генерации
+        error = check_source(generated_code)
+        if error is not None:
+            raise ValueError(f"Generated code for {action_id} does not parse: {error}")
+        if self.cache is not None and generated_code:
+            self.cache.put(key, generated_code)
+        return action_id, generated_code
+
+    def emit_results(self, results):
+        if self.on_results is not None:
+            self.on_results(results)
+
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+
+        pending = []
+        session = self.create_session()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = [executor.submit(self.generate, session, action_id, user_code)
+                           for action_id, user_code in self.jobs]
+                for future in as_completed(futures):
+                    try:
+                        action_id, generated_code = future.result()
+                        # None без ошибки означает, что ожидание запроса прервала отмена
+                        if generated_code is None and self.cancelled.is_set():
+                            self.skipped += 1
+                        else:
+                            self.done += 1
+                        if generated_code:
+                            pending.append((action_id, generated_code))
+                    except CancelledError:
+                        self.skipped += 1
+                    except Exception as e:
+                        self.done += 1
+                        self.failed += 1
+                        logging.error(f"Batch generation error: {str(e)}")
+                    if self.on_progress is not None:
+                        self.on_progress(self.done, self.failed, self.skipped)
+                    # Результаты отдаются пачками, чтобы сохранять их одной транзакцией
+                    if len(pending) >= self.COMMIT_BATCH_SIZE:
+                        self.emit_results(pending)
+                        pending = []
+                    if self.cancelled.is_set():
+                        for other in futures:
+                            other.cancel()
+        finally:
+            session.close()
+            if pending:
+                self.emit_results(pending)
+        if self.skipped:
+            logging.info(f"Batch generation cancelled, skipped {self.skipped} jobs")
+        return self.done, self.failed
@@ -0,0 +1,82 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from .metrics import metrics
+
+class CompletionCache:
+    def __init__(self, path='completion_cache.db', max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions(last_used)")
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def make_key(system_prompt, user_code, model_uri, temperature, max_tokens):
+        data = json.dumps([system_prompt, user_code, model_uri, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT text FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.increment('completion_cache_misses_total')
+                return None
+            self.hits += 1
+            metrics.increment('completion_cache_hits_total')
+            with self.connection:
+                self.connection.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, text):
+        size = len(text.encode('utf-8'))
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self.connection.execute("INSERT OR REPLACE INTO completions(key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                                    (key, text, size, time.time()))
+            self.total_bytes += size
+            self.evict()
+
+    def evict(self):
+        # Удаляем давно не использованные ответы, пока кэш не уложится в лимит
+        while self.total_bytes > self.max_bytes:
+            row = self.connection.execute(
+                "SELECT key, size FROM completions ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                self.total_bytes = 0
+                break
+            self.connection.execute("DELETE FROM completions WHERE key = ?", (row[0],))
+            self.total_bytes -= row[1]
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM completions")
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': self.total_bytes}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
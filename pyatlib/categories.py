@@ -0,0 +1,77 @@
+from collections import defaultdict, Counter
+
+class CategoryIndex:
+    SEPARATOR = '/'
+
+    def __init__(self):
+        self.members = defaultdict(set)
+        self.category_of = {}
+        self.totals = Counter()
+
+    @classmethod
+    def lineage(cls, category):
+        # "UI/Login/Form" -> ["UI", "UI/Login", "UI/Login/Form"]
+        parts = category.split(cls.SEPARATOR)
+        return [cls.SEPARATOR.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+    def build(self, actions):
+        self.members.clear()
+        self.category_of.clear()
+        self.totals.clear()
+        for action in actions:
+            self.add(action.id, action.category)
+
+    def restore(self, members, totals, category_of):
+        # Готовое состояние из снимка индексов, без разбора путей категорий
+        self.members.clear()
+        self.members.update(members)
+        self.category_of.clear()
+        self.category_of.update(category_of)
+        self.totals.clear()
+        self.totals.update(totals)
+
+    def add(self, action_id, category):
+        self.members[category].add(action_id)
+        self.category_of[action_id] = category
+        paths = self.lineage(category)
+        for path in paths:
+            self.totals[path] += 1
+        return paths
+
+    def remove(self, action_id):
+        category = self.category_of.pop(action_id, None)
+        if category is None:
+            return []
+        members = self.members[category]
+        members.discard(action_id)
+        if not members:
+            del self.members[category]
+        paths = self.lineage(category)
+        for path in paths:
+            self.totals[path] -= 1
+            if not self.totals[path]:
+                del self.totals[path]
+        return paths
+
+    def move(self, action_id, category):
+        if self.category_of.get(action_id) == category:
+            return []
+        return self.remove(action_id) + self.add(action_id, category)
+
+    def count(self, category):
+        return self.totals.get(category, 0)
+
+    def total(self):
+        return len(self.category_of)
+
+    def ids_in(self, category):
+        # Действия категории вместе со всеми вложенными подкатегориями
+        prefix = category + self.SEPARATOR
+        result = set(self.members.get(category, ()))
+        for name, ids in self.members.items():
+            if name.startswith(prefix):
+                result |= ids
+        return result
+
+    def is_used(self, category):
+        return self.count(category) > 0
@@ -0,0 +1,317 @@
+import sys
+import argparse
+
+from .store import ActionStore
+
+def open_store(args):
+    store = ActionStore(args.db)
+    store.migrate_from_json()
+    return store
+
+def resolve_action(store, reference):
+    actions = store.find_actions(reference)
+    if not actions:
+        raise SystemExit(f"Действие не найдено: {reference}")
+    if len(actions) > 1:
+        ids = ', '.join(action.id for action in actions)
+        raise SystemExit(f"Найдено несколько действий ({ids}), укажите идентификатор")
+    return actions[0]
+
+def read_text(value, path):
+    if path == '-':
+        return sys.stdin.read()
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return value or ""
+
+def cmd_list(store, args):
+    for row in store.list_summaries(args.category):
+        print(f"{row['id']}\t{row['category']}\t{row['name']}")
+
+def search_rows(store, query):
+    from .search import match_score
+
+    query = query.lower()
+    results = []
+    for position, (action_id, name, description, code) in enumerate(store.iter_search_rows()):
+        score = match_score(query, name, description, code)
+        if score:
+            results.append((-score, position, action_id, name))
+    results.sort()
+    return [(action_id, name) for _, _, action_id, name in results]
+
+def cmd_search(store, args):
+    for action_id, name in search_rows(store, args.query)[:args.limit]:
+        print(f"{action_id}\t{name}")
+
+def cmd_show(store, args):
+    action = resolve_action(store, args.action)
+    if args.field:
+        print(getattr(action, args.field))
+        return
+    print(f"Название: {action.name}\n")
+    print(f"Категория: {action.category}\n")
+    print(f"Описание: {action.description}\n")
+    print(f"Код:\n{action.code}\n")
+    print(f"Сгенерированный код:\n{action.generated_code}")
+
+def cmd_add(store, args):
+    from .models import Action
+
+    action = Action(args.name, read_text(args.description, args.description_file),
+                    read_text(args.code, args.code_file), args.category)
+    store.upsert_action(action)
+    store.add_categories([action.category])
+    print(action.id)
+
+def cmd_generate(store, args):
+    from .cache import CompletionCache
+    from .settings import Settings
+    from .yandexgpt import CodeFormatter
+
+    action = resolve_action(store, args.action)
+    settings = Settings(store)
+    settings.load()
+    backend = settings.create_backend()
+    cache = None if args.no_cache else CompletionCache()
+    key = backend.cache_key(settings.system_prompt, action.code)
+    generated_code = cache.get(key) if cache is not None else None
+    if generated_code is None:
+        formatter = CodeFormatter()
+        formatter.feed(backend.complete(settings.system_prompt, action.code))
+        generated_code = formatter.finish()
+        if cache is not None and generated_code:
+            cache.put(key, generated_code)
+    if args.save:
+        action.generated_code = generated_code
+        store.upsert_action(action)
+    print(generated_code)
+
+def cmd_export(store, args):
+    from .transfer import export_actions
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        export_actions(store, output, args.format, args.category)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+def cmd_import(store, args):
+    from .transfer import Importer, iter_file, detect_format
+
+    def report(stats):
+        print(f"\r{stats.read} записей, {stats.rate:.0f}/с", end='', file=sys.stderr, flush=True)
+
+    importer = Importer(store, args.conflict, args.batch_size, None if args.quiet else report)
+    if args.path == '-':
+        stats = importer.run(iter_file(sys.stdin, args.format or 'json'))
+    else:
+        stats = importer.import_file(args.path, args.format)
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(stats.summary())
+
+def cmd_export_tests(store, args):
+    from .testexport import TestPackageExporter
+
+    action_ids = [action_id for action_id, _ in search_rows(store, args.query)] if args.query else None
+    exporter = TestPackageExporter(store, args.directory, args.source, args.workers)
+    print(exporter.export(args.category, action_ids).summary())
+
+def cmd_check(store, args):
+    from .validation import SnippetValidator
+
+    broken = SnippetValidator(store, args.workers).run()
+    names = {action_id: name for action_id, name, _, _ in store.iter_search_rows()} if broken else {}
+    for action_id, errors in broken.items():
+        for field, error in errors.items():
+            print(f"{action_id}\t{names.get(action_id, '')}\t{field}\t{error}")
+    return 1 if broken else 0
+
+def cmd_serve(store, args):
+    from .server import serve
+
+    serve(store, args.host, args.port, args.token)
+
+def cmd_sync(store, args):
+    from .remote import RemoteLibrary, LibrarySync
+
+    remote = RemoteLibrary(args.url, args.token)
+    try:
+        sync = LibrarySync(store, remote)
+        if args.upload:
+            print(f"Отправлено на сервер: {sync.upload_local()}")
+        result = sync.pull()
+        if result is None:
+            print(f"Изменений нет, версия {sync.version}")
+        else:
+            changed, deleted, reset = result
+            print(f"Версия {sync.version}: изменено {len(changed)}, удалено {len(deleted)}"
+                  + (", полная синхронизация" if reset else ""))
+    finally:
+        remote.close()
+
+def cmd_stub_server(store, args):
+    from .stub import serve_stub, IAM_PATH, COMPLETION_PATH
+
+    url = f"http://{args.host}:{args.port}"
+    print(f"Адрес генерации: {url}{COMPLETION_PATH}\nАдрес IAM: {url}{IAM_PATH}", file=sys.stderr)
+    serve_stub(args.host, args.port, latency=args.latency, chunk_delay=args.chunk_delay, chunks=args.chunks,
+               rate_limit=args.rate_limit, error_rate=args.error_rate, token_ttl=args.token_ttl)
+
+def history_action_id(store, history, reference):
+    # Удалённое действие ищется только по полному идентификатору
+    if history.revisions(reference):
+        return reference
+    return resolve_action(store, reference).id
+
+def cmd_history(store, args):
+    from .history import ActionHistory, KIND_LABELS, diff_states
+
+    history = ActionHistory(store)
+    if args.compact:
+        print(f"Удалено ревизий: {history.compact(args.keep, args.days)}")
+        return
+    if args.action is None:
+        for action_id, created, state in history.deleted_actions(args.limit):
+            print(f"{action_id}\t{created}\t{state['category']}\t{state['name']}")
+        return
+    action_id = history_action_id(store, history, args.action)
+    revisions = history.revisions(action_id)
+    if args.diff is not None:
+        previous = None
+        for revision in revisions:
+            if revision['id'] == args.diff:
+                print('\n'.join(diff_states(previous, revision['state'])) or "Без изменений")
+                return
+            previous = revision['state']
+        raise SystemExit(f"Ревизия не найдена: {args.diff}")
+    for revision in revisions:
+        print(f"{revision['id']}\t{revision['created']}\t{KIND_LABELS.get(revision['kind'], revision['kind'])}\t"
+              f"{revision['state']['name']}")
+
+def cmd_restore(store, args):
+    from .history import ActionHistory
+
+    history = ActionHistory(store)
+    action_id = history_action_id(store, history, args.action)
+    revisions = history.revisions(action_id)
+    if args.revision is not None:
+        revisions = [revision for revision in revisions if revision['id'] == args.revision]
+    if not revisions:
+        raise SystemExit(f"Ревизия не найдена: {args.revision if args.revision is not None else args.action}")
+    state = revisions[-1]['state']
+    store.write_batch([dict(state, id=action_id)], categories=[state['category']], history=history)
+    print(f"Восстановлено: {action_id}\t{state['name']}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pyatlib', description="Библиотека автотестера без графического интерфейса")
+    parser.add_argument('--db', default='library.db', help="путь к базе библиотеки")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="список действий")
+    list_parser.add_argument('--category', help="только категория и её подкатегории")
+    list_parser.set_defaults(handler=cmd_list)
+
+    search_parser = commands.add_parser('search', help="поиск по названию, описанию и коду")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=50)
+    search_parser.set_defaults(handler=cmd_search)
+
+    show_parser = commands.add_parser('show', help="показать действие")
+    show_parser.add_argument('action', help="идентификатор, его префикс или название")
+    show_parser.add_argument('--field', choices=['name', 'category', 'description', 'code', 'generated_code'])
+    show_parser.set_defaults(handler=cmd_show)
+
+    add_parser = commands.add_parser('add', help="добавить действие")
+    add_parser.add_argument('--name', required=True)
+    add_parser.add_argument('--category', default="Без категории")
+    add_parser.add_argument('--description')
+    add_parser.add_argument('--description-file', help="файл с описанием или - для stdin")
+    add_parser.add_argument('--code')
+    add_parser.add_argument('--code-file', help="файл с кодом или - для stdin")
+    add_parser.set_defaults(handler=cmd_add)
+
+    generate_parser = commands.add_parser('generate', help="сгенерировать код через YandexGPT")
+    generate_parser.add_argument('action', help="идентификатор, его префикс или название")
+    generate_parser.add_argument('--no-cache', action='store_true', help="не использовать кэш генерации")
+    generate_parser.add_argument('--save', action='store_true', help="сохранить результат в действие")
+    generate_parser.set_defaults(handler=cmd_generate)
+
+    export_parser = commands.add_parser('export', help="выгрузить действия")
+    export_parser.add_argument('--category')
+    export_parser.add_argument('--format', choices=['json', 'ndjson'], default='json')
+    export_parser.add_argument('-o', '--output', help="файл для выгрузки, по умолчанию stdout")
+    export_parser.set_defaults(handler=cmd_export)
+
+    import_parser = commands.add_parser('import', help="загрузить действия из JSON или NDJSON")
+    import_parser.add_argument('path', help="файл для загрузки или - для stdin")
+    import_parser.add_argument('--format', choices=['json', 'ndjson'], help="по умолчанию определяется по файлу")
+    import_parser.add_argument('--conflict', choices=['rename', 'skip', 'replace', 'keep'], default='rename',
+                               help="что делать с совпадающими названиями")
+    import_parser.add_argument('--batch-size', type=int, default=2000)
+    import_parser.add_argument('-q', '--quiet', action='store_true', help="не выводить прогресс")
+    import_parser.set_defaults(handler=cmd_import)
+
+    tests_parser = commands.add_parser('export-tests', help="собрать пакет pytest из действий")
+    tests_parser.add_argument('directory', help="каталог пакета; повторная выгрузка обновляет только изменённые модули")
+    tests_parser.add_argument('--category', help="только категория и её подкатегории")
+    tests_parser.add_argument('--query', help="только действия, найденные поиском")
+    tests_parser.add_argument('--source', choices=['generated', 'code'], default='generated',
+                              help="брать сгенерированный код, если он есть, или всегда исходный")
+    tests_parser.add_argument('--workers', type=int, default=8)
+    tests_parser.set_defaults(handler=cmd_export_tests)
+
+    serve_parser = commands.add_parser('serve', help="раздавать библиотеку клиентам по HTTP")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--token', help="общий токен, который клиенты передают в Authorization")
+    serve_parser.set_defaults(handler=cmd_serve)
+
+    sync_parser = commands.add_parser('sync', help="забрать изменения с сервера библиотеки")
+    sync_parser.add_argument('url', help="адрес сервера, например http://127.0.0.1:8765")
+    sync_parser.add_argument('--token')
+    sync_parser.add_argument('--upload', action='store_true',
+                             help="сначала отправить локальные действия на сервер и пересобрать зеркало")
+    sync_parser.set_defaults(handler=cmd_sync)
+
+    stub_parser = commands.add_parser('stub-server', help="локальная заглушка IAM и YandexGPT")
+    stub_parser.add_argument('--host', default='127.0.0.1')
+    stub_parser.add_argument('--port', type=int, default=8799)
+    stub_parser.add_argument('--latency', type=float, default=0.0, help="задержка перед ответом, с")
+    stub_parser.add_argument('--chunk-delay', type=float, default=0.0, help="задержка между частями потока, с")
+    stub_parser.add_argument('--chunks', type=int, default=5, help="частей в потоковом ответе")
+    stub_parser.add_argument('--rate-limit', type=float, help="запросов в секунду, сверх - ответ 429")
+    stub_parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 500")
+    stub_parser.add_argument('--token-ttl', type=int, default=3600, help="срок жизни IAM-токена, с")
+    stub_parser.set_defaults(handler=cmd_stub_server)
+
+    history_parser = commands.add_parser('history', help="ревизии действия или список удалённых действий")
+    history_parser.add_argument('action', nargs='?', help="идентификатор, его префикс или название; "
+                                                         "без него выводятся удалённые действия")
+    history_parser.add_argument('--diff', type=int, metavar='REVISION', help="показать изменения ревизии")
+    history_parser.add_argument('--limit', type=int, default=50)
+    history_parser.add_argument('--compact', action='store_true', help="удалить старые ревизии")
+    history_parser.add_argument('--keep', type=int, default=50, help="ревизий на действие при --compact")
+    history_parser.add_argument('--days', type=int, default=90, help="срок хранения ревизий при --compact")
+    history_parser.set_defaults(handler=cmd_history)
+
+    restore_parser = commands.add_parser('restore', help="восстановить действие из истории")
+    restore_parser.add_argument('action', help="идентификатор, его префикс или название")
+    restore_parser.add_argument('--revision', type=int, help="по умолчанию последняя ревизия")
+    restore_parser.set_defaults(handler=cmd_restore)
+
+    check_parser = commands.add_parser('check', help="проверить синтаксис кода всех действий")
+    check_parser.add_argument('--workers', type=int, help="число процессов проверки")
+    check_parser.set_defaults(handler=cmd_check)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    store = open_store(args)
+    try:
+        return args.handler(store, args) or 0
+    finally:
+        store.close()
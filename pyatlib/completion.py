@@ -0,0 +1,96 @@
+import json
+import time
+import logging
+
+from .metrics import metrics
+
+class StaticTokenSource:
+    # Постоянный токен: для заглушки, тестов и бенчмарков
+    def __init__(self, token):
+        self.token = token
+
+    def get_token(self):
+        return self.token
+
+    def refresh_token(self):
+        return self.token
+
+class CompletionBackend:
+    # Источник генерации кода. Реализация знает адрес, формат запроса и ответа,
+    # а токен берёт у token_source: get_token() и refresh_token() после ответа 401
+    name = None
+
+    def __init__(self, token_source):
+        self.token_source = token_source
+
+    def cache_key(self, system_prompt, user_code):
+        raise NotImplementedError
+
+    def send(self, session, system_prompt, user_code, token, stream=False, timeout=(10, 120)):
+        # Отправляет запрос и возвращает ответ requests как есть, без проверки статуса
+        raise NotImplementedError
+
+    def extract_text(self, data):
+        raise NotImplementedError
+
+    def request(self, session, system_prompt, user_code, stream=False, timeout=(10, 120)):
+        # Просроченный токен обновляется один раз и запрос повторяется
+        response = self.send(session, system_prompt, user_code, self.token_source.get_token(), stream, timeout)
+        if response.status_code == 401:
+            response.close()
+            logging.info("Completion token rejected, refreshing")
+            response = self.send(session, system_prompt, user_code, self.token_source.refresh_token(), stream, timeout)
+        return response
+
+    def complete(self, system_prompt, user_code, session=None, connect_timeout=10, read_timeout=120):
+        import requests
+
+        response = self.request(session or requests, system_prompt, user_code,
+                                timeout=(connect_timeout, read_timeout))
+        if not response.ok:
+            logging.error(f"API Error Response: {response.text}")
+        response.raise_for_status()
+        return self.extract_text(response.json())
+
+    def stream(self, system_prompt, user_code, session=None, cancelled=None,
+               connect_timeout=10, read_timeout=60, total_timeout=300):
+        # Ответ в режиме stream приходит построчно, каждая строка содержит весь текст на текущий момент
+        import requests
+
+        started = time.perf_counter()
+        response = self.request(session or requests, system_prompt, user_code, stream=True,
+                                timeout=(connect_timeout, read_timeout))
+        try:
+            if not response.ok:
+                logging.error(f"API Error Response: {response.text}")
+            response.raise_for_status()
+
+            deadline = time.monotonic() + total_timeout
+            first = True
+            for line in response.iter_lines(decode_unicode=True):
+                if cancelled is not None and cancelled.is_set():
+                    return
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(f"Генерация не завершилась за {total_timeout} с")
+                if line:
+                    if first and metrics.enabled:
+                        metrics.observe('completion_first_chunk', time.perf_counter() - started)
+                    first = False
+                    yield self.extract_text(json.loads(line))
+        finally:
+            response.close()
+
+BACKENDS = {}
+
+def register_backend(name, factory):
+    BACKENDS[name] = factory
+
+def create_backend(name, token_source, **options):
+    if name not in BACKENDS:
+        # Встроенные реализации регистрируются при импорте своих модулей
+        from . import yandexgpt
+    try:
+        factory = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown completion backend: {name}")
+    return factory(token_source, **options)
@@ -0,0 +1,284 @@
+import json
+import zlib
+import difflib
+import datetime
+import logging
+from datetime import timezone
+from collections import OrderedDict
+
+from .metrics import metrics
+
+FIELDS = ('name', 'description', 'code', 'category', 'generated_code')
+FIELD_LABELS = {
+    'name': "Название",
+    'description': "Описание",
+    'code': "Код",
+    'category': "Категория",
+    'generated_code': "Сгенерированный код",
+}
+KIND_LABELS = {
+    'base': "исходная",
+    'add': "создание",
+    'edit': "правка",
+    'delete': "удаление",
+    'restore': "восстановление",
+}
+# Короткие значения выгоднее хранить целиком, чем списком операций
+INLINE_LIMIT = 80
+
+def pack(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+
+def unpack(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def state_of(record):
+    return {field: record.get(field) or "" for field in FIELDS}
+
+def make_delta(old, new):
+    # Для изменившегося поля хранятся ссылки на неизменные диапазоны строк
+    # старого текста ([начало, конец]) и только новые строки
+    delta = {}
+    for field in FIELDS:
+        before, after = old[field], new[field]
+        if before == after:
+            continue
+        if len(after) <= INLINE_LIMIT:
+            delta[field] = after
+            continue
+        before_lines = before.splitlines(keepends=True)
+        after_lines = after.splitlines(keepends=True)
+        operations = []
+        matcher = difflib.SequenceMatcher(None, before_lines, after_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                operations.append([i1, i2])
+            elif j2 > j1:
+                operations.append(''.join(after_lines[j1:j2]))
+        delta[field] = operations
+    return delta
+
+def apply_delta(old, delta):
+    new = dict(old)
+    for field, operations in delta.items():
+        if isinstance(operations, str):
+            new[field] = operations
+            continue
+        lines = old[field].splitlines(keepends=True)
+        new[field] = ''.join(''.join(lines[op[0]:op[1]]) if isinstance(op, list) else op for op in operations)
+    return new
+
+def diff_states(old, new):
+    # Построчный diff по всем изменившимся полям; old=None - действия ещё не было
+    old = old or state_of({})
+    lines = []
+    for field in FIELDS:
+        if old[field] == new[field]:
+            continue
+        label = FIELD_LABELS[field]
+        lines.extend(difflib.unified_diff(old[field].splitlines(), new[field].splitlines(),
+                                          f"{label} (было)", f"{label} (стало)", lineterm=''))
+    return lines
+
+class ActionHistory:
+    # Ревизии действий хранятся прямыми дельтами от предыдущей ревизии; каждая
+    # KEYFRAME_INTERVAL-я записывается целиком, поэтому для восстановления любой
+    # ревизии достаточно применить не больше KEYFRAME_INTERVAL - 1 дельт
+    KEYFRAME_INTERVAL = 16
+    CACHE_SIZE = 256
+
+    def __init__(self, store):
+        self.store = store
+        # Последняя ревизия действия: (id ревизии, состояние, дельт после опорной)
+        self.latest = OrderedDict()
+
+    @property
+    def connection(self):
+        return self.store.connection
+
+    def _remember(self, action_id, entry):
+        self.latest[action_id] = entry
+        self.latest.move_to_end(action_id)
+        while len(self.latest) > self.CACHE_SIZE:
+            self.latest.popitem(last=False)
+
+    def forget(self, action_ids):
+        # Транзакция с ревизиями откатилась: кэш мог запомнить несохранённые состояния
+        with self.store.lock:
+            for action_id in action_ids:
+                self.latest.pop(action_id, None)
+
+    def _rows(self, action_id, upto=None):
+        # Ревизии начиная с последней опорной до upto включительно
+        upto = upto if upto is not None else -1
+        return self.connection.execute("""
+            SELECT id, created, kind, keyframe, data FROM revisions
+            WHERE action_id = ?1 AND (?2 < 0 OR id <= ?2) AND id >= (
+                SELECT COALESCE(MAX(id), 0) FROM revisions
+                WHERE action_id = ?1 AND keyframe = 1 AND (?2 < 0 OR id <= ?2)
+            )
+            ORDER BY id
+        """, (action_id, upto)).fetchall()
+
+    def _replay(self, rows):
+        state = None
+        chain = 0
+        for row in rows:
+            if row['keyframe']:
+                state = unpack(row['data'])
+                chain = 0
+            else:
+                state = apply_delta(state, unpack(row['data']))
+                chain += 1
+        return state, chain
+
+    def _latest(self, action_id):
+        entry = self.latest.get(action_id)
+        if entry is None:
+            rows = self._rows(action_id)
+            if not rows:
+                return None
+            state, chain = self._replay(rows)
+            entry = (rows[-1]['id'], state, chain)
+            self._remember(action_id, entry)
+        return entry
+
+    def _insert(self, action_id, kind, state, created):
+        latest = self._latest(action_id)
+        if latest is None or latest[2] + 1 >= self.KEYFRAME_INTERVAL:
+            keyframe, data, chain = 1, pack(state), 0
+        else:
+            keyframe, data, chain = 0, pack(make_delta(latest[1], state)), latest[2] + 1
+        cursor = self.connection.execute(
+            "INSERT INTO revisions(action_id, created, kind, keyframe, data) VALUES (?, ?, ?, ?, ?)",
+            (action_id, created, kind, keyframe, data))
+        self._remember(action_id, (cursor.lastrowid, state, chain))
+
+    def record(self, records, deleted_ids):
+        # Вызывается из ActionStore.write_batch внутри транзакции, до изменения действий.
+        # Если действие менялось в обход истории (импорт, CLI), сначала сохраняется
+        # его состояние в базе как исходная ревизия, чтобы правку можно было откатить
+        created = datetime.datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with self.store.lock:
+            current = {record['id']: state_of(record)
+                       for record in self.store.get_records([record['id'] for record in records] + list(deleted_ids))}
+            for record in records:
+                action_id = record['id']
+                state = state_of(record)
+                before = current.get(action_id)
+                latest = self._latest(action_id)
+                if before is not None and (latest is None or latest[1] != before):
+                    self._insert(action_id, 'base', before, created)
+                    latest = self._latest(action_id)
+                if before is not None and before == state:
+                    continue
+                if before is not None:
+                    kind = 'edit'
+                else:
+                    kind = 'restore' if latest is not None else 'add'
+                self._insert(action_id, kind, state, created)
+            for action_id in deleted_ids:
+                before = current.get(action_id)
+                if before is None:
+                    continue
+                latest = self._latest(action_id)
+                if latest is None or latest[1] != before:
+                    self._insert(action_id, 'base', before, created)
+                self._insert(action_id, 'delete', before, created)
+
+    def revisions(self, action_id):
+        # Все ревизии действия от старых к новым, каждая с восстановленным состоянием
+        with self.store.lock:
+            rows = self.connection.execute(
+                "SELECT id, created, kind, keyframe, data FROM revisions WHERE action_id = ? ORDER BY id",
+                (action_id,)).fetchall()
+        revisions = []
+        state = None
+        for row in rows:
+            state = unpack(row['data']) if row['keyframe'] else apply_delta(state, unpack(row['data']))
+            revisions.append({'id': row['id'], 'created': row['created'], 'kind': row['kind'], 'state': state})
+        return revisions
+
+    def revision(self, action_id, revision_id):
+        with self.store.lock:
+            rows = self._rows(action_id, revision_id)
+        if not rows or rows[-1]['id'] != revision_id:
+            return None
+        return self._replay(rows)[0]
+
+    def deleted_actions(self, limit=50):
+        # Удалённые действия, последняя ревизия которых - удаление: (id, время, состояние)
+        with self.store.lock:
+            rows = self.connection.execute("""
+                SELECT r.id, r.action_id, r.created FROM revisions r
+                WHERE r.kind = 'delete'
+                  AND r.id = (SELECT MAX(id) FROM revisions WHERE action_id = r.action_id)
+                  AND NOT EXISTS (SELECT 1 FROM actions WHERE id = r.action_id)
+                ORDER BY r.id DESC LIMIT ?
+            """, (limit,)).fetchall()
+        return [(row['action_id'], row['created'], self.revision(row['action_id'], row['id'])) for row in rows]
+
+    @metrics.timed('history_compact')
+    def compact(self, max_revisions=50, max_days=90):
+        # Оставляет не больше max_revisions последних ревизий действия и только моложе
+        # max_days дней; первая оставшаяся ревизия переписывается целиком, если была дельтой
+        cutoff = (datetime.datetime.now(timezone.utc) - datetime.timedelta(days=max_days)).isoformat(timespec='seconds')
+        with self.store.lock:
+            action_ids = [row[0] for row in self.connection.execute(
+                "SELECT action_id FROM revisions GROUP BY action_id HAVING COUNT(*) > ? OR MIN(created) < ?",
+                (max_revisions, cutoff))]
+        removed = 0
+        for action_id in action_ids:
+            with self.store.lock, self.connection:
+                rows = self.connection.execute(
+                    "SELECT id, created, keyframe, data FROM revisions WHERE action_id = ? ORDER BY id",
+                    (action_id,)).fetchall()
+                keep = max(0, len(rows) - max_revisions)
+                while keep < len(rows) and rows[keep]['created'] < cutoff:
+                    keep += 1
+                if keep == 0:
+                    continue
+                if keep < len(rows) and not rows[keep]['keyframe']:
+                    state, _ = self._replay(self._rows(action_id, rows[keep]['id']))
+                    self.connection.execute("UPDATE revisions SET keyframe = 1, data = ? WHERE id = ?",
+                                            (pack(state), rows[keep]['id']))
+                self.connection.execute("DELETE FROM revisions WHERE action_id = ? AND id < ?",
+                                        (action_id, rows[keep]['id'] if keep < len(rows) else rows[-1]['id'] + 1))
+                self.latest.pop(action_id, None)
+                removed += keep
+        if removed:
+            logging.info(f"History compaction removed {removed} revisions of {len(action_ids)} actions")
+        return removed
+
+class UndoStack:
+    # Операции окна для отмены и повтора в пределах сеанса: каждая хранит состояния
+    # затронутых действий до и после (None - действия нет)
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.done = []
+        self.undone = []
+
+    def push(self, label, changes):
+        # changes: id -> (запись до, запись после)
+        changes = {action_id: pair for action_id, pair in changes.items() if pair[0] != pair[1]}
+        if not changes:
+            return
+        self.done.append((label, changes))
+        del self.done[:-self.limit]
+        self.undone.clear()
+
+    def undo_label(self):
+        return self.done[-1][0] if self.done else None
+
+    def redo_label(self):
+        return self.undone[-1][0] if self.undone else None
+
+    def undo(self):
+        label, changes = self.done.pop()
+        self.undone.append((label, changes))
+        return label, {action_id: before for action_id, (before, after) in changes.items()}
+
+    def redo(self):
+        label, changes = self.undone.pop()
+        self.done.append((label, changes))
+        return label, {action_id: after for action_id, (before, after) in changes.items()}
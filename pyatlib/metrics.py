@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import functools
+import threading
+from collections import deque
+
+class Histogram:
+    # Границы корзин в секундах, как в гистограммах Prometheus
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, window=2048):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bucket_counts = [0] * len(self.BUCKETS)
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentile(self, samples, q):
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self):
+        # Перцентили считаются по последним замерам из скользящего окна
+        samples = sorted(self.samples)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(samples, 0.50),
+            'p95': self.percentile(samples, 0.95),
+            'p99': self.percentile(samples, 0.99),
+            'buckets': dict(zip(self.BUCKETS, self.bucket_counts)),
+        }
+
+class Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def span(self, name):
+        # При выключенных замерах возвращается общий пустой объект без обращения к часам
+        return Span(self, name) if self.enabled else NULL_SPAN
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Span(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds, error=False):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds, error)
+
+    def increment(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'spans': {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def export_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=4)
+
+    def export_prometheus(self, prefix='pyatlib'):
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot['spans']:
+            metric = f"{prefix}_span_duration_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, data in snapshot['spans'].items():
+                cumulative = 0
+                for bound, count in data['buckets'].items():
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{span="{name}",le="+Inf"}} {data["count"]}')
+                lines.append(f'{metric}_sum{{span="{name}"}} {data["sum"]}')
+                lines.append(f'{metric}_count{{span="{name}"}} {data["count"]}')
+            lines.append(f"# TYPE {prefix}_span_errors_total counter")
+            for name, data in snapshot['spans'].items():
+                lines.append(f'{prefix}_span_errors_total{{span="{name}"}} {data["errors"]}')
+        for name, value in snapshot['counters'].items():
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.append(f"{prefix}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(enabled=os.environ.get('PYATLIB_METRICS') == '1')
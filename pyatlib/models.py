@@ -0,0 +1,40 @@
+import uuid
+
+def body_property(field):
+    return property(lambda self: self.body()[field],
+                    lambda self, value: self.set_body_field(field, value))
+
+class Action:
+    # В памяти держатся только идентификатор, название и категория;
+    # описание и код подгружаются из хранилища по требованию
+    __slots__ = ('id', 'name', 'category', '_body', '_loader')
+
+    def __init__(self, name, description="", code="", category=None, generated_code=None, id=None, loader=None):
+        self.id = id if id is not None else uuid.uuid4().hex
+        self.name = name
+        self.category = category if category is not None else "Без категории"
+        self._loader = loader
+        self._body = None
+        if loader is None:
+            self._body = {
+                'description': description,
+                'code': code,
+                'generated_code': generated_code if generated_code is not None else ""
+            }
+
+    description = body_property('description')
+    code = body_property('code')
+    generated_code = body_property('generated_code')
+
+    def body(self):
+        return self._body if self._body is not None else self._loader(self.id)
+
+    def set_body_field(self, field, value):
+        # Несохранённые изменения держатся в объекте до записи в хранилище
+        if self._body is None:
+            self._body = dict(self._loader(self.id))
+        self._body[field] = value
+
+    def attach(self, loader):
+        self._loader = loader
+        self._body = None
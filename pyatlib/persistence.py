@@ -0,0 +1,206 @@
+import time
+import sqlite3
+import logging
+import threading
+
+from .store import WriteConflict
+from .metrics import metrics
+
+def action_snapshot(action):
+    # Снимок берётся в момент сохранения: дальнейшие правки объекта попадут в следующую запись
+    return {'id': action.id, 'name': action.name, 'description': action.description, 'code': action.code,
+            'category': action.category, 'generated_code': action.generated_code}
+
+class WriteBehindQueue:
+    # Отложенная запись: изменения копятся в памяти и сохраняются фоновым потоком
+    # одной транзакцией. Серия правок за DELAY секунд сливается в одну запись,
+    # из нескольких сохранений одного действия пишется последнее
+    DELAY = 0.3
+    RETRY_INTERVALS = (0.5, 2, 5, 15)
+
+    def __init__(self, store, delay=None, on_state=None, on_flushed=None, on_conflict=None, on_error=None,
+                 history=None):
+        self.store = store
+        self.history = history
+        self.delay = self.DELAY if delay is None else delay
+        self.on_state = on_state
+        self.on_flushed = on_flushed
+        self.on_conflict = on_conflict
+        self.on_error = on_error
+        self.condition = threading.Condition()
+        self.upserts = {}
+        self.deletes = set()
+        self.categories = {}
+        self.expected = {}
+        self.inflight = set()
+        self.saving = False
+        self.deadline = None
+        self.failures = 0
+        self.closed = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+            self.thread.start()
+
+    def has_pending(self):
+        with self.condition:
+            return bool(self.upserts or self.deletes or self.categories or self.saving)
+
+    def pending_ids(self):
+        # Действия, которые ещё не записаны или записываются прямо сейчас
+        with self.condition:
+            return set(self.upserts) | self.deletes | self.inflight
+
+    def report_state(self):
+        if self.on_state is not None:
+            with self.condition:
+                pending = len(self.upserts) + len(self.deletes) + len(self.categories)
+                saving = self.saving
+            self.on_state(pending, saving)
+
+    def schedule(self):
+        # Вызывается под condition; первая правка в серии задаёт момент записи
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.delay
+        self.condition.notify_all()
+
+    def save(self, actions, expected=None):
+        # expected: id -> версия действия, прочитанная до правки; сравнивается при записи
+        records = [action_snapshot(action) for action in actions]
+        self.save_records(records, expected)
+
+    def save_records(self, records, expected=None):
+        with self.condition:
+            for record in records:
+                self.upserts[record['id']] = record
+                self.deletes.discard(record['id'])
+            for action_id, version in (expected or {}).items():
+                # При слиянии правок сравнивать нужно с версией до первой из них
+                self.expected.setdefault(action_id, version)
+            self.schedule()
+        self.report_state()
+
+    def delete(self, action_ids):
+        with self.condition:
+            for action_id in action_ids:
+                self.upserts.pop(action_id, None)
+                self.expected.pop(action_id, None)
+                self.deletes.add(action_id)
+            self.schedule()
+        self.report_state()
+
+    def add_categories(self, categories):
+        with self.condition:
+            self.categories.update(dict.fromkeys(categories))
+            self.schedule()
+        self.report_state()
+
+    def take_batch(self):
+        records = list(self.upserts.values())
+        deleted = set(self.deletes)
+        categories = list(self.categories)
+        expected = {action_id: version for action_id, version in self.expected.items() if action_id in self.upserts}
+        self.upserts = {}
+        self.deletes = set()
+        self.categories = {}
+        self.expected = {}
+        self.inflight = {record['id'] for record in records} | deleted
+        return records, deleted, categories, expected
+
+    def restore_batch(self, records, deleted, categories, expected):
+        # Неудавшийся пакет возвращается в очередь; правки, сделанные за время записи, новее
+        for record in records:
+            if record['id'] not in self.upserts and record['id'] not in self.deletes:
+                self.upserts[record['id']] = record
+                if record['id'] in expected:
+                    self.expected.setdefault(record['id'], expected[record['id']])
+        for action_id in deleted:
+            if action_id not in self.upserts:
+                self.deletes.add(action_id)
+        for category in categories:
+            self.categories.setdefault(category, None)
+
+    @metrics.timed('write_behind_flush')
+    def write(self, records, deleted, categories, expected):
+        try:
+            self.store.write_batch(records, deleted, categories, expected, self.history)
+            return records, []
+        except WriteConflict as e:
+            # Действия без конфликта записываются, конфликтующие отдаются на решение пользователю
+            conflicts = set(e.action_ids)
+            kept = [record for record in records if record['id'] not in conflicts]
+            expected = {action_id: version for action_id, version in expected.items() if action_id not in conflicts}
+            self.store.write_batch(kept, deleted, categories, expected, self.history)
+            return kept, [record for record in records if record['id'] in conflicts]
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not (self.upserts or self.deletes or self.categories):
+                    self.condition.wait()
+                if self.closed and not (self.upserts or self.deletes or self.categories):
+                    return
+                remaining = self.deadline - time.monotonic() if self.deadline is not None else 0
+                if remaining > 0 and not self.closed:
+                    self.condition.wait(remaining)
+                    continue
+                batch = self.take_batch()
+                self.deadline = None
+                self.saving = True
+            self.report_state()
+            try:
+                written, conflicts = self.write(*batch)
+            except (sqlite3.Error, WriteConflict) as e:
+                # База занята или недоступна: пакет остаётся в очереди до следующей попытки
+                logging.error(f"Write-behind flush failed: {e}")
+                with self.condition:
+                    self.restore_batch(*batch)
+                    self.saving = False
+                    self.inflight = set()
+                    delay = self.RETRY_INTERVALS[min(self.failures, len(self.RETRY_INTERVALS) - 1)]
+                    self.deadline = time.monotonic() + delay
+                    self.failures += 1
+                    self.condition.notify_all()
+                if self.failures == 1 and self.on_error is not None:
+                    self.on_error(str(e))
+                self.report_state()
+                if self.closed:
+                    return
+                continue
+            with self.condition:
+                self.saving = False
+                self.inflight = set()
+                self.failures = 0
+                self.condition.notify_all()
+            if self.on_flushed is not None:
+                self.on_flushed([record['id'] for record in written] + list(batch[1]))
+            if conflicts and self.on_conflict is not None:
+                self.on_conflict(conflicts)
+            self.report_state()
+
+    def flush(self, timeout=10.0):
+        # Немедленная запись всего накопленного; возвращает False, если не успели
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            # Срок сдвигается только для накопленных правок: иначе следующая правка
+            # после пустого сброса записалась бы сразу, без ожидания
+            if self.upserts or self.deletes or self.categories:
+                self.deadline = time.monotonic()
+                self.condition.notify_all()
+            while self.upserts or self.deletes or self.categories or self.saving:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.thread is None or not self.thread.is_alive():
+                    return False
+                self.condition.wait(remaining)
+                if self.failures:
+                    return False
+        return True
+
+    def close(self, timeout=10.0):
+        flushed = self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        return flushed
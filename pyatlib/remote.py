@@ -0,0 +1,231 @@
+import json
+import gzip
+import logging
+import threading
+
+from .metrics import metrics
+
+class RemoteLibrary:
+    # Клиент сервера общей библиотеки; соединения переиспользуются через одну сессию
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self._session = requests.Session()
+            self._session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+            self._session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+            if self.token:
+                self._session.headers['Authorization'] = f"Bearer {self.token}"
+        return self._session
+
+    def request(self, method, path, timeout=None, **kwargs):
+        response = self.session.request(method, self.url + path, timeout=timeout or self.timeout, **kwargs)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def changes(self, since, wait=0, limit=5000):
+        # None означает, что с версии since ничего не изменилось (304)
+        with metrics.span('remote_changes'):
+            response = self.request('GET', '/changes', params={'since': since, 'wait': wait, 'limit': limit},
+                                    headers={'If-None-Match': f'"{since}"'}, timeout=self.timeout + wait)
+        if response.status_code == 304:
+            return None
+        return response.json()
+
+    def push_actions(self, records):
+        with metrics.span('remote_push'):
+            return self.request('POST', '/actions', json={'actions': records}).json()
+
+    def delete_action(self, action_id):
+        return self.request('DELETE', f'/actions/{action_id}').json()
+
+    def add_categories(self, categories):
+        return self.request('POST', '/categories', json={'categories': list(categories)}).json()
+
+    def upload(self, records, conflict='skip'):
+        body = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+        return self.request('POST', '/import', params={'conflict': conflict}, data=gzip.compress(body),
+                            headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/x-ndjson'},
+                            timeout=max(self.timeout, 60)).json()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+class LibrarySync:
+    # Локальная база работает как зеркало сервера: в ней хранится последняя полученная
+    # версия, и при синхронизации запрашиваются только изменения после неё
+    UPLOAD_BATCH_SIZE = 5000
+
+    def __init__(self, store, remote):
+        self.store = store
+        self.remote = remote
+        if store.get_meta('remote_url') != remote.url:
+            store.set_meta('remote_url', remote.url)
+            store.set_meta('remote_version', 0)
+
+    @property
+    def version(self):
+        return int(self.store.get_meta('remote_version', 0))
+
+    def pull(self, wait=0):
+        # Возвращает (изменённые идентификаторы, удалённые идентификаторы, сброс)
+        # или None, если изменений нет
+        changed = set()
+        deleted = set()
+        reset = False
+        data = self.remote.changes(self.version, wait)
+        if data is None:
+            return None
+        while True:
+            if data.get('reset') and not reset:
+                # Сервер не знает нашей версии: локальное зеркало собирается заново
+                logging.info(f"Library server {self.remote.url} requested full resync")
+                self.store.clear_actions()
+                changed.clear()
+                reset = True
+            self.store.apply_remote_changes(data['actions'], data['deleted'], data['categories'])
+            self.store.set_meta('remote_version', data['version'])
+            changed.update(record['id'] for record in data['actions'])
+            changed.difference_update(data['deleted'])
+            deleted.update(data['deleted'])
+            if not data['more']:
+                break
+            data = self.remote.changes(self.version)
+        deleted.difference_update(changed)
+        return changed, deleted, reset
+
+    def upload_local(self, conflict='skip'):
+        # Перенос локальной библиотеки на сервер при первом подключении;
+        # после него локальная база пересобирается как зеркало сервера
+        uploaded = 0
+        records = []
+        for record in self.store.iter_records():
+            records.append(record)
+            if len(records) >= self.UPLOAD_BATCH_SIZE:
+                uploaded += self.remote.upload(records, conflict)['imported']
+                records = []
+        if records:
+            uploaded += self.remote.upload(records, conflict)['imported']
+        self.store.clear_actions()
+        self.store.set_meta('remote_version', 0)
+        return uploaded
+
+def action_record(action):
+    return {'id': action.id, 'name': action.name, 'description': action.description, 'code': action.code,
+            'category': action.category, 'generated_code': action.generated_code}
+
+class RemoteImporter:
+    # Импорт файла в режиме сервера: записи отправляются на сервер пакетами,
+    # дедупликация и политика конфликтов применяются там
+    def __init__(self, remote, conflict='rename', batch_size=5000, on_progress=None):
+        from .transfer import ImportStats
+
+        self.remote = remote
+        self.conflict = conflict
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.cancelled = False
+        self.stats = ImportStats()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def send(self, batch):
+        result = self.remote.upload(batch, self.conflict)
+        for field in ('read', 'imported', 'replaced', 'renamed', 'duplicates', 'skipped', 'errors'):
+            setattr(self.stats, field, getattr(self.stats, field) + result[field])
+        self.stats.tick()
+        if self.on_progress is not None:
+            self.on_progress(self.stats)
+
+    def run(self, items):
+        batch = []
+        for item in items:
+            if self.cancelled:
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.send(batch)
+                batch = []
+        if batch and not self.cancelled:
+            self.send(batch)
+        self.stats.tick()
+        return self.stats
+
+    def import_file(self, path, fmt=None):
+        from .transfer import detect_format, iter_file
+
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            return self.run(iter_file(f, fmt or detect_format(path)))
+
+class SyncLoop:
+    # Фоновый долгий опрос сервера; изменения отдаются через on_changes, а локальные
+    # правки отправляются на сервер по одной в порядке их сохранения
+    WAIT = 25
+    RETRY_INTERVALS = (2, 5, 15, 30, 60)
+
+    def __init__(self, sync, on_changes=None, on_error=None):
+        self.sync = sync
+        self.pusher = RemoteLibrary(sync.remote.url, sync.remote.token, sync.remote.timeout)
+        self.on_changes = on_changes
+        self.on_error = on_error
+        self.stopped = threading.Event()
+        self.thread = None
+        self.executor = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='library-sync', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.pusher.close()
+        self.sync.remote.close()
+
+    def report(self, message):
+        logging.error(f"Library sync error: {message}")
+        if self.on_error is not None and not self.stopped.is_set():
+            self.on_error(message)
+
+    def run(self):
+        failures = 0
+        while not self.stopped.is_set():
+            try:
+                result = self.sync.pull(wait=self.WAIT)
+            except Exception as e:
+                # Об ошибке сообщается один раз, дальше повторяем молча с нарастающей паузой
+                if not failures:
+                    self.report(str(e))
+                self.stopped.wait(self.RETRY_INTERVALS[min(failures, len(self.RETRY_INTERVALS) - 1)])
+                failures += 1
+                continue
+            failures = 0
+            if result is not None and self.on_changes is not None and not self.stopped.is_set():
+                self.on_changes(result)
+
+    def submit(self, func, *args):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='library-push')
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda done: done.exception() and self.report(str(done.exception())))
+        return future
+
+    def push(self, actions):
+        return self.submit(self.pusher.push_actions, [action_record(action) for action in actions])
+
+    def delete(self, action_id):
+        return self.submit(self.pusher.delete_action, action_id)
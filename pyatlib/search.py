@@ -0,0 +1,214 @@
+import threading
+from array import array
+from itertools import islice
+from collections import defaultdict
+
+from .metrics import metrics
+
+def match_score(query, name, description, code):
+    # Совпадение в названии важнее совпадения в описании, а оно важнее совпадения в коде;
+    # query передаётся в нижнем регистре; 0 означает, что совпадения нет
+    name = (name or "").lower()
+    if query in name:
+        return 4 if name.startswith(query) else 3
+    if query in (description or "").lower():
+        return 2
+    if query in (code or "").lower():
+        return 1
+    return 0
+
+class DocumentNumbers(dict):
+    # Номера документов снимка; удалённые и добавленные после его начала документы получают MISSING
+    MISSING = 0xFFFFFFFF
+
+    def __missing__(self, action_id):
+        return self.MISSING
+
+class SearchIndex:
+    GRAM_SIZE = 3
+    VERIFY_CHUNK = 256
+    BUILD_CHUNK = 500
+    READY_POLL = 0.1
+
+    def __init__(self, text_loader):
+        # В памяти хранятся только триграммы и названия; описание и код для проверки
+        # совпадения читаются из хранилища через text_loader
+        self._lock = threading.RLock()
+        self._text_loader = text_loader
+        self._postings = defaultdict(set)
+        self._names = {}
+        self._order = {}
+        self._counter = 0
+        # Триграммы из снимка индексов остаются в отображённом файле; _postings дополняет их
+        # документами, изменёнными после загрузки снимка
+        self._base = None
+        self._generation = 0
+        self._ready = threading.Event()
+        self._ready.set()
+
+    def _grams(self, text):
+        n = self.GRAM_SIZE
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def _release_base(self):
+        if self._base is not None:
+            self._base.close()
+            self._base = None
+
+    def clear(self):
+        # Пока индекс не заполнен через extend, поиск ждёт его готовности
+        with self._lock:
+            self._release_base()
+            self._postings.clear()
+            self._names.clear()
+            self._order.clear()
+            self._counter = 0
+            self._generation += 1
+            self._ready.clear()
+            return self._generation
+
+    def extend(self, rows, generation=None):
+        # Блокировка берётся на пачку строк, чтобы правки из интерфейса не ждали всю сборку.
+        # False - индекс успели очистить заново, и эта сборка больше не нужна
+        generation = self._generation if generation is None else generation
+        rows = iter(rows)
+        try:
+            while True:
+                chunk = list(islice(rows, self.BUILD_CHUNK))
+                if not chunk:
+                    return True
+                with self._lock:
+                    if generation != self._generation:
+                        return False
+                    for action_id, name, description, code in chunk:
+                        self.add_document(action_id, name, description, code)
+        finally:
+            with self._lock:
+                if generation == self._generation:
+                    self._ready.set()
+
+    def build(self, rows):
+        self.extend(rows, self.clear())
+
+    def restore(self, base, ids, names):
+        # base - снимок с методами lookup(gram) и close(); ids и names в порядке списка действий
+        with self._lock:
+            self._release_base()
+            self._postings.clear()
+            self._base = base
+            self._names = {action_id: (name or "").lower() for action_id, name in zip(ids, names)}
+            self._order = dict(zip(ids, range(len(ids))))
+            self._counter = len(ids)
+            self._generation += 1
+            self._ready.set()
+            return self._generation
+
+    def add_document(self, action_id, name, description, code):
+        with self._lock:
+            self._names[action_id] = (name or "").lower()
+            if action_id not in self._order:
+                self._order[action_id] = self._counter
+                self._counter += 1
+            for text in (name, description, code):
+                for gram in self._grams((text or "").lower()):
+                    self._postings[gram].add(action_id)
+
+    def add(self, action):
+        self.add_document(action.id, action.name, action.description, action.code)
+
+    def update(self, action):
+        # Устаревшие триграммы не удаляются: лишние кандидаты отсекаются проверкой текста
+        self.add(action)
+
+    def remove(self, action_id):
+        with self._lock:
+            self._names.pop(action_id, None)
+
+    def forget(self, action_id):
+        with self._lock:
+            self.remove(action_id)
+            self._order.pop(action_id, None)
+
+    def _posting(self, gram):
+        overlay = self._postings.get(gram)
+        base = self._base.lookup(gram) if self._base is not None else None
+        if base is None:
+            return overlay
+        return base | overlay if overlay else base
+
+    def export(self, ids, generation=None):
+        # Триграммы для записи снимка: номер триграммы, границы её документов в postings
+        # и номера документов по списку ids; документы вне ids пропускаются.
+        # None - индекс очистили или заменили во время выгрузки
+        generation = self._generation if generation is None else generation
+        numbers = DocumentNumbers(zip(ids, range(len(ids))))
+        with self._lock:
+            grams = set(self._postings)
+            if self._base is not None:
+                grams.update(self._base.grams)
+        numbering = {}
+        offsets = array('I', [0])
+        postings = array('I')
+        for gram in grams:
+            with self._lock:
+                if generation != self._generation:
+                    return None
+                documents = self._posting(gram)
+                documents = array('I', map(numbers.__getitem__, documents)) if documents else None
+            if documents and DocumentNumbers.MISSING in documents:
+                documents = array('I', (number for number in documents if number != DocumentNumbers.MISSING))
+            if documents:
+                numbering[gram] = len(numbering)
+                postings.extend(documents)
+                offsets.append(len(postings))
+        return numbering, offsets, postings
+
+    def _candidates(self, query):
+        if len(query) < self.GRAM_SIZE:
+            return list(self._names)
+        postings = [self._posting(gram) for gram in self._grams(query)]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            candidates &= keys
+            if not candidates:
+                break
+        return [action_id for action_id in candidates if action_id in self._names]
+
+    @metrics.timed('search_actions')
+    def search(self, query, is_cancelled=None):
+        # Возвращает идентификаторы действий в порядке убывания релевантности
+        query = query.lower()
+        while not self._ready.wait(self.READY_POLL):
+            if is_cancelled is not None and is_cancelled():
+                metrics.increment('search_cancelled_total')
+                return None
+        with self._lock:
+            if not query:
+                return sorted(self._names, key=self._order.__getitem__)
+            candidates = self._candidates(query)
+            names = {action_id: self._names[action_id] for action_id in candidates}
+            order = {action_id: self._order[action_id] for action_id in candidates}
+
+        results = []
+        for start in range(0, len(candidates), self.VERIFY_CHUNK):
+            if is_cancelled is not None and is_cancelled():
+                metrics.increment('search_cancelled_total')
+                return None
+            chunk = candidates[start:start + self.VERIFY_CHUNK]
+            pending = []
+            for action_id in chunk:
+                score = match_score(query, names[action_id], "", "")
+                if score:
+                    results.append((-score, order[action_id], action_id))
+                else:
+                    pending.append(action_id)
+            texts = self._text_loader(pending) if pending else {}
+            for action_id, (description, code) in texts.items():
+                score = match_score(query, "", description, code)
+                if score:
+                    results.append((-score, order[action_id], action_id))
+        results.sort(key=lambda result: result[:2])
+        return [action_id for _, _, action_id in results]
@@ -0,0 +1,198 @@
+import io
+import re
+import gzip
+import json
+import time
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from .models import Action
+from .metrics import metrics
+
+ACTION_PATH = r'/actions/([^/]+)'
+MAX_WAIT = 60.0
+GZIP_MIN_BYTES = 1024
+
+class LibraryServer(ThreadingHTTPServer):
+    # Общая библиотека для нескольких клиентов: клиенты забирают изменения по номеру версии,
+    # а долгий опрос /changes?wait=... заменяет рассылку изменений с сервера
+    daemon_threads = True
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, address, store, token=None):
+        super().__init__(address, LibraryRequestHandler)
+        self.store = store
+        self.token = token
+        self.changed = threading.Condition()
+
+    def notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def wait_for_change(self, since, timeout):
+        # База может меняться и в обход сервера (CLI, импорт), поэтому версия
+        # перечитывается не реже раза в POLL_INTERVAL
+        deadline = time.monotonic() + timeout
+        while True:
+            version = self.store.library_version()
+            remaining = deadline - time.monotonic()
+            if version != since or remaining <= 0:
+                return version
+            with self.changed:
+                self.changed.wait(min(remaining, self.POLL_INTERVAL))
+
+class LibraryRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'pyatlib'
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def send_json(self, status, data, etag=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {'error': message})
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def read_json(self):
+        return json.loads(self.read_body() or b'{}')
+
+    def authorized(self):
+        token = self.server.token
+        if token and self.headers.get('Authorization') != f"Bearer {token}":
+            self.read_body()
+            self.send_error_json(401, "unauthorized")
+            return False
+        return True
+
+    def dispatch(self, routes):
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if not self.authorized():
+            return
+        with metrics.span(f'server_{self.command.lower()}'):
+            try:
+                for pattern, handler in routes:
+                    match = re.fullmatch(pattern, url.path)
+                    if match is not None:
+                        return handler(*match.groups())
+                self.read_body()
+                self.send_error_json(404, "not found")
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_error_json(400, str(e))
+
+    def do_GET(self):
+        self.dispatch([('/version', self.get_version), ('/changes', self.get_changes), (ACTION_PATH, self.get_action)])
+
+    def do_POST(self):
+        self.dispatch([('/actions', self.post_actions), ('/categories', self.post_categories),
+                       ('/import', self.post_import)])
+
+    def do_DELETE(self):
+        self.dispatch([(ACTION_PATH, self.delete_action)])
+
+    def get_version(self):
+        version = self.server.store.library_version()
+        self.send_json(200, {'version': version}, etag=f'"{version}"')
+
+    def get_changes(self):
+        # Клиент присылает свою версию в since и If-None-Match; если библиотека
+        # не изменилась за время ожидания, отвечаем 304 без тела
+        since = int(self.query.get('since', 0))
+        limit = max(1, min(int(self.query.get('limit', 5000)), 50000))
+        wait = min(float(self.query.get('wait', 0)), MAX_WAIT)
+        store = self.server.store
+        version = self.server.wait_for_change(since, wait) if wait > 0 else store.library_version()
+        etag = f'"{version}"'
+        if version == since and self.headers.get('If-None-Match') == etag:
+            self.send_not_modified(etag)
+            return
+        if since > version:
+            # База сервера заменена или откатилась: клиенту нужна полная синхронизация
+            changes = store.changes_since(0, limit)
+            changes['reset'] = True
+        else:
+            changes = store.changes_since(since, limit)
+        self.send_json(200, changes, etag=f'"{changes["version"]}"')
+
+    def get_action(self, action_id):
+        records = self.server.store.get_records([action_id])
+        if not records:
+            self.send_error_json(404, "not found")
+            return
+        etag = f'"{records[0]["version"]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_not_modified(etag)
+            return
+        self.send_json(200, records[0], etag=etag)
+
+    def post_actions(self):
+        data = self.read_json()
+        actions = [Action(record['name'], record.get('description', ""), record.get('code', ""),
+                          record.get('category'), record.get('generated_code'), record.get('id'))
+                   for record in data['actions']]
+        store = self.server.store
+        store.upsert_actions(actions)
+        store.add_categories(dict.fromkeys(action.category for action in actions))
+        self.server.notify()
+        self.send_json(200, {'version': store.library_version(), 'ids': [action.id for action in actions]})
+
+    def delete_action(self, action_id):
+        self.read_body()
+        store = self.server.store
+        store.delete_action(action_id)
+        self.server.notify()
+        self.send_json(200, {'version': store.library_version()})
+
+    def post_categories(self):
+        data = self.read_json()
+        store = self.server.store
+        store.add_categories(data['categories'])
+        self.server.notify()
+        self.send_json(200, {'version': store.library_version()})
+
+    def post_import(self):
+        # Тело - NDJSON; дубликаты по коду отсекаются так же, как при импорте из файла
+        from .transfer import Importer, iter_ndjson
+
+        conflict = self.query.get('conflict', 'rename')
+        stream = io.TextIOWrapper(io.BytesIO(self.read_body()), encoding='utf-8')
+        stats = Importer(self.server.store, conflict).run(iter_ndjson(stream))
+        self.server.notify()
+        self.send_json(200, dict(stats.to_dict(), version=self.server.store.library_version()))
+
+def serve(store, host='127.0.0.1', port=8765, token=None):
+    server = LibraryServer((host, port), store, token)
+    logging.info(f"Serving library {store.path} on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,216 @@
+import json
+import logging
+import datetime
+import threading
+from datetime import timezone
+
+from .metrics import metrics
+
+IAM_URL = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
+
+class IamTokenManager:
+    REFRESH_MARGIN = datetime.timedelta(minutes=10)
+    RETRY_INTERVAL = 60
+    MAX_SLEEP = 3600
+
+    def __init__(self, settings, on_error=None):
+        # Сессия и пул потоков создаются при первом обновлении токена
+        self.settings = settings
+        self.on_error = on_error
+        self.session = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.inflight = None
+        self.executor = None
+        self.thread = None
+
+    def is_fresh(self, margin=datetime.timedelta(0)):
+        return bool(self.settings.iam_token) and \
+            datetime.datetime.now(timezone.utc) < self.settings.iam_token_expires - margin
+
+    def peek_token(self):
+        # Неблокирующий доступ: None, если действующего токена сейчас нет
+        return self.settings.iam_token if self.is_fresh() else None
+
+    def get_token(self, timeout=None):
+        if self.is_fresh():
+            return self.settings.iam_token
+        return self.refresh().result(timeout)
+
+    def refresh_token(self, timeout=None):
+        # Сервер отверг токен раньше срока: берётся новый, не дожидаясь планового обновления
+        return self.refresh().result(timeout)
+
+    def refresh(self):
+        # Все одновременные вызовы разделяют один запрос к IAM
+        with self.lock:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='iam-token')
+            if self.inflight is not None:
+                return self.inflight
+            future = self.inflight = self.executor.submit(self.do_refresh)
+        # Вне блокировки: у уже завершённого запроса обработчик вызывается сразу в этом потоке
+        future.add_done_callback(self.refresh_done)
+        return future
+
+    def refresh_done(self, future):
+        # Запрос освобождается только после того, как его результат выставлен: вызовы,
+        # пришедшие раньше, получают этот же результат, а не запускают второй запрос
+        with self.lock:
+            if self.inflight is future:
+                self.inflight = None
+        self.wakeup.set()
+
+    def do_refresh(self):
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        self.settings.refresh_iam_token(self.session)
+        return self.settings.iam_token
+
+    def seconds_until_refresh(self):
+        refresh_at = self.settings.iam_token_expires - self.REFRESH_MARGIN
+        return (refresh_at - datetime.datetime.now(timezone.utc)).total_seconds()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='iam-token-refresh', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        if self.session is not None:
+            self.session.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            delay = self.seconds_until_refresh()
+            if delay <= 0 and self.settings.oauth_token:
+                try:
+                    self.refresh().result()
+                    continue
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error(str(e))
+                    delay = self.RETRY_INTERVAL
+            elif delay <= 0:
+                delay = self.RETRY_INTERVAL
+            self.wakeup.wait(min(delay, self.MAX_SLEEP))
+            self.wakeup.clear()
+
+class Settings:
+    def __init__(self, store=None):
+        self.store = store
+        self.token_manager = IamTokenManager(self)
+        self.oauth_token = ""
+        self.iam_token = ""
+        self.iam_token_expires = datetime.datetime.now(timezone.utc)
+        self.system_prompt = "Ты должен писать только код. И ничего больше. \nТы используешь PyTest, Python в написании кода.\nА так же используешь Chrome в качестве основного браузера. \nВ конце ничего так же не требуется писать."
+        self.batch_concurrency = 8
+        self.batch_requests_per_second = 5.0
+        self.server_url = ""
+        self.server_token = ""
+        self.history_max_revisions = 50
+        self.history_max_days = 90
+        # Пустые адреса означают стандартные адреса Yandex Cloud
+        self.backend = 'yandexgpt'
+        self.completion_url = ""
+        self.model_uri = ""
+        self.iam_url = ""
+    
+    def to_dict(self):
+        return {
+            'oauth_token': self.oauth_token,
+            'iam_token': self.iam_token,
+            'iam_token_expires': self.iam_token_expires.isoformat(),
+            'system_prompt': self.system_prompt,
+            'batch_concurrency': self.batch_concurrency,
+            'batch_requests_per_second': self.batch_requests_per_second,
+            'server_url': self.server_url,
+            'server_token': self.server_token,
+            'history_max_revisions': self.history_max_revisions,
+            'history_max_days': self.history_max_days,
+            'backend': self.backend,
+            'completion_url': self.completion_url,
+            'model_uri': self.model_uri,
+            'iam_url': self.iam_url
+        }
+
+    def from_dict(self, data):
+        self.oauth_token = data.get('oauth_token', "")
+        self.iam_token = data.get('iam_token', "")
+        self.iam_token_expires = datetime.datetime.fromisoformat(data.get('iam_token_expires', datetime.datetime.now(timezone.utc).isoformat()))
+        self.system_prompt = data.get('system_prompt', self.system_prompt)
+        self.batch_concurrency = data.get('batch_concurrency', self.batch_concurrency)
+        self.batch_requests_per_second = data.get('batch_requests_per_second', self.batch_requests_per_second)
+        self.server_url = data.get('server_url', self.server_url)
+        self.server_token = data.get('server_token', self.server_token)
+        self.history_max_revisions = data.get('history_max_revisions', self.history_max_revisions)
+        self.history_max_days = data.get('history_max_days', self.history_max_days)
+        self.backend = data.get('backend', self.backend)
+        self.completion_url = data.get('completion_url', self.completion_url)
+        self.model_uri = data.get('model_uri', self.model_uri)
+        self.iam_url = data.get('iam_url', self.iam_url)
+
+    def save(self):
+        if self.store is not None:
+            self.store.save_settings(self.to_dict())
+            return
+        with open('settings.json', 'w') as f:
+            json.dump(self.to_dict(), f)
+    
+    def load(self):
+        if self.store is not None:
+            self.from_dict(self.store.load_settings())
+            return
+        try:
+            with open('settings.json', 'r') as f:
+                self.from_dict(json.load(f))
+        except FileNotFoundError:
+            pass
+
+    def save_iam_token(self):
+        # Обновление токена не переписывает остальные настройки
+        if self.store is not None:
+            self.store.save_settings({
+                'iam_token': self.iam_token,
+                'iam_token_expires': self.iam_token_expires.isoformat()
+            })
+        else:
+            self.save()
+
+    def get_iam_token(self):
+        return self.token_manager.get_token()
+
+    def create_backend(self):
+        from .completion import create_backend
+
+        return create_backend(self.backend, self.token_manager, url=self.completion_url or None,
+                              model_uri=self.model_uri or None)
+
+    @metrics.timed('refresh_iam_token')
+    def refresh_iam_token(self, session=None):
+        import requests
+
+        url = self.iam_url or IAM_URL
+        payload = {"yandexPassportOauthToken": self.oauth_token}
+        try:
+            response = (session or requests).post(url, json=payload, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            logging.info(f"Received data: {data}")
+            self.iam_token = data['iamToken']
+            if isinstance(data['expiresAt'], str):
+                expires_at = datetime.datetime.fromisoformat(data['expiresAt'].replace('Z', '+00:00'))
+            else:
+                expires_at = datetime.datetime.fromtimestamp(data['expiresAt'], tz=timezone.utc)
+            self.iam_token_expires = expires_at
+            self.save_iam_token()
+        except Exception as e:
+            logging.error(f"Error refreshing IAM token: {str(e)}")
+            raise
@@ -0,0 +1,164 @@
+import re
+import math
+import heapq
+import functools
+import threading
+from collections import defaultdict
+
+from .metrics import metrics
+
+WORD_RE = re.compile(r'\w+')
+PART_RE = re.compile(r'[A-ZА-ЯЁ]+(?![a-zа-яё])|[A-ZА-ЯЁ]?[^\W\d_A-ZА-ЯЁ]+|\d+')
+
+@functools.lru_cache(maxsize=65536)
+def split_word(word):
+    # Идентификаторы дробятся по snake_case и camelCase, целое слово тоже остаётся термом;
+    # словарь кода повторяется, поэтому разбиение кэшируется
+    tokens = []
+    parts = PART_RE.findall(word)
+    if len(parts) > 1 or (parts and parts[0] != word):
+        tokens.extend(part.lower() for part in parts if len(part) > 1)
+    if len(word) > 1:
+        tokens.append(word.lower())
+    return tuple(tokens)
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_RE.findall(text or ""):
+        tokens.extend(split_word(word))
+    return tokens
+
+class SimilarityIndex:
+    # Совпадение в названии весит больше, чем в описании, а в описании больше, чем в коде
+    FIELD_WEIGHTS = (3.0, 2.0, 1.0)
+    MAX_TERMS = 64
+    # Термы, встречающиеся в большой доле действий, почти не влияют на результат,
+    # но дороже всего обходить их списки, поэтому в большой библиотеке они пропускаются
+    COMMON_FRACTION = 0.3
+    COMMON_MIN_DOCUMENTS = 1000
+    RENORMALIZE_DRIFT = 0.2
+
+    def __init__(self):
+        # Разреженная матрица TF-IDF хранится как списки термов: терм -> {действие: tf};
+        # idf не сохраняется в весах и берётся по текущей статистике при запросе
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._norms = {}
+        self._normalized_size = 0
+        self._building = False
+        self._pending = []
+
+    @classmethod
+    def vectorize(cls, name, description, code):
+        counts = defaultdict(float)
+        for text, weight in zip((name, description, code), cls.FIELD_WEIGHTS):
+            for token in tokenize(text):
+                counts[token] += weight
+        if len(counts) > cls.MAX_TERMS:
+            counts = dict(heapq.nlargest(cls.MAX_TERMS, counts.items(), key=lambda item: item[1]))
+        return {term: 1.0 + math.log(count) for term, count in counts.items()}
+
+    def _idf(self, term, postings):
+        return math.log((len(self._documents) + 1) / (len(postings.get(term, ())) + 1)) + 1.0
+
+    def _norm(self, vector, postings):
+        return math.sqrt(sum((tf * self._idf(term, postings)) ** 2 for term, tf in vector.items())) or 1.0
+
+    def _insert(self, postings, documents, action_id, vector):
+        documents[action_id] = vector
+        for term, tf in vector.items():
+            postings[term][action_id] = tf
+
+    def _delete(self, action_id):
+        vector = self._documents.pop(action_id, None)
+        self._norms.pop(action_id, None)
+        if vector is None:
+            return
+        for term in vector:
+            postings = self._postings[term]
+            postings.pop(action_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def _renormalize(self):
+        size = len(self._documents) + 1
+        idf = {term: math.log(size / (len(postings) + 1)) + 1.0 for term, postings in self._postings.items()}
+        self._norms = {action_id: math.sqrt(sum((tf * idf[term]) ** 2 for term, tf in vector.items())) or 1.0
+                       for action_id, vector in self._documents.items()}
+        self._normalized_size = len(self._documents)
+
+    def build(self, rows):
+        # Индекс собирается в стороне и подменяется целиком, поэтому поиск
+        # продолжает работать по старым данным, пока идёт сборка
+        with self._lock:
+            self._building = True
+            self._pending = []
+        postings = defaultdict(dict)
+        documents = {}
+        for action_id, name, description, code in rows:
+            self._insert(postings, documents, action_id, self.vectorize(name, description, code))
+        with self._lock:
+            self._postings = postings
+            self._documents = documents
+            self._building = False
+            pending, self._pending = self._pending, []
+            for action_id, vector in pending:
+                self._delete(action_id)
+                if vector is not None:
+                    self._insert(self._postings, self._documents, action_id, vector)
+            self._renormalize()
+
+    def add_document(self, action_id, name, description, code):
+        vector = self.vectorize(name, description, code)
+        with self._lock:
+            if self._building:
+                self._pending.append((action_id, vector))
+            self._delete(action_id)
+            self._insert(self._postings, self._documents, action_id, vector)
+            self._norms[action_id] = self._norm(vector, self._postings)
+
+    def add(self, action):
+        self.add_document(action.id, action.name, action.description, action.code)
+
+    def update(self, action):
+        self.add(action)
+
+    def remove(self, action_id):
+        with self._lock:
+            if self._building:
+                self._pending.append((action_id, None))
+            self._delete(action_id)
+
+    def __len__(self):
+        return len(self._documents)
+
+    @metrics.timed('similar_actions')
+    def similar(self, name, description="", code="", k=5, exclude=None, threshold=0.0):
+        # Возвращает до k пар (идентификатор, косинусная близость) по убыванию близости
+        query = self.vectorize(name, description, code)
+        with self._lock:
+            size = len(self._documents)
+            if not query or not size:
+                return []
+            if abs(size - self._normalized_size) > self.RENORMALIZE_DRIFT * max(self._normalized_size, 1):
+                self._renormalize()
+            weights = {term: tf * self._idf(term, self._postings)
+                       for term, tf in query.items() if term in self._postings}
+            query_norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            if not query_norm:
+                return []
+            common = self.COMMON_FRACTION * size if size >= self.COMMON_MIN_DOCUMENTS else size + 1
+            scores = defaultdict(float)
+            for term, weight in weights.items():
+                postings = self._postings[term]
+                if len(postings) > common:
+                    continue
+                factor = weight * self._idf(term, self._postings)
+                for action_id, tf in postings.items():
+                    scores[action_id] += factor * tf
+            scores.pop(exclude, None)
+            norms = self._norms
+            ranked = heapq.nlargest(k, ((score / (query_norm * norms.get(action_id, 1.0)), action_id)
+                                        for action_id, score in scores.items()))
+        return [(action_id, min(score, 1.0)) for score, action_id in ranked if score >= threshold]
@@ -0,0 +1,170 @@
+import os
+import sys
+import mmap
+import zlib
+import struct
+import marshal
+import logging
+
+from .metrics import metrics
+from .categories import CategoryIndex
+
+MAGIC = b'PYATLIDX'
+FORMAT_VERSION = 1
+# Сигнатура, версия формата, длины метаданных, границ и списков документов, CRC32 всего после заголовка
+HEADER = struct.Struct('<8sIQQQI')
+
+def snapshot_path(store):
+    return f"{store.path}.index"
+
+def source_files(path):
+    # Время изменения и размер базы и её WAL-журнала: любая запись в базу меняет хотя бы одно из них
+    stamps = []
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+def source_stamp(store):
+    # Снимается до чтения действий: запись между отметкой и чтением лишь сделает снимок устаревшим
+    library_id = store.library_id()
+    return {'library_id': library_id, 'files': source_files(store.path), 'version': store.library_version()}
+
+@metrics.timed('snapshot_write')
+def write_snapshot(path, source, ids, names, categories, search_index, generation=None):
+    # Файл пишется рядом и подменяется целиком; если старый снимок ещё открыт
+    # и подменить его нельзя, новый подхватывается при следующем открытии
+    exported = search_index.export(ids, generation)
+    if exported is None:
+        return False
+    grams, offsets, postings = exported
+    category_index = CategoryIndex()
+    for action_id, category in zip(ids, categories):
+        category_index.add(action_id, category)
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+        postings.byteswap()
+    meta = marshal.dumps({
+        'source': source,
+        'ids': ids,
+        'names': names,
+        'categories': categories,
+        'members': dict(category_index.members),
+        'totals': dict(category_index.totals),
+        'grams': grams,
+    })
+    parts = [meta, offsets, postings]
+    checksum = 0
+    for part in parts:
+        checksum = zlib.crc32(part, checksum)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(meta), len(offsets) * offsets.itemsize,
+                         len(postings) * postings.itemsize, checksum)
+    temp = path + '.new'
+    with open(temp, 'wb') as f:
+        f.write(header)
+        for part in parts:
+            f.write(part)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.replace(temp, path)
+    except OSError as e:
+        logging.info(f"Index snapshot {path} is in use, it will be replaced on next open: {e}")
+        return False
+    logging.info(f"Index snapshot written to {path}: {len(ids)} actions, {len(grams)} grams")
+    return True
+
+class IndexSnapshot:
+    # Снимок производных индексов библиотеки: порядок, названия и категории действий, индекс категорий
+    # и триграммы поиска. Файл отображается в память, списки документов читаются только для триграмм запроса
+    def __init__(self, path, mapping, meta, offsets, postings, view):
+        self.path = path
+        self.mapping = mapping
+        self.view = view
+        self.offsets = offsets
+        self.postings = postings
+        self.source = meta['source']
+        self.ids = meta['ids']
+        self.names = meta['names']
+        self.categories = meta['categories']
+        self.members = meta['members']
+        self.totals = meta['totals']
+        self.grams = meta['grams']
+
+    @property
+    def version(self):
+        return self.source['version']
+
+    @classmethod
+    def open(cls, path):
+        # None, если снимка нет или он повреждён; тогда индексы строятся заново
+        if os.path.exists(path + '.new'):
+            try:
+                os.replace(path + '.new', path)
+            except OSError as e:
+                logging.info(f"Pending index snapshot for {path} is not applied: {e}")
+        try:
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            with metrics.span('snapshot_open'):
+                return cls.parse(path, mapping)
+        except (ValueError, TypeError, EOFError, KeyError, struct.error) as e:
+            logging.info(f"Index snapshot {path} is unusable: {e}")
+            mapping.close()
+            return None
+
+    @classmethod
+    def parse(cls, path, mapping):
+        magic, version, meta_size, offsets_size, postings_size, checksum = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"unsupported format {magic!r} {version}")
+        if sys.byteorder != 'little':
+            raise ValueError("snapshot arrays are little-endian")
+        if HEADER.size + meta_size + offsets_size + postings_size != len(mapping):
+            raise ValueError("truncated file")
+        view = memoryview(mapping)
+        try:
+            if zlib.crc32(view[HEADER.size:]) != checksum:
+                raise ValueError("checksum mismatch")
+            start = HEADER.size + meta_size
+            meta = marshal.loads(view[HEADER.size:start])
+            offsets = view[start:start + offsets_size].cast('I')
+            postings = view[start + offsets_size:].cast('I')
+        except Exception:
+            view.release()
+            raise
+        return cls(path, mapping, meta, offsets, postings, view)
+
+    def freshness(self, store):
+        # 'fresh' - снимок соответствует базе, 'behind' - в базе есть изменения после снимка,
+        # их можно догнать по версии; 'stale' - снимок от другой базы или версия ушла назад
+        if self.source['files'] == source_files(store.path):
+            return 'fresh'
+        if self.source['library_id'] != store.library_id():
+            return 'stale'
+        version = store.library_version()
+        if version == self.version:
+            return 'fresh'
+        return 'behind' if version > self.version else 'stale'
+
+    def lookup(self, gram):
+        number = self.grams.get(gram)
+        if number is None:
+            return None
+        documents = self.postings[self.offsets[number]:self.offsets[number + 1]]
+        return set(map(self.ids.__getitem__, documents.tolist()))
+
+    def close(self):
+        if self.mapping is None:
+            return
+        self.postings.release()
+        self.offsets.release()
+        self.view.release()
+        self.mapping.close()
+        self.mapping = None
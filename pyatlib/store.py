@@ -0,0 +1,540 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import sqlite3
+import datetime
+import threading
+from datetime import timezone
+from collections import OrderedDict
+
+from .models import Action
+
+def code_hash(code):
+    # Пустой код не участвует в поиске дубликатов
+    if not code or not code.strip():
+        return None
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+class WriteConflict(Exception):
+    # Действия изменены другим процессом после того, как их прочитали для редактирования
+    def __init__(self, action_ids):
+        super().__init__(f"Actions changed by another process: {', '.join(action_ids)}")
+        self.action_ids = action_ids
+
+class ActionStore:
+    ACTION_FIELDS = ('id', 'name', 'description', 'code', 'category', 'generated_code')
+
+    def __init__(self, path='library.db', body_cache_size=64):
+        self.path = path
+        self.lock = threading.RLock()
+        self.body_cache = OrderedDict()
+        self.body_cache_size = body_cache_size
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA mmap_size=268435456")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.create_schema()
+
+    def create_schema(self):
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS actions (
+                    id TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    description TEXT NOT NULL DEFAULT '',
+                    code TEXT NOT NULL DEFAULT '',
+                    category TEXT NOT NULL DEFAULT 'Без категории',
+                    generated_code TEXT NOT NULL DEFAULT '',
+                    code_hash TEXT,
+                    version INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS actions_seq ON actions(seq);
+                CREATE TABLE IF NOT EXISTS categories (
+                    name TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS deleted_actions (
+                    id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS snippet_checks (
+                    hash TEXT PRIMARY KEY,
+                    error TEXT
+                );
+                CREATE TABLE IF NOT EXISTS revisions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    action_id TEXT NOT NULL,
+                    created TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    keyframe INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS revisions_action ON revisions(action_id, id);
+            """)
+            columns = {row['name'] for row in self.connection.execute("PRAGMA table_info(actions)")}
+            if 'code_hash' not in columns:
+                # Базы, созданные до появления дедупликации, дополняются хешами кода
+                self.connection.execute("ALTER TABLE actions ADD COLUMN code_hash TEXT")
+                rows = self.connection.execute("SELECT id, code FROM actions").fetchall()
+                self.connection.executemany("UPDATE actions SET code_hash = ? WHERE id = ?",
+                                            [(code_hash(row['code']), row['id']) for row in rows])
+            if 'version' not in columns:
+                self.connection.execute("ALTER TABLE actions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS actions_code_hash ON actions(code_hash)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS actions_version ON actions(version)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS deleted_actions_version ON deleted_actions(version)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS actions_name ON actions(name)")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row is not None else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+
+    def library_id(self):
+        # Постоянный идентификатор базы: по нему снимок индексов отличает свою базу от подменённой
+        library_id = self.get_meta('library_id')
+        if library_id is not None:
+            return library_id
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('library_id', ?)",
+                                    (uuid.uuid4().hex,))
+            return self.connection.execute("SELECT value FROM meta WHERE key = 'library_id'").fetchone()[0]
+
+    def load_actions(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT id, name, category FROM actions ORDER BY seq").fetchall()
+        return [Action(row['name'], category=row['category'], id=row['id'], loader=self.load_body) for row in rows]
+
+    def load_body(self, action_id):
+        # Недавно открытые тела действий держатся в небольшом LRU-кэше
+        with self.lock:
+            body = self.body_cache.get(action_id)
+            if body is not None:
+                self.body_cache.move_to_end(action_id)
+                return body
+            row = self.connection.execute(
+                "SELECT description, code, generated_code FROM actions WHERE id = ?", (action_id,)).fetchone()
+            body = dict(row) if row is not None else {'description': "", 'code': "", 'generated_code': ""}
+            self.body_cache[action_id] = body
+            if len(self.body_cache) > self.body_cache_size:
+                self.body_cache.popitem(last=False)
+            return body
+
+    def category_filter(self, category):
+        if category is None:
+            return "", ()
+        return "WHERE category = ? OR category LIKE ? ESCAPE '\\'", \
+            (category, category.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '/%')
+
+    def list_summaries(self, category=None):
+        where, params = self.category_filter(category)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT id, name, category FROM actions {where} ORDER BY seq", params).fetchall()
+
+    def find_actions(self, reference):
+        # Поиск по идентификатору, его префиксу или точному названию
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM actions WHERE id = ? ORDER BY seq", (reference,)).fetchall()
+            if not rows:
+                rows = self.connection.execute(
+                    "SELECT id FROM actions WHERE substr(id, 1, length(?1)) = ?1 OR name = ?1 ORDER BY seq",
+                    (reference,)).fetchall()
+        return [self.get_action(row['id']) for row in rows]
+
+    def get_action(self, action_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, name, category FROM actions WHERE id = ?", (action_id,)).fetchone()
+        if row is None:
+            return None
+        return Action(row['name'], category=row['category'], id=row['id'], loader=self.load_body)
+
+    def iter_records(self, category=None, chunk_size=1000):
+        where, params = self.category_filter(category)
+        with self.lock:
+            cursor = self.connection.execute(
+                f"SELECT id, name, description, code, category, generated_code FROM actions {where} ORDER BY seq",
+                params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+
+    def iter_code_rows(self, chunk_size=1000):
+        with self.lock:
+            cursor = self.connection.execute("SELECT id, code, generated_code FROM actions ORDER BY seq")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+
+    def iter_search_rows(self, chunk_size=1000):
+        with self.lock:
+            cursor = self.connection.execute("SELECT id, name, description, code FROM actions ORDER BY seq")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row['id'], row['name'], row['description'], row['code']
+
+    def load_search_texts(self, action_ids, chunk_size=500):
+        texts = {}
+        action_ids = list(action_ids)
+        for start in range(0, len(action_ids), chunk_size):
+            chunk = action_ids[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT id, description, code FROM actions WHERE id IN ({placeholders})", chunk).fetchall()
+            for row in rows:
+                texts[row['id']] = (row['description'], row['code'])
+        return texts
+
+    def load_codes(self, action_ids):
+        rows = self.select_in("SELECT id, code FROM actions WHERE id IN ({placeholders})", action_ids)
+        return {row['id']: row['code'] for row in rows}
+
+    def library_version(self):
+        return int(self.get_meta('version', 0))
+
+    def _next_version(self):
+        # Каждая пишущая транзакция получает новый номер версии библиотеки;
+        # по нему клиенты сервера забирают только изменения после своей версии
+        self.connection.execute("""
+            INSERT INTO meta(key, value) VALUES ('version', 1)
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        """)
+        return int(self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+
+    def _forget_tombstones(self, action_ids):
+        self.connection.executemany("DELETE FROM deleted_actions WHERE id = ?", [(action_id,) for action_id in action_ids])
+
+    def _upsert(self, action, version):
+        self.connection.execute("""
+            INSERT INTO actions(id, seq, name, description, code, category, generated_code, code_hash, version)
+            VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM actions), ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                name = excluded.name,
+                description = excluded.description,
+                code = excluded.code,
+                category = excluded.category,
+                generated_code = excluded.generated_code,
+                code_hash = excluded.code_hash,
+                version = excluded.version
+        """, (action.id, action.name, action.description, action.code, action.category, action.generated_code,
+              code_hash(action.code), version))
+
+    def _check_versions(self, expected):
+        # Вызывается внутри пишущей транзакции, когда блокировка записи уже взята
+        current = self.action_versions(expected)
+        conflicts = [action_id for action_id, seen in expected.items() if current.get(action_id) != seen]
+        if conflicts:
+            raise WriteConflict(conflicts)
+
+    def upsert_actions(self, actions, expected=None):
+        # Все изменения пакета фиксируются одной транзакцией; expected - версии действий
+        # на момент чтения: если другой процесс успел их изменить, запись отменяется
+        with self.lock:
+            with self.connection:
+                version = self._next_version()
+                if expected:
+                    self._check_versions(expected)
+                for action in actions:
+                    self._upsert(action, version)
+                self._forget_tombstones(action.id for action in actions)
+            for action in actions:
+                self.body_cache.pop(action.id, None)
+                action.attach(self.load_body)
+        return version
+
+    def upsert_action(self, action):
+        self.upsert_actions([action])
+
+    def insert_records(self, records, categories=()):
+        # Пакетная запись для импорта: порядковые номера выдаются одним запросом на пакет,
+        # действия и новые категории фиксируются одной транзакцией
+        with self.lock, self.connection:
+            self._insert_records(records)
+            category_seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM categories").fetchone()[0]
+            self.connection.executemany("INSERT OR IGNORE INTO categories(name, seq) VALUES (?, ?)",
+                                        [(category, category_seq + i) for i, category in enumerate(categories, 1)])
+            for record in records:
+                self.body_cache.pop(record['id'], None)
+
+    def _insert_records(self, records, version=None):
+        if version is None:
+            version = self._next_version()
+        seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM actions").fetchone()[0]
+        self.connection.executemany("""
+            INSERT INTO actions(id, seq, name, description, code, category, generated_code, code_hash, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                name = excluded.name,
+                description = excluded.description,
+                code = excluded.code,
+                category = excluded.category,
+                generated_code = excluded.generated_code,
+                code_hash = excluded.code_hash,
+                version = excluded.version
+        """, [(record['id'], seq + i, record['name'], record['description'], record['code'], record['category'],
+               record['generated_code'], record['code_hash'], version) for i, record in enumerate(records, 1)])
+        self._forget_tombstones(record['id'] for record in records)
+        return version
+
+    def changes_since(self, since, limit=5000):
+        # Изменённые действия и удаления с версией больше since; последняя версия
+        # в ответе отдаётся целиком, чтобы страница не разрезала одну транзакцию
+        changed_versions = """
+            SELECT version FROM actions WHERE version > ?1
+            UNION ALL SELECT version FROM deleted_actions WHERE version > ?1
+        """
+        with self.lock:
+            current = self.library_version()
+            upto = current
+            overflow = self.connection.execute(
+                f"SELECT version FROM ({changed_versions}) ORDER BY version LIMIT 1 OFFSET ?2", (since, limit)).fetchone()
+            if overflow is not None:
+                first = self.connection.execute(f"SELECT MIN(version) FROM ({changed_versions})", (since,)).fetchone()[0]
+                upto = overflow[0] - 1 if overflow[0] > first else overflow[0]
+            actions = [dict(row) for row in self.connection.execute(
+                f"SELECT {', '.join(self.ACTION_FIELDS)}, version FROM actions "
+                "WHERE version > ? AND version <= ? ORDER BY seq", (since, upto))]
+            deleted = [row[0] for row in self.connection.execute(
+                "SELECT id FROM deleted_actions WHERE version > ? AND version <= ?", (since, upto))]
+            categories = self.load_categories()
+        return {'version': upto, 'current': current, 'more': upto < current,
+                'actions': actions, 'deleted': deleted, 'categories': categories}
+
+    def data_version(self):
+        # Меняется, только когда в базу записало другое соединение
+        with self.lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def action_versions(self, action_ids):
+        rows = self.select_in("SELECT id, version FROM actions WHERE id IN ({placeholders})", action_ids)
+        return {row['id']: row['version'] for row in rows}
+
+    def changed_since(self, since):
+        # Идентификаторы действий, изменённых и удалённых после версии since; версия читается
+        # первой, поэтому параллельная запись в худшем случае попадёт в ответ дважды
+        with self.lock:
+            version = self.library_version()
+            changed = [row[0] for row in self.connection.execute("SELECT id FROM actions WHERE version > ?", (since,))]
+            deleted = [row[0] for row in self.connection.execute(
+                "SELECT id FROM deleted_actions WHERE version > ?", (since,))]
+            for action_id in changed + deleted:
+                self.body_cache.pop(action_id, None)
+        return version, changed, deleted
+
+    def get_records(self, action_ids):
+        # Записи идут в порядке списка действий, а не в порядке переданных идентификаторов
+        rows = self.select_in(f"SELECT {', '.join(self.ACTION_FIELDS)}, version, seq FROM actions "
+                              "WHERE id IN ({placeholders})", action_ids)
+        rows.sort(key=lambda row: row['seq'])
+        fields = self.ACTION_FIELDS + ('version',)
+        return [{field: row[field] for field in fields} for row in rows]
+
+    def apply_remote_changes(self, records, deleted_ids, categories):
+        # Зеркалирование изменений с сервера одной транзакцией
+        records = [dict(record, code_hash=code_hash(record['code'])) for record in records]
+        deleted_ids = list(deleted_ids)
+        with self.lock, self.connection:
+            # Сохранения и удаления одной транзакции получают одну версию
+            version = self._next_version() if records or deleted_ids else None
+            if records:
+                self._insert_records(records, version)
+            self._delete(deleted_ids, version)
+            if categories is not None:
+                self.connection.execute("DELETE FROM categories")
+                self.connection.executemany("INSERT INTO categories(name, seq) VALUES (?, ?)",
+                                            [(category, i) for i, category in enumerate(categories, 1)])
+            for action_id in [record['id'] for record in records] + deleted_ids:
+                self.body_cache.pop(action_id, None)
+
+    def write_batch(self, records, deleted_ids=(), categories=(), expected=None, history=None):
+        # Отложенная запись: сохранения, удаления и новые категории одной транзакцией;
+        # ревизии в history пишутся в той же транзакции, до изменения действий
+        records = [dict(record, code_hash=code_hash(record['code'])) for record in records]
+        deleted_ids = list(deleted_ids)
+        with self.lock:
+            try:
+                with self.connection:
+                    version = self._next_version()
+                    if expected:
+                        self._check_versions(expected)
+                    if history is not None:
+                        history.record(records, deleted_ids)
+                    if records:
+                        self._insert_records(records, version)
+                    self._delete(deleted_ids, version)
+                    for category in categories:
+                        self.connection.execute("""
+                            INSERT OR IGNORE INTO categories(name, seq)
+                            VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM categories))
+                        """, (category,))
+            except Exception:
+                # Ревизии откатились вместе с транзакцией; следующая попытка должна строить
+                # дельты от того, что действительно есть в базе
+                if history is not None:
+                    history.forget([record['id'] for record in records] + deleted_ids)
+                raise
+            for action_id in [record['id'] for record in records] + deleted_ids:
+                self.body_cache.pop(action_id, None)
+        return version
+
+    def clear_actions(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM actions")
+            self.connection.execute("DELETE FROM deleted_actions")
+            self.body_cache.clear()
+
+    def select_in(self, query, values, chunk_size=500):
+        # Списки значений режутся на части, чтобы не упереться в лимит параметров SQLite
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            with self.lock:
+                rows.extend(self.connection.execute(query.format(placeholders=placeholders), chunk).fetchall())
+        return rows
+
+    def existing_code_hashes(self, hashes):
+        rows = self.select_in("SELECT DISTINCT code_hash FROM actions WHERE code_hash IN ({placeholders})",
+                              {value for value in hashes if value is not None})
+        return {row[0] for row in rows}
+
+    def ids_by_name(self, names):
+        rows = self.select_in("SELECT id, name, seq FROM actions WHERE name IN ({placeholders})", set(names))
+        result = {}
+        for row in sorted(rows, key=lambda row: row['seq']):
+            result.setdefault(row['name'], row['id'])
+        return result
+
+    def existing_ids(self, action_ids):
+        rows = self.select_in("SELECT id FROM actions WHERE id IN ({placeholders})", set(action_ids))
+        return {row[0] for row in rows}
+
+    def load_snippet_checks(self, hashes):
+        rows = self.select_in("SELECT hash, error FROM snippet_checks WHERE hash IN ({placeholders})", hashes)
+        return {row['hash']: row['error'] for row in rows}
+
+    def save_snippet_checks(self, checks):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO snippet_checks(hash, error) VALUES (?, ?)", checks)
+
+    def clear_snippet_checks(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM snippet_checks")
+
+    def _delete(self, action_ids, version=None):
+        action_ids = list(action_ids)
+        if not action_ids:
+            return
+        if version is None:
+            version = self._next_version()
+        self.connection.executemany("INSERT OR REPLACE INTO deleted_actions(id, version) VALUES (?, ?)",
+                                    [(action_id, version) for action_id in action_ids])
+        self.connection.executemany("DELETE FROM actions WHERE id = ?", [(action_id,) for action_id in action_ids])
+
+    def delete_actions(self, action_ids):
+        with self.lock, self.connection:
+            self._delete(action_ids)
+            for action_id in action_ids:
+                self.body_cache.pop(action_id, None)
+
+    def delete_action(self, action_id):
+        self.delete_actions([action_id])
+
+    def load_categories(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT name FROM categories ORDER BY seq").fetchall()
+        return [row['name'] for row in rows]
+
+    def add_categories(self, categories):
+        with self.lock, self.connection:
+            self._next_version()
+            for category in categories:
+                self.connection.execute("""
+                    INSERT OR IGNORE INTO categories(name, seq)
+                    VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM categories))
+                """, (category,))
+
+    def replace_categories(self, categories):
+        with self.lock, self.connection:
+            self._next_version()
+            self.connection.execute("DELETE FROM categories")
+            self.connection.executemany("INSERT INTO categories(name, seq) VALUES (?, ?)",
+                                        [(category, i) for i, category in enumerate(categories, 1)])
+
+    def load_settings(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT key, value FROM settings").fetchall()
+        return {row['key']: json.loads(row['value']) for row in rows}
+
+    def save_settings(self, data):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO settings(key, value) VALUES (?, ?)",
+                                        [(key, json.dumps(value, ensure_ascii=False)) for key, value in data.items()])
+
+    def migrate_from_json(self, actions_path='actions.json', settings_path='settings.json'):
+        # Одноразовый перенос старой библиотеки; исходные файлы не изменяются
+        if self.get_meta('json_migrated'):
+            return False
+        actions = []
+        if os.path.exists(actions_path):
+            with open(actions_path, 'r', encoding='utf-8') as f:
+                for data in json.load(f):
+                    data.setdefault('category', 'Без категории')
+                    data.setdefault('generated_code', '')
+                    actions.append(Action(**{key: data[key] for key in self.ACTION_FIELDS if key in data}))
+        settings = {}
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r') as f:
+                settings = json.load(f)
+        with self.lock, self.connection:
+            version = self._next_version()
+            for action in actions:
+                self._upsert(action, version)
+            for category in dict.fromkeys(action.category for action in actions):
+                self.connection.execute("""
+                    INSERT OR IGNORE INTO categories(name, seq)
+                    VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM categories))
+                """, (category,))
+            self.connection.executemany("INSERT OR REPLACE INTO settings(key, value) VALUES (?, ?)",
+                                        [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()])
+            self.connection.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('json_migrated', ?)",
+                                    (datetime.datetime.now(timezone.utc).isoformat(),))
+        logging.info(f"Migrated {len(actions)} actions from {actions_path}")
+        return True
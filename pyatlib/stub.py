@@ -0,0 +1,202 @@
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import logging
+import datetime
+import threading
+from datetime import timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+IAM_PATH = '/iam/v1/tokens'
+COMPLETION_PATH = '/foundationModels/v1/completion'
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # None - запрос пропущен, иначе через сколько секунд появится свободный слот
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            return (1 - self.tokens) / self.rate
+
+class CompletionStubServer(ThreadingHTTPServer):
+    # Локальная замена IAM и YandexGPT для проверки и нагрузочных замеров генерации без сети.
+    # Отвечает детерминированным кодом pytest в формате ответа foundationModels/v1/completion
+    daemon_threads = True
+    # Со стандартной очередью в 5 соединений десятки параллельных клиентов упираются в accept
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.0, chunk_delay=0.0, chunks=5, rate_limit=None, error_rate=0.0,
+                 token_ttl=3600, seed=0):
+        super().__init__(address, CompletionStubHandler)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunks = max(1, chunks)
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.stats = {'iam': 0, 'completions': 0, 'streams': 0, 'unauthorized': 0, 'rate_limited': 0, 'errors': 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def issue_token(self):
+        token = f"stub-{uuid.uuid4().hex}"
+        expires = datetime.datetime.now(timezone.utc) + datetime.timedelta(seconds=self.token_ttl)
+        with self.lock:
+            self.tokens[token] = expires
+            self.stats['iam'] += 1
+        return token, expires
+
+    def token_valid(self, token):
+        with self.lock:
+            expires = self.tokens.get(token)
+        return expires is not None and datetime.datetime.now(timezone.utc) < expires
+
+    def expire_tokens(self):
+        # Имитация отзыва токена раньше срока: следующий запрос получит 401
+        with self.lock:
+            self.tokens.clear()
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def completion_text(self, prompt):
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:10]
+        lines = ["```python", f"def test_generated_{digest}(driver):",
+                 f"    driver.get('https://example.com/{digest}')"]
+        lines += [f"    element_{i} = driver.find_element('id', 'field_{i}')\n    assert element_{i}.is_displayed()"
+                  for i in range(self.chunks)]
+        lines.append("```")
+        return '\n'.join(lines)
+
+    def text_chunks(self, text):
+        # Накопленный текст на каждом шаге, как в потоковом ответе YandexGPT
+        size = math.ceil(len(text) / self.chunks)
+        return [text[:min(len(text), size * (i + 1))] for i in range(self.chunks)]
+
+class CompletionStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'pyatlib-stub'
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, data, headers=()):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        try:
+            data = self.read_json()
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if path == IAM_PATH:
+            self.post_token(data)
+        elif path == COMPLETION_PATH:
+            self.post_completion(data)
+        else:
+            self.send_json(404, {'error': "not found"})
+
+    def post_token(self, data):
+        if not data.get('yandexPassportOauthToken'):
+            self.send_json(400, {'error': "yandexPassportOauthToken is required"})
+            return
+        token, expires = self.server.issue_token()
+        self.send_json(200, {'iamToken': token, 'expiresAt': expires.isoformat().replace('+00:00', 'Z')})
+
+    def post_completion(self, data):
+        server = self.server
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer ') or not server.token_valid(authorization[7:]):
+            server.count('unauthorized')
+            self.send_json(401, {'error': "The token is invalid or expired"})
+            return
+        if server.bucket is not None:
+            retry_after = server.bucket.acquire()
+            if retry_after is not None:
+                server.count('rate_limited')
+                self.send_json(429, {'error': "Too many requests"}, [('Retry-After', str(math.ceil(retry_after)))])
+                return
+        if server.should_fail():
+            server.count('errors')
+            self.send_json(500, {'error': "Internal error"})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        prompt = ''.join(message.get('text', '') for message in data.get('messages', []))
+        text = server.completion_text(prompt)
+        if data.get('completionOptions', {}).get('stream'):
+            server.count('streams')
+            self.stream_completion(server.text_chunks(text))
+        else:
+            server.count('completions')
+            self.send_json(200, self.result(text, 'ALTERNATIVE_STATUS_FINAL'))
+
+    def result(self, text, status):
+        return {'result': {
+            'alternatives': [{'message': {'role': 'assistant', 'text': text}, 'status': status}],
+            'modelVersion': 'stub',
+        }}
+
+    def stream_completion(self, chunks):
+        # Строки NDJSON в chunked-ответе, каждая с полным текстом на текущий момент
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i and self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+            final = i == len(chunks) - 1
+            line = json.dumps(self.result(chunk, 'ALTERNATIVE_STATUS_FINAL' if final else 'ALTERNATIVE_STATUS_PARTIAL'),
+                              ensure_ascii=False).encode('utf-8') + b'\n'
+            self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+def serve_stub(host='127.0.0.1', port=8799, **options):
+    server = CompletionStubServer((host, port), **options)
+    logging.info(f"Completion stub on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,268 @@
+import os
+import re
+import ast
+import json
+import hashlib
+import builtins
+import logging
+import textwrap
+from collections import defaultdict
+
+from .metrics import metrics
+from .validation import check_source
+
+MANIFEST_NAME = '.pyatlib-manifest.json'
+# Меняется при изменении шаблонов, чтобы следующий экспорт переписал все файлы
+GENERATOR_VERSION = 1
+BUILTIN_NAMES = frozenset(dir(builtins))
+NON_WORD_RE = re.compile(r'\W+')
+
+def slugify(text, default='action'):
+    slug = NON_WORD_RE.sub('_', text.lower()).strip('_')
+    if not slug:
+        return default
+    return f"_{slug}" if slug[0].isdigit() else slug
+
+def module_name(category, taken):
+    # Одна категория - один модуль; подкатегории разделяются двойным подчёркиванием
+    name = "test_" + '__'.join(slugify(part, 'category') for part in category.split('/'))
+    if name in taken and taken[name] != category:
+        name = f"{name}_{hashlib.sha1(category.encode('utf-8')).hexdigest()[:6]}"
+    taken[name] = category
+    return name + '.py'
+
+def free_names(tree):
+    # Имена, которые читаются, но нигде во фрагменте не определены; из них
+    # строчные считаются фикстурами, остальные - забытыми импортами или классами
+    loaded = set()
+    defined = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            (loaded if isinstance(node.ctx, ast.Load) else defined).add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defined.add(node.name)
+        elif isinstance(node, ast.arg):
+            defined.add(node.arg)
+        elif isinstance(node, ast.alias):
+            defined.add((node.asname or node.name).split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            defined.add(node.name)
+    return sorted(name for name in loaded - defined - BUILTIN_NAMES if name[:1].islower())
+
+def render_action(action_id, name, source, function_names):
+    # Возвращает (импорты, фикстуры, текст тестовой функции)
+    function = slugify(name)
+    function = function if function.startswith('test_') else f"test_{function}"
+    while function in function_names:
+        function += '_'
+    header = f"# {' '.join(name.split())} [{action_id}]"
+    error = check_source(source)
+    if error is not None:
+        function_names.add(function)
+        commented = textwrap.indent(source.strip('\n'), '# ')
+        reason = json.dumps(f"синтаксическая ошибка: {error}", ensure_ascii=False)
+        return [], [], f"{header}\n{commented}\n@pytest.mark.skip(reason={reason})\ndef {function}():\n    pass\n"
+
+    code = textwrap.dedent(source).strip('\n')
+    tree = ast.parse(code)
+    lines = code.splitlines()
+    imports = []
+    import_lines = set()
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append(ast.unparse(node))
+            import_lines.update(range(node.lineno - 1, node.end_lineno))
+    body = '\n'.join(line for i, line in enumerate(lines) if i not in import_lines).strip('\n')
+    tests = [node for node in tree.body
+             if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith('test')]
+    if tests:
+        # Фрагмент уже содержит тесты: переносятся как есть, совпадающие имена переименовываются
+        fixtures = set()
+        for node in tests:
+            fixtures.update(arg.arg for arg in node.args.args)
+            renamed = node.name
+            while renamed in function_names:
+                renamed += '_'
+            if renamed != node.name:
+                body = re.sub(rf'\bdef {node.name}\(', f'def {renamed}(', body, count=1)
+            function_names.add(renamed)
+        return imports, sorted(fixtures), f"{header}\n{body}\n"
+    function_names.add(function)
+    fixtures = free_names(tree)
+    body = textwrap.indent(body, '    ') if body.strip() else '    pass'
+    return imports, fixtures, f"{header}\ndef {function}({', '.join(fixtures)}):\n{body}\n"
+
+def render_module(category, actions):
+    imports = {}
+    fixtures = set()
+    functions = []
+    function_names = set()
+    for action_id, name, source in actions:
+        action_imports, action_fixtures, text = render_action(action_id, name, source, function_names)
+        imports.update(dict.fromkeys(action_imports))
+        fixtures.update(action_fixtures)
+        functions.append(text)
+    header = (f"# Сгенерировано pyatlib из категории {category!r}.\n"
+              "# Файл перезаписывается при следующем экспорте, правьте действия в библиотеке.\n")
+    import_block = '\n'.join(['import pytest'] + sorted(set(imports) - {'import pytest'}))
+    return header + import_block + '\n\n\n' + '\n\n'.join(functions), fixtures
+
+def render_conftest(fixtures):
+    names = ',\n'.join(f"    {name!r}" for name in sorted(fixtures))
+    return f'''# Сгенерировано pyatlib. Свои фикстуры объявляйте в fixtures.py рядом с этим файлом:
+# всё, что там не определено, заменяется заглушками, которые пропускают тест.
+import pytest
+
+try:
+    from fixtures import *
+except ImportError:
+    pass
+
+REQUIRED_FIXTURES = (
+{names}{',' if fixtures else ''}
+)
+
+def missing_fixture(name):
+    @pytest.fixture(name=name)
+    def fixture():
+        pytest.skip(f"Фикстура {{name}} не объявлена в fixtures.py")
+    return fixture
+
+for _name in REQUIRED_FIXTURES:
+    if _name not in globals():
+        globals()[f"_missing_{{_name}}"] = missing_fixture(_name)
+'''
+
+class ExportStats:
+    __slots__ = ('actions', 'modules', 'written', 'unchanged', 'removed')
+
+    def __init__(self):
+        self.actions = 0
+        self.modules = 0
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def summary(self):
+        return (f"Действий: {self.actions}, модулей: {self.modules}, записано: {self.written}, "
+                f"без изменений: {self.unchanged}, удалено: {self.removed}")
+
+class TestPackageExporter:
+    # Манифест хранит для каждого файла хеш входных данных: если действия категории
+    # не менялись, модуль не рендерится и не перезаписывается
+    def __init__(self, store, directory, source='generated', workers=8, on_progress=None):
+        self.store = store
+        self.directory = directory
+        self.source = source
+        self.workers = workers
+        self.on_progress = on_progress
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != GENERATOR_VERSION:
+            return {}
+        return manifest.get('files', {})
+
+    def save_manifest(self, files):
+        path = self.manifest_path + '.tmp'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': GENERATOR_VERSION, 'files': files}, f, ensure_ascii=False, indent=4)
+        os.replace(path, self.manifest_path)
+
+    def pick_source(self, record):
+        if self.source == 'generated' and record['generated_code'].strip():
+            return record['generated_code']
+        return record['code']
+
+    def collect(self, category=None, action_ids=None):
+        wanted = set(action_ids) if action_ids is not None else None
+        modules = defaultdict(list)
+        for record in self.store.iter_records(category):
+            if wanted is not None and record['id'] not in wanted:
+                continue
+            source = self.pick_source(record)
+            if source.strip():
+                modules[record['category']].append((record['id'], record['name'], source))
+        return modules
+
+    def inputs_hash(self, category, actions):
+        digest = hashlib.sha256(f"{GENERATOR_VERSION}\0{category}".encode('utf-8'))
+        for action_id, name, source in actions:
+            digest.update(f"\0{action_id}\0{name}\0{source}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def write_file(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temporary, path)
+
+    def build_module(self, filename, category, actions):
+        content, fixtures = render_module(category, actions)
+        self.write_file(filename, content)
+        return filename, fixtures
+
+    @metrics.timed('export_test_package')
+    def export(self, category=None, action_ids=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self.load_manifest()
+        modules = self.collect(category, action_ids)
+        stats = ExportStats()
+        stats.modules = len(modules)
+        stats.actions = sum(len(actions) for actions in modules.values())
+
+        files = {}
+        pending = []
+        taken = {}
+        for module_category in sorted(modules):
+            actions = modules[module_category]
+            filename = module_name(module_category, taken)
+            digest = self.inputs_hash(module_category, actions)
+            entry = previous.get(filename)
+            if entry is not None and entry['hash'] == digest and \
+                    os.path.exists(os.path.join(self.directory, filename)):
+                files[filename] = entry
+                stats.unchanged += 1
+            else:
+                files[filename] = {'hash': digest, 'category': module_category, 'fixtures': []}
+                pending.append((filename, module_category, actions))
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for filename, fixtures in executor.map(lambda job: self.build_module(*job), pending):
+                files[filename]['fixtures'] = sorted(fixtures)
+                stats.written += 1
+                done += 1
+                if self.on_progress is not None:
+                    self.on_progress(done, len(pending))
+
+        # Модули категорий, которых больше нет в выгрузке, удаляются, чужие файлы не трогаются
+        for filename in previous:
+            if filename not in files and filename != 'conftest.py':
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                    stats.removed += 1
+                except FileNotFoundError:
+                    pass
+
+        fixtures = set()
+        for filename, entry in files.items():
+            fixtures.update(entry['fixtures'])
+        conftest = render_conftest(fixtures)
+        conftest_hash = hashlib.sha256(conftest.encode('utf-8')).hexdigest()
+        if previous.get('conftest.py', {}).get('hash') != conftest_hash or \
+                not os.path.exists(os.path.join(self.directory, 'conftest.py')):
+            self.write_file('conftest.py', conftest)
+            stats.written += 1
+        files['conftest.py'] = {'hash': conftest_hash, 'fixtures': []}
+        self.save_manifest(files)
+        logging.info(f"Exported test package to {self.directory}: {stats.summary()}")
+        return stats
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import uuid
+import logging
+from collections import Counter
+
+from .store import code_hash
+from .metrics import metrics
+
+FORMATS = ('json', 'ndjson')
+CONFLICT_POLICIES = ('rename', 'skip', 'replace', 'keep')
+READ_CHUNK_SIZE = 1 << 16
+
+def iter_json_array(f, chunk_size=READ_CHUNK_SIZE):
+    # Массив формата actions.json разбирается по одному элементу,
+    # в памяти держится только текущий кусок файла
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+
+    def read_more():
+        nonlocal buffer, position
+        data = f.read(chunk_size)
+        if not data:
+            return False
+        buffer = buffer[position:] + data
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if not read_more():
+                raise ValueError("Неожиданный конец JSON-массива")
+            continue
+        char = buffer[position]
+        if not started:
+            if char != '[':
+                raise ValueError("Ожидался JSON-массив действий")
+            started = True
+            position += 1
+        elif char == ']':
+            return
+        elif char == ',':
+            position += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+                continue
+            # Число на границе куска могло оборваться, поэтому такой элемент разбирается заново
+            if end == len(buffer) and read_more():
+                continue
+            position = end
+            yield item
+
+def iter_ndjson(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(4096).lstrip('﻿ \t\r\n')
+    return 'json' if head.startswith('[') else 'ndjson'
+
+def iter_file(f, fmt):
+    return iter_ndjson(f) if fmt == 'ndjson' else iter_json_array(f)
+
+def export_actions(store, output, fmt='json', category=None, on_progress=None, progress_every=5000):
+    # Записи выгружаются потоком, без загрузки всей библиотеки в память
+    count = 0
+    if fmt != 'ndjson':
+        output.write('[')
+    for record in store.iter_records(category):
+        if fmt == 'ndjson':
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            output.write((',\n' if count else '\n') + json.dumps(record, ensure_ascii=False, indent=4))
+        count += 1
+        if on_progress and count % progress_every == 0:
+            on_progress(count)
+    if fmt != 'ndjson':
+        output.write('\n]\n')
+    if on_progress:
+        on_progress(count)
+    return count
+
+class ImportStats:
+    __slots__ = ('read', 'imported', 'replaced', 'renamed', 'duplicates', 'skipped', 'errors', 'started', 'elapsed')
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.replaced = 0
+        self.renamed = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def tick(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__ if name != 'started'}
+        result['rate'] = self.rate
+        return result
+
+    def summary(self):
+        return (f"Прочитано: {self.read}, добавлено: {self.imported}, заменено: {self.replaced}, "
+                f"переименовано: {self.renamed}, дубликатов кода: {self.duplicates}, "
+                f"пропущено: {self.skipped}, ошибок: {self.errors}; "
+                f"{self.elapsed:.1f} с, {self.rate:.0f} записей/с")
+
+class Importer:
+    # Импорт идёт пакетами: каждый пакет проверяется на дубликаты одним запросом
+    # к индексам базы и фиксируется отдельной транзакцией
+    NAME_WINDOW = 4
+
+    def __init__(self, store, conflict='rename', batch_size=2000, on_progress=None):
+        if conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"Неизвестная политика конфликтов: {conflict}")
+        self.store = store
+        self.conflict = conflict
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.cancelled = False
+        self.stats = ImportStats()
+        self.added_categories = []
+
+    def cancel(self):
+        self.cancelled = True
+
+    def normalize(self, data):
+        if not isinstance(data, dict) or not isinstance(data.get('name'), str) or not data['name'].strip():
+            return None
+        record = {
+            'id': data.get('id') if isinstance(data.get('id'), str) and data.get('id') else None,
+            'name': data['name'],
+            'description': data.get('description') or "",
+            'code': data.get('code') or "",
+            'category': data.get('category') or "Без категории",
+            'generated_code': data.get('generated_code') or "",
+        }
+        if not all(isinstance(record[key], str) for key in ('description', 'code', 'category', 'generated_code')):
+            return None
+        record['code_hash'] = code_hash(record['code'])
+        return record
+
+    def reserve_names(self, batch, existing_names):
+        # Занятые в базе варианты "Имя (N)" проверяются общими запросами на пакет: окна вариантов
+        # для всех конфликтующих названий читаются разом и растут, пока свободных не хватит
+        self.checked_names = set()
+        self.taken_names = set()
+        self.next_numbers = {}
+        if self.conflict != 'rename':
+            return
+        counts = Counter(record['name'] for record in batch)
+        needed = {}
+        for name, count in counts.items():
+            renames = count if name in existing_names else count - 1
+            if renames > 0:
+                needed[name] = renames
+        starts = dict.fromkeys(needed, 2)
+        window = 0
+        while needed:
+            windows = {name: [f"{name} ({number})" for number in range(starts[name], starts[name] + renames + window)]
+                       for name, renames in needed.items()}
+            self.check_names([candidate for candidates in windows.values() for candidate in candidates])
+            for name, candidates in windows.items():
+                needed[name] -= sum(candidate not in self.taken_names for candidate in candidates)
+                starts[name] += len(candidates)
+                if needed[name] <= 0:
+                    del needed[name]
+            window = max(window * 4, self.NAME_WINDOW)
+
+    def check_names(self, candidates):
+        self.checked_names.update(candidates)
+        self.taken_names.update(self.store.ids_by_name(candidates))
+
+    def free_name(self, name, taken):
+        # Варианты до последнего выданного уже заняты, поиск продолжается с него
+        number = self.next_numbers.get(name, 2)
+        while True:
+            candidate = f"{name} ({number})"
+            if candidate not in self.checked_names:
+                # Свободные варианты заняты записями пакета: следующая порция одним запросом
+                self.check_names([f"{name} ({n})" for n in range(number, number + self.NAME_WINDOW)])
+            if candidate not in taken and candidate not in self.taken_names:
+                self.next_numbers[name] = number + 1
+                return candidate
+            number += 1
+
+    def process_batch(self, batch):
+        stats = self.stats
+        known_hashes = self.store.existing_code_hashes(record['code_hash'] for record in batch)
+        existing_names = self.store.ids_by_name(record['name'] for record in batch)
+        existing_ids = self.store.existing_ids(record['id'] for record in batch if record['id'])
+        self.reserve_names(batch, existing_names)
+        batch_names = {}
+        records = []
+        for record in batch:
+            # Одинаковый код считается одним и тем же действием независимо от названия
+            if record['code_hash'] is not None:
+                if record['code_hash'] in known_hashes:
+                    stats.duplicates += 1
+                    continue
+                known_hashes.add(record['code_hash'])
+            if record['id'] is None or record['id'] in existing_ids:
+                record['id'] = uuid.uuid4().hex
+            existing_ids.add(record['id'])
+            name = record['name']
+            if name in existing_names or name in batch_names:
+                if self.conflict == 'skip':
+                    stats.skipped += 1
+                    continue
+                if self.conflict == 'rename':
+                    record['name'] = self.free_name(name, batch_names)
+                    stats.renamed += 1
+                elif self.conflict == 'replace':
+                    if name in batch_names:
+                        # Повтор внутри пакета заменяет ранее прочитанную запись
+                        record['id'] = records[batch_names[name]]['id']
+                        records[batch_names[name]] = None
+                        stats.imported -= 1
+                    else:
+                        record['id'] = existing_names[name]
+                    stats.replaced += 1
+            if record['name'] not in batch_names or self.conflict != 'keep':
+                batch_names[record['name']] = len(records)
+            records.append(record)
+            stats.imported += 1
+        records = [record for record in records if record is not None]
+        categories = [category for category in dict.fromkeys(record['category'] for record in records)
+                      if category not in self.known_categories]
+        self.store.insert_records(records, categories)
+        self.known_categories.update(categories)
+        self.added_categories.extend(categories)
+
+    def run(self, items):
+        self.known_categories = set(self.store.load_categories())
+        stats = self.stats
+        batch = []
+        with metrics.span('import_actions'):
+            for data in items:
+                if self.cancelled:
+                    break
+                stats.read += 1
+                record = self.normalize(data)
+                if record is None:
+                    stats.errors += 1
+                    continue
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self.process_batch(batch)
+                    batch = []
+                    stats.tick()
+                    if self.on_progress:
+                        self.on_progress(stats)
+            if batch and not self.cancelled:
+                self.process_batch(batch)
+        stats.tick()
+        if self.on_progress:
+            self.on_progress(stats)
+        metrics.increment('imported_actions', stats.imported)
+        logging.info(f"Import finished: {stats.to_dict()}")
+        return stats
+
+    def import_file(self, path, fmt=None):
+        fmt = fmt or detect_format(path)
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            return self.run(iter_file(f, fmt))
@@ -0,0 +1,123 @@
+import os
+import ast
+import sys
+import logging
+import hashlib
+import textwrap
+import warnings
+
+from .metrics import metrics
+
+CODE_FIELDS = ('code', 'generated_code')
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def check_source(source):
+    # Возвращает None для корректного или пустого фрагмента, иначе текст ошибки;
+    # фрагменты часто скопированы из тела функции, поэтому общий отступ снимается
+    if not source or not source.strip():
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ast.parse(textwrap.dedent(source), '<snippet>')
+    except SyntaxError as e:
+        return f"строка {e.lineno}: {e.msg}" if e.lineno else e.msg
+    except (ValueError, RecursionError, MemoryError) as e:
+        return str(e) or type(e).__name__
+    return None
+
+def check_many(sources):
+    return [check_source(source) for source in sources]
+
+class SnippetValidator:
+    # Результаты проверки кэшируются в базе по хешу текста, поэтому повторный прогон
+    # проверяет только изменившиеся фрагменты; кэш сбрасывается при смене версии Python
+    PROCESS_THRESHOLD = 256
+    CHUNK_SIZE = 64
+
+    def __init__(self, store, workers=None):
+        self.store = store
+        self.workers = workers
+        self.cancelled = False
+        version = '.'.join(map(str, sys.version_info[:2]))
+        if store.get_meta('validation_python') != version:
+            store.clear_snippet_checks()
+            store.set_meta('validation_python', version)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_texts(self, texts):
+        # texts: хеш -> текст; возвращает хеш -> ошибка или None
+        hashes = list(texts)
+        sources = [texts[key] for key in hashes]
+        if len(sources) < self.PROCESS_THRESHOLD or (self.workers or os.cpu_count() or 1) < 2:
+            return dict(zip(hashes, check_many(sources)))
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = [sources[start:start + self.CHUNK_SIZE] for start in range(0, len(sources), self.CHUNK_SIZE)]
+        errors = []
+        # fork из процесса с потоками Qt, записи и наблюдения за базой может унаследовать занятые
+        # блокировки, поэтому рабочие процессы запускаются заново
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for chunk_errors in executor.map(check_many, chunks):
+                errors.extend(chunk_errors)
+        return dict(zip(hashes, errors))
+
+    def validate_rows(self, rows):
+        # rows: (id, code, generated_code); возвращает id -> {поле: ошибка} для сломанных действий
+        row_hashes = []
+        texts = {}
+        for action_id, *sources in rows:
+            hashes = []
+            for source in sources:
+                key = text_hash(source) if source and source.strip() else None
+                if key is not None:
+                    texts[key] = source
+                hashes.append(key)
+            row_hashes.append((action_id, hashes))
+        known = self.store.load_snippet_checks(texts)
+        unknown = {key: text for key, text in texts.items() if key not in known}
+        if unknown:
+            checked = self.check_texts(unknown)
+            self.store.save_snippet_checks(checked.items())
+            known.update(checked)
+        broken = {}
+        for action_id, hashes in row_hashes:
+            errors = {field: known[key] for field, key in zip(CODE_FIELDS, hashes)
+                      if key is not None and known[key] is not None}
+            if errors:
+                broken[action_id] = errors
+        return broken, len(unknown)
+
+    def validate_action(self, action):
+        return self.validate_rows([(action.id, action.code, action.generated_code)])[0].get(action.id)
+
+    @metrics.timed('validate_snippets')
+    def run(self, batch_size=5000, on_progress=None):
+        broken = {}
+        checked = 0
+        total = 0
+        batch = []
+        for row in self.store.iter_code_rows():
+            if self.cancelled:
+                break
+            batch.append(row)
+            if len(batch) >= batch_size:
+                result, fresh = self.validate_rows(batch)
+                broken.update(result)
+                checked += fresh
+                total += len(batch)
+                batch = []
+                if on_progress is not None:
+                    on_progress(total, len(broken))
+        if batch and not self.cancelled:
+            result, fresh = self.validate_rows(batch)
+            broken.update(result)
+            checked += fresh
+            total += len(batch)
+        logging.info(f"Validated {total} actions, rechecked {checked} snippets, broken {len(broken)}")
+        return broken
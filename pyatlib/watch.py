@@ -0,0 +1,40 @@
+import logging
+
+class LibraryWatcher:
+    # Замечает изменения базы, сделанные другими процессами (CLI, второй экземпляр
+    # приложения, импорт скриптом). PRAGMA data_version стоит микросекунды, поэтому
+    # его можно опрашивать по таймеру; список изменений читается, только когда он сдвинулся
+    def __init__(self, store):
+        self.store = store
+        self.data_version = None
+        self.version = 0
+        self.reset()
+
+    def reset(self):
+        # Вызывается перед полной загрузкой библиотеки
+        self.data_version = self.store.data_version()
+        self.version = self.store.library_version()
+
+    def mark_synced(self):
+        # После собственной записи: если чужих транзакций с прошлого опроса не было,
+        # все версии до текущей уже отражены в памяти
+        if self.store.data_version() == self.data_version:
+            self.version = self.store.library_version()
+
+    def poll(self):
+        # Возвращает (изменённые идентификаторы, удалённые идентификаторы, сброс)
+        # или None, если библиотека не менялась
+        data_version = self.store.data_version()
+        if data_version == self.data_version:
+            return None
+        self.data_version = data_version
+        version, changed, deleted = self.store.changed_since(self.version)
+        if version == self.version:
+            # Чужая запись не затронула действия и категории (кэш проверок, настройки)
+            return None
+        reset = version < self.version
+        if reset:
+            logging.info(f"Library version went back from {self.version} to {version}, full reload required")
+        self.version = version
+        deleted = set(deleted).difference(changed)
+        return set(changed), deleted, reset
@@ -0,0 +1,136 @@
+import logging
+
+from .cache import CompletionCache
+from .completion import CompletionBackend, register_backend
+
+COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+MODEL_URI = "gpt://b1gkl7o40oq65tfl3s3j/yandexgpt"
+MAX_TOKENS = 1500
+TEMPERATURE = 0.1
+
+def build_completion_payload(system_prompt, user_code, stream=False, model_uri=MODEL_URI,
+                             max_tokens=MAX_TOKENS, temperature=TEMPERATURE):
+    prompt = f"""{system_prompt}
+
+        {user_code}
+
+        Верни только готовый код без дополнительного текста."""
+
+    return {
+        "messages": [
+            {"text": prompt, "role": "user"}
+        ],
+        "completionOptions": {
+            "stream": stream,
+            "maxTokens": max_tokens,
+            "temperature": temperature
+        },
+        "modelUri": model_uri
+    }
+
+class CodeFormatter:
+    BLOCK_PREFIXES = ('def ', 'class ', 'if ', 'elif ', 'else:', 'for ', 'while ', 'try:', 'except:', 'finally:')
+    CONTINUATION_PREFIXES = ('else:', 'elif ', 'except:', 'finally:')
+    DEDENT_PREFIXES = ('return ', 'break', 'continue', 'pass')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.raw = ""
+        self.consumed = 0
+        self.lines = []
+        self.reported = 0
+        self.indent_level = 0
+        self.blank_pending = False
+
+    def feed(self, text):
+        # Ответ приходит накопительно: обрабатываем только новые завершённые строки
+        if not text.startswith(self.raw[:self.consumed]):
+            self.reset()
+        self.raw = text
+        while True:
+            end = self.raw.find('\n', self.consumed)
+            if end < 0:
+                break
+            self.add_line(self.raw[self.consumed:end])
+            self.consumed = end + 1
+        new_lines = self.lines[self.reported:]
+        self.reported = len(self.lines)
+        tail = self.raw[self.consumed:].strip()
+        if tail.startswith('`'):
+            tail = ""
+        elif tail:
+            tail = f"{'    ' * self.indent_level}{tail}"
+        return new_lines, tail
+
+    def finish(self):
+        if self.consumed < len(self.raw):
+            self.add_line(self.raw[self.consumed:])
+            self.consumed = len(self.raw)
+        self.reported = len(self.lines)
+        return '\n'.join(self.lines)
+
+    def add_line(self, line):
+        stripped_line = line.strip()
+        # Маркеры блока кода ```python и ``` отбрасываются
+        if stripped_line.startswith('```'):
+            return
+        # Множественные пустые строки схлопываются в одну, пустые строки по краям удаляются
+        if not stripped_line:
+            self.blank_pending = bool(self.lines)
+            return
+        if self.blank_pending:
+            self.lines.append("")
+            self.blank_pending = False
+
+        # Исправление отступов
+        if stripped_line.startswith(self.BLOCK_PREFIXES):
+            self.lines.append(f"{'    ' * self.indent_level}{stripped_line}")
+            if not stripped_line.endswith(':'):
+                return
+            if not stripped_line.startswith(self.CONTINUATION_PREFIXES):
+                self.indent_level += 1
+        elif stripped_line.startswith(self.DEDENT_PREFIXES) or stripped_line.startswith(')'):
+            self.indent_level = max(0, self.indent_level - 1)
+            self.lines.append(f"{'    ' * self.indent_level}{stripped_line}")
+        else:
+            self.lines.append(f"{'    ' * self.indent_level}{stripped_line}")
+
+def extract_text(data):
+    return data['result']['alternatives'][0]['message']['text']
+
+def make_headers(token):
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+
+class YandexGPTBackend(CompletionBackend):
+    # Адрес и модель настраиваются, чтобы генерацию можно было направить на заглушку
+    name = 'yandexgpt'
+
+    def __init__(self, token_source, url=None, model_uri=None, max_tokens=MAX_TOKENS, temperature=TEMPERATURE):
+        super().__init__(token_source)
+        self.url = url or COMPLETION_URL
+        self.model_uri = model_uri or MODEL_URI
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def payload(self, system_prompt, user_code, stream=False):
+        return build_completion_payload(system_prompt, user_code, stream, self.model_uri,
+                                        self.max_tokens, self.temperature)
+
+    def cache_key(self, system_prompt, user_code):
+        return CompletionCache.make_key(system_prompt, user_code, self.model_uri, self.temperature, self.max_tokens)
+
+    def send(self, session, system_prompt, user_code, token, stream=False, timeout=(10, 120)):
+        payload = self.payload(system_prompt, user_code, stream)
+        if stream:
+            logging.info(f"Request payload: {payload}")
+        return session.post(self.url, json=payload, headers=make_headers(token), stream=stream, timeout=timeout)
+
+    def extract_text(self, data):
+        return extract_text(data)
+
+register_backend(YandexGPTBackend.name, YandexGPTBackend)